@@ -14,11 +14,15 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# Use the same connection settings as the app
+from app.infra.postgres import Base, DATABASE_URL
+from app.models import user, message, mailbox_usage  # noqa: F401 (register tables)
+
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
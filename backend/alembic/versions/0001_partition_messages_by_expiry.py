@@ -0,0 +1,109 @@
+"""partition messages by expiry day
+
+Moves the plain messages table to a table range-partitioned on expires_at
+(one partition per UTC day) so expired messages can be dropped a partition
+at a time. Unexpired rows are copied over; already expired rows are dropped.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keep in sync with PARTITION_DAYS_AHEAD in app/services/expiry_reaper.py
+DAYS_AHEAD = 10
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. Move the old table out of the way, keeping its id sequence
+    op.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    op.execute("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_messages_recipient_hash RENAME TO ix_messages_unpartitioned_recipient_hash")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+    op.execute("ALTER SEQUENCE messages_id_seq AS BIGINT")
+
+    # 2. Partitioned table (the primary key must include the partition key)
+    op.execute("""
+        CREATE TABLE messages (
+            id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+            recipient_hash BYTEA NOT NULL,
+            sender_id VARCHAR NOT NULL,
+            ciphertext BYTEA NOT NULL,
+            expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE,
+            PRIMARY KEY (id, expires_at)
+        ) PARTITION BY RANGE (expires_at)
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("CREATE INDEX ix_messages_recipient_hash ON messages (recipient_hash)")
+
+    # 3. One partition per day, from today through the horizon (or the latest live row)
+    op.execute(f"""
+        DO $$
+        DECLARE
+            today DATE := (now() AT TIME ZONE 'utc')::date;
+            last_day DATE;
+            day DATE;
+        BEGIN
+            SELECT GREATEST(today + {DAYS_AHEAD}, COALESCE(MAX(expires_at)::date, today))
+            INTO last_day FROM messages_unpartitioned;
+
+            day := today;
+            WHILE day <= last_day LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    'messages_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+                );
+                day := day + 1;
+            END LOOP;
+        END $$
+    """)
+
+    # 4. Copy live rows, drop the old table
+    op.execute("""
+        INSERT INTO messages (id, recipient_hash, sender_id, ciphertext, expires_at, created_at)
+        SELECT id, recipient_hash, sender_id, ciphertext, expires_at, created_at
+        FROM messages_unpartitioned
+        WHERE expires_at > (now() AT TIME ZONE 'utc')
+    """)
+    op.execute("DROP TABLE messages_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+    op.execute("ALTER INDEX ix_messages_recipient_hash RENAME TO ix_messages_partitioned_recipient_hash")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id BIGINT NOT NULL DEFAULT nextval('messages_id_seq') PRIMARY KEY,
+            recipient_hash BYTEA NOT NULL,
+            sender_id VARCHAR NOT NULL,
+            ciphertext BYTEA NOT NULL,
+            expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("CREATE INDEX ix_messages_recipient_hash ON messages (recipient_hash)")
+
+    op.execute("""
+        INSERT INTO messages (id, recipient_hash, sender_id, ciphertext, expires_at, created_at)
+        SELECT id, recipient_hash, sender_id, ciphertext, expires_at, created_at
+        FROM messages_partitioned
+    """)
+    op.execute("DROP TABLE messages_partitioned")
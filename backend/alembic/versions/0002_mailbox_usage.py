@@ -0,0 +1,46 @@
+"""mailbox usage counters
+
+Adds mailbox_usage (pending messages and ciphertext bytes per recipient and
+expiry day), which the mailbox quota checks read instead of scanning the
+mailbox, and fills it from the messages already queued.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'mailbox_usage',
+        sa.Column('recipient_hash', sa.LargeBinary(), nullable=False),
+        sa.Column('expires_on', sa.Date(), nullable=False),
+        sa.Column('pending', sa.Integer(), nullable=False),
+        sa.Column('bytes', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('recipient_hash', 'expires_on')
+    )
+    # Same as app.core.message.rebuild_mailbox_usage
+    op.execute("""
+        INSERT INTO mailbox_usage (recipient_hash, expires_on, pending, bytes)
+        SELECT recipient_hash, expires_at::date, count(*), sum(length(ciphertext))
+        FROM messages
+        GROUP BY recipient_hash, expires_at::date
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('mailbox_usage')
@@ -0,0 +1,79 @@
+# app/api/auth.py
+
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from app.infra.postgres import get_async_db
+from app.core.user import get_public_key_async, hash_user_id
+from app.core.message import hash_recipient
+from app.core.circuit_breaker import identity_rate_limit
+from app.core.security import (
+    verify_pgp_signature_async, VerificationBacklogFull,
+    issue_session_token, SESSION_TOKEN_TTL
+)
+import traceback
+
+router = APIRouter(prefix="/auth")
+
+class SessionRequestSchema(BaseModel):
+    user_id: str
+    signature: str
+    timestamp: str
+
+async def verify_identity(db: AsyncSession, user_id: str, signature: str, timestamp: str) -> bytes:
+    """
+    Check a user_id|timestamp PGP signature against the registered key.
+    Returns the user's public key bytes, raises HTTPException otherwise.
+    """
+    # 1. Get user's public key
+    pub_key_bytes = await get_public_key_async(db, user_id)
+    if not pub_key_bytes:
+        raise HTTPException(status_code=404, detail=f"User not found: {user_id}")
+    # End the read transaction so the connection goes back to the pool during the verify
+    await db.commit()
+
+    # 2. Verify Signature
+    # The data signed is user_id + timestamp
+    signed_data = f"{user_id}|{timestamp}"
+
+    # pub_key_bytes is stored as PGP Armor bytes from our new registration logic
+    pub_key_text = pub_key_bytes.decode('utf-8')
+
+    # PGP verification is CPU-bound, keep it off the event loop
+    try:
+        verified = await verify_pgp_signature_async(
+            pub_key_text, signature, signed_data,
+            user_id_hash=hash_user_id(user_id)
+        )
+    except VerificationBacklogFull:
+        raise HTTPException(status_code=503, detail="Server busy, retry shortly", headers={"Retry-After": "1"})
+    if not verified:
+        print(f"❌ Signature verification failed for: {user_id}")
+        raise HTTPException(status_code=401, detail="Invalid identity signature")
+
+    return pub_key_bytes
+
+@router.post("/session", dependencies=[Depends(identity_rate_limit)])
+async def create_session(payload: SessionRequestSchema, db: AsyncSession = Depends(get_async_db)):
+    """
+    Verify the PGP signature once and return a short-lived token that
+    /messages/receive and /messages/stream accept instead of a signature.
+    The token is tied to the current key: get a new one after re-registering.
+    """
+    try:
+        pub_key_bytes = await verify_identity(db, payload.user_id, payload.signature, payload.timestamp)
+
+        token, expires_at = issue_session_token(hash_user_id(payload.user_id), hash_recipient(pub_key_bytes))
+
+        return {
+            "token": token,
+            "expires_in": SESSION_TOKEN_TTL,
+            "expires_at": datetime.utcfromtimestamp(expires_at).isoformat()
+        }
+    except Exception as e:
+        print(f"❌ ERROR in create_session: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,144 @@
+# app/api/files.py
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from app.core.user import hash_user_id
+from app.core.security import verify_session_token, InvalidSessionToken
+from app.core.circuit_breaker import (
+    enforce_rate_limit, upload_limiter, upload_bytes_limiter, upload_chunk_limiter
+)
+from app.services.file_service import (
+    validate_upload, create_upload, get_upload, expected_chunk_size, put_chunk, upload_status, complete_upload,
+    get_manifest, iter_file, read_chunk,
+    UploadNotFound, FileNotFound, InvalidChunk, UploadIncomplete, DEFAULT_CHUNK_SIZE
+)
+
+router = APIRouter(prefix="/files")
+
+# Upload flow (bodies are client-side encrypted, the server never sees plaintext):
+#   POST /files/uploads                        {"size", "chunk_size"?} -> upload_id
+#   PUT  /files/uploads/{id}/chunks/{index}    raw chunk bytes (any order, in parallel, retried freely)
+#   GET  /files/uploads/{id}                   missing chunk indexes, to resume after a disconnect
+#   POST /files/uploads/{id}/complete          -> file_id
+# Download: GET /files/{file_id} (whole file or ?start_chunk=n), or chunk by chunk.
+# Upload calls need a session token from /auth/session:
+#   X-User-Id: <user_id>    Authorization: Bearer <token>
+# and an upload can only be continued by the user who started it. Uploads are
+# rate-limited per user (sessions, declared bytes and chunk PUTs).
+
+def upload_owner(x_user_id: str | None = Header(None), authorization: str | None = Header(None)) -> str:
+    """The authenticated user's recipient hash (hex), which owns the uploads they start"""
+    scheme, _, token = (authorization or "").partition(" ")
+    if not x_user_id or scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Missing X-User-Id or bearer session token")
+    try:
+        return verify_session_token(token, hash_user_id(x_user_id)).hex()
+    except InvalidSessionToken:
+        raise HTTPException(status_code=401, detail="Invalid or expired session token")
+
+class CreateUploadSchema(BaseModel):
+    size: int
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+
+@router.post("/uploads")
+def start_upload(payload: CreateUploadSchema, request: Request, owner: str = Depends(upload_owner)):
+    try:
+        validate_upload(payload.size, payload.chunk_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The whole declared size is charged now, so abandoned uploads count too
+    enforce_rate_limit(upload_limiter, "upload", request, key=owner)
+    enforce_rate_limit(upload_bytes_limiter, "upload_bytes", request, cost=payload.size, key=owner)
+    return create_upload(owner, payload.size, payload.chunk_size)
+
+@router.put("/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(upload_id: str, index: int, request: Request, owner: str = Depends(upload_owner)):
+    """
+    Body is the chunk itself (application/octet-stream). Optional
+    X-Chunk-SHA256 header is checked against what arrived.
+    """
+    enforce_rate_limit(upload_chunk_limiter, "upload_chunk", request, key=owner)
+    try:
+        meta = await run_in_threadpool(get_upload, upload_id, owner)
+        expected = expected_chunk_size(meta, index)
+
+        # Read at most one chunk; a body that runs over is rejected before it is buffered
+        parts = []
+        received = 0
+        async for piece in request.stream():
+            received += len(piece)
+            if received > expected:
+                raise HTTPException(status_code=413, detail=f"Chunk {index} must be {expected} bytes")
+            parts.append(piece)
+
+        digest = await run_in_threadpool(
+            put_chunk, upload_id, owner, index, b"".join(parts), request.headers.get("X-Chunk-SHA256")
+        )
+        return {"index": index, "sha256": digest}
+
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    except InvalidChunk as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/uploads/{upload_id}")
+def get_upload_status(upload_id: str, owner: str = Depends(upload_owner)):
+    try:
+        return upload_status(upload_id, owner)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+
+@router.post("/uploads/{upload_id}/complete")
+def finish_upload(upload_id: str, owner: str = Depends(upload_owner)):
+    try:
+        manifest = complete_upload(upload_id, owner)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    except UploadIncomplete as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "missing": e.missing})
+
+    print(f"📎 File stored: {manifest['file_id']} ({manifest['size']} bytes, {len(manifest['chunks'])} chunks)")
+    return {"file_id": manifest["file_id"], "size": manifest["size"], "chunks": len(manifest["chunks"])}
+
+@router.get("/{file_id}/manifest")
+def file_manifest(file_id: str):
+    """Chunk size and digests, for clients that download (and verify) chunk by chunk"""
+    try:
+        return get_manifest(file_id)
+    except FileNotFound:
+        raise HTTPException(status_code=404, detail="File not found")
+
+@router.get("/{file_id}/chunks/{index}")
+def download_chunk(file_id: str, index: int):
+    try:
+        data = read_chunk(get_manifest(file_id), index)
+    except FileNotFound:
+        raise HTTPException(status_code=404, detail="File not found")
+    except InvalidChunk as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=data, media_type="application/octet-stream")
+
+@router.get("/{file_id}")
+def download_file(file_id: str, start_chunk: int = 0):
+    """
+    Stream the file from disk/S3 without buffering it. start_chunk resumes an
+    interrupted download at a chunk boundary (offset start_chunk * chunk_size).
+    """
+    try:
+        manifest = get_manifest(file_id)
+    except FileNotFound:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    chunk_count = len(manifest["chunks"])
+    if not 0 <= start_chunk < chunk_count:
+        raise HTTPException(status_code=400, detail=f"start_chunk must be between 0 and {chunk_count - 1}")
+
+    offset = start_chunk * manifest["chunk_size"]
+    return StreamingResponse(
+        iter_file(manifest, start_chunk),
+        media_type="application/octet-stream",
+        headers={"Content-Length": str(manifest["size"] - offset), "X-Chunk-Size": str(manifest["chunk_size"])}
+    )
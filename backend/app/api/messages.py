@@ -1,38 +1,63 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from app.infra.postgres import get_db
-from app.core.message import store_message, fetch_messages
-from app.core.user import get_public_key
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.infra.postgres import get_async_db, AsyncSessionLocal
+from app.core.message import (
+    store_message_async, store_messages_async, fetch_mailbox_async, stream_mailbox_async,
+    hash_recipient, MailboxQuotaExceeded, FETCH_LIMIT_DEFAULT, FETCH_LIMIT_MAX, STREAM_LIMIT_MAX
+)
+from app.core.user import get_public_key_async, get_public_keys_async, hash_user_id
+from app.core.security import verify_session_token, InvalidSessionToken
+from app.core.circuit_breaker import send_rate_limit, receive_rate_limit, enforce_rate_limit, send_limiter
+from app.api.auth import verify_identity
+from app.services.notification_service import mailbox_notifier
+from app.services.ephemeral_store import ephemeral_store
+from app.utils.framing import encode_frames, decode_frames, FrameError, FRAMES_CONTENT_TYPE
+import anyio
+import asyncio
 import traceback
 import base64
+import json
 
 router = APIRouter(prefix="/messages")
 
-@router.post("/send")
-def send_message(payload: dict, db: Session = Depends(get_db)):
+async def _deliver(db: AsyncSession, recipient_id: str, ciphertext_bytes: bytes, sender_id: str, ephemeral: bool = False):
+    """Look up the recipient and store (or buffer, if ephemeral) one message"""
+    # 1. Get recipient's public key (returns bytes from core.user)
+    pub_key = await get_public_key_async(db, recipient_id)
+    if not pub_key:
+        raise HTTPException(status_code=404, detail=f"User not found: {recipient_id}")
+
+    # 2. Store message (an ephemeral one too big to share with the other workers is stored durably)
+    if ephemeral and ephemeral_store.fits(ciphertext_bytes, sender_id):
+        ephemeral_store.put(hash_recipient(pub_key), ciphertext_bytes, sender_id)
+    else:
+        try:
+            await store_message_async(db, pub_key, ciphertext_bytes, sender_id)
+        except MailboxQuotaExceeded:
+            raise HTTPException(status_code=507, detail=f"Recipient mailbox is full: {recipient_id}")
+
+@router.post("/send", dependencies=[Depends(send_rate_limit)])
+async def send_message(payload: dict, db: AsyncSession = Depends(get_async_db)):
     try:
         recipient_id = payload.get("recipient")
         ciphertext = payload.get("ciphertext") or payload.get("encryptedMessage")
         sender_id = payload.get("senderId", "anonymous")
+        # Typing/receipt/ICE signals: keep in memory for a few seconds instead of a DB row
+        ephemeral = bool(payload.get("ephemeral", False))
         
         if not recipient_id or not ciphertext:
             raise HTTPException(status_code=400, detail="Missing recipient or content")
 
-        # 1. Get recipient's public key (returns bytes from core.user)
-        pub_key = get_public_key(db, recipient_id)
-        if not pub_key:
-            raise HTTPException(status_code=404, detail=f"User not found: {recipient_id}")
-
-        # 2. Ensure ciphertext is converted to bytes for the LargeBinary column
+        # Ensure ciphertext is converted to bytes for the LargeBinary column
         if isinstance(ciphertext, str):
             ciphertext_bytes = ciphertext.encode('utf-8')
         else:
             ciphertext_bytes = ciphertext
 
-        # 3. Store message
-        store_message(db, pub_key, ciphertext_bytes, sender_id)
+        await _deliver(db, recipient_id, ciphertext_bytes, sender_id, ephemeral)
         
         return {"status": "sent"}
         
@@ -44,58 +69,425 @@ def send_message(payload: dict, db: Session = Depends(get_db)):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+class BatchItemSchema(BaseModel):
+    recipient: str
+    ciphertext: str
+    senderId: str | None = None
+    ephemeral: bool = False
+
+class SendBatchSchema(BaseModel):
+    items: list[BatchItemSchema]
+    senderId: str = "anonymous"
+
+# Max messages per /messages/send_batch call
+MAX_BATCH_SIZE = 256
+
+async def _deliver_batch(db: AsyncSession, items: list, sender_id: str) -> list:
+    """
+    items are (recipient, ciphertext bytes, senderId or None, ephemeral).
+    Recipients are resolved in one query and all rows go in one INSERT.
+    Returns one result per item, in order.
+    """
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE})")
+
+    # 1. Resolve every recipient at once
+    public_keys = await get_public_keys_async(db, [recipient for recipient, _, _, _ in items])
+
+    # 2. Validate items, keep the storable ones (with their result index)
+    results = []
+    to_store = []
+    positions = []
+    for recipient, ciphertext_bytes, item_sender_id, ephemeral in items:
+        if not recipient or not ciphertext_bytes:
+            results.append({"status": "error", "detail": "Missing recipient or content"})
+            continue
+        pub_key = public_keys.get(recipient)
+        if not pub_key:
+            results.append({"status": "error", "detail": f"User not found: {recipient}"})
+            continue
+        if ephemeral and ephemeral_store.fits(ciphertext_bytes, item_sender_id or sender_id):
+            ephemeral_store.put(hash_recipient(pub_key), ciphertext_bytes, item_sender_id or sender_id)
+        else:
+            to_store.append((pub_key, ciphertext_bytes, item_sender_id))
+            positions.append(len(results))
+        results.append({"status": "sent"})
+
+    # 3. Store everything durable in one transaction; if some mailboxes are
+    #    full, fail their items and store the rest
+    while to_store:
+        try:
+            await store_messages_async(db, to_store, sender_id)
+            break
+        except MailboxQuotaExceeded as e:
+            await db.rollback()
+            keep = []
+            for item, position in zip(to_store, positions):
+                if hash_recipient(item[0]) in e.recipient_hashes:
+                    results[position] = {"status": "error", "detail": f"Recipient mailbox is full: {items[position][0]}"}
+                else:
+                    keep.append((item, position))
+            to_store = [item for item, _ in keep]
+            positions = [position for _, position in keep]
+    return results
+
+def _charge_batch(request: Request, items: list):
+    """A batch costs one send token per item (413 if that is more than the send burst)"""
+    enforce_rate_limit(send_limiter, "send", request, cost=max(1, len(items)))
+
+@router.post("/send_batch")
+async def send_message_batch(request: Request, payload: SendBatchSchema, db: AsyncSession = Depends(get_async_db)):
+    """
+    Send many messages (receipts, reactions, ICE candidates...) in one request.
+    Returns one result per item, in request order.
+    """
+    try:
+        items = [
+            (item.recipient, item.ciphertext.encode('utf-8'), item.senderId, item.ephemeral)
+            for item in payload.items
+        ]
+        _charge_batch(request, items)
+        return {"results": await _deliver_batch(db, items, payload.senderId)}
+
+    except Exception as e:
+        print(f"❌ ERROR in send_message_batch: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
 class ReceiveMessagesSchema(BaseModel):
     user_id: str
-    signature: str
-    timestamp: str
+    signature: str | None = None
+    timestamp: str | None = None
+    # Token from POST /auth/session, used instead of signature/timestamp
+    token: str | None = None
+    # Long-poll: seconds to hold the request open when the mailbox is empty
+    wait: float = 0
+    # Max messages returned; the rest stay queued (see X-More-Pending)
+    limit: int = Field(FETCH_LIMIT_DEFAULT, ge=1, le=FETCH_LIMIT_MAX)
+
+# Upper bound for long-poll waits (keep below client receive timeouts)
+MAX_RECEIVE_WAIT_SECONDS = 30
+
+
+async def _authenticate_receiver(db: AsyncSession, payload: ReceiveMessagesSchema) -> bytes:
+    """Authenticate with a session token or a user_id|timestamp signature; returns the recipient hash"""
+    if payload.token:
+        # One HMAC compare, no key lookup or PGP verify
+        try:
+            return verify_session_token(payload.token, hash_user_id(payload.user_id))
+        except InvalidSessionToken:
+            raise HTTPException(status_code=401, detail="Invalid or expired session token")
+
+    if not payload.signature or not payload.timestamp:
+        raise HTTPException(status_code=401, detail="Missing signature or session token")
+    pub_key_bytes = await verify_identity(db, payload.user_id, payload.signature, payload.timestamp)
+    return hash_recipient(pub_key_bytes)
+
 
-@router.post("/receive")
-def receive_messages_endpoint(payload: ReceiveMessagesSchema, db: Session = Depends(get_db)):
+async def _fetch_mailbox(db: AsyncSession, recipient_hash: bytes, limit: int = FETCH_LIMIT_DEFAULT):
+    """Durable messages followed by buffered ephemeral ones, at most limit in total"""
+    messages, more_pending = await fetch_mailbox_async(db, recipient_hash, limit)
+    if len(messages) < limit:
+        ephemeral, more_ephemeral = ephemeral_store.take(recipient_hash, limit - len(messages))
+        if ephemeral:
+            messages = messages + ephemeral
+        more_pending = more_pending or more_ephemeral
+    elif not more_pending:
+        more_pending = ephemeral_store.has_pending(recipient_hash)
+    return messages, more_pending
+
+
+def _format_message(m, user_id: str) -> dict:
+    """Format one fetched message for JSON"""
+    # We must decode bytes back to string to send in JSON
+    # Using base64 is safest if the ciphertext contains raw binary data
     try:
-        # 1. Get user's public key
-        pub_key_bytes = get_public_key(db, payload.user_id)
-        if not pub_key_bytes:
-            raise HTTPException(status_code=404, detail=f"User not found: {payload.user_id}")
-
-        # 2. Verify Signature
-        # The data signed is user_id + timestamp
-        signed_data = f"{payload.user_id}|{payload.timestamp}"
-        from app.core.security import verify_pgp_signature
-        
-        # pub_key_bytes is stored as PGP Armor bytes from our new registration logic
-        pub_key_text = pub_key_bytes.decode('utf-8')
-        
-        if not verify_pgp_signature(pub_key_text, payload.signature, signed_data):
-            print(f"❌ Signature verification failed for fetch: {payload.user_id}")
-            raise HTTPException(status_code=401, detail="Invalid identity signature")
+        display_text = m.ciphertext.decode('utf-8')
+    except UnicodeDecodeError:
+        display_text = base64.b64encode(m.ciphertext).decode('utf-8')
 
-        # 3. Fetch messages (this also deletes them from DB)
-        # We need the raw bytes for comparison in fetch_messages
-        messages = fetch_messages(db, pub_key_bytes)
-        
-        # 3. Format result for JSON
-        result = []
-        for m in messages:
-            # We must decode bytes back to string to send in JSON
-            # Using base64 is safest if the ciphertext contains raw binary data
-            try:
-                display_text = m.ciphertext.decode('utf-8')
-            except UnicodeDecodeError:
-                display_text = base64.b64encode(m.ciphertext).decode('utf-8')
-
-            result.append({
+    return {
+        "id": m.id,
+        "ciphertext": display_text,
+        "senderId": m.sender_id,
+        "recipientId": user_id,
+        "timestamp": m.created_at.isoformat() if m.created_at else datetime.utcnow().isoformat()
+    }
+
+
+def _format_messages(messages, user_id: str) -> list:
+    """Format fetched messages for JSON"""
+    return [_format_message(m, user_id) for m in messages]
+
+
+async def _receive(db: AsyncSession, payload: ReceiveMessagesSchema):
+    """Authenticate, then fetch (long-polling if asked). Returns (messages, more_pending)."""
+    recipient_hash = await _authenticate_receiver(db, payload)
+
+    # Fetch messages (this also deletes them from DB)
+    wait = min(max(payload.wait, 0), MAX_RECEIVE_WAIT_SECONDS)
+    if wait <= 0:
+        return await _fetch_mailbox(db, recipient_hash, payload.limit)
+
+    # Subscribe before the first fetch so a message stored in between still wakes us.
+    # The session has committed after each fetch, so no connection is held while waiting.
+    waiter = mailbox_notifier.subscribe(recipient_hash)
+    try:
+        deadline = asyncio.get_running_loop().time() + wait
+        messages, more_pending = await _fetch_mailbox(db, recipient_hash, payload.limit)
+        # A wakeup can find nothing (another receiver was faster, or the LISTEN
+        # bridge re-announcing a mailbox), so keep waiting until the deadline
+        while not messages:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0 or not await waiter.wait(remaining):
+                break
+            waiter.event.clear()
+            messages, more_pending = await _fetch_mailbox(db, recipient_hash, payload.limit)
+        return messages, more_pending
+    finally:
+        mailbox_notifier.unsubscribe(waiter)
+
+
+@router.post("/receive", dependencies=[Depends(receive_rate_limit)])
+async def receive_messages_endpoint(
+    payload: ReceiveMessagesSchema,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Returns the JSON list of messages. The X-More-Pending response header is
+    "true" when the limit was hit and more messages are queued; clients
+    should call again right away instead of waiting for their next poll.
+    """
+    try:
+        messages, more_pending = await _receive(db, payload)
+
+        # The body stays a plain list for existing clients
+        response.headers["X-More-Pending"] = "true" if more_pending else "false"
+        return _format_messages(messages, payload.user_id)
+
+    except Exception as e:
+        print(f"❌ ERROR in receive_messages: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class ReceiveStreamSchema(BaseModel):
+    user_id: str
+    signature: str | None = None
+    timestamp: str | None = None
+    token: str | None = None
+    # Max messages streamed in one response
+    limit: int = Field(STREAM_LIMIT_MAX, ge=1, le=STREAM_LIMIT_MAX)
+
+
+@router.post("/receive/stream", dependencies=[Depends(receive_rate_limit)])
+async def receive_messages_stream(payload: ReceiveStreamSchema, db: AsyncSession = Depends(get_async_db)):
+    """
+    For large backlogs: newline-delimited JSON, one message per line in the
+    /messages/receive format, claimed from the database one batch at a time.
+    The last line is {"more_pending": bool}. Each batch is deleted once it has
+    been written; if the connection drops midway, the batch being written and
+    everything after it stay queued.
+    """
+    try:
+        recipient_hash = await _authenticate_receiver(db, payload)
+    except Exception as e:
+        print(f"❌ ERROR in receive_messages_stream: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def lines():
+        # Own session: the request's get_async_db session is closed before the body is streamed
+        sent = 0
+        status = {}
+        stream_db = AsyncSessionLocal()
+        rows = stream_mailbox_async(stream_db, recipient_hash, payload.limit, status)
+        try:
+            async for m in rows:
+                yield json.dumps(_format_message(m, payload.user_id)) + "\n"
+                sent += 1
+        finally:
+            # A dropped client cancels this generator. Shield the cleanup so the
+            # current batch's rollback completes and its row locks are released now.
+            with anyio.CancelScope(shield=True):
+                await rows.aclose()
+                await stream_db.close()
+        # Same rules as _fetch_mailbox
+        more_pending = status["more_pending"]
+        if sent < payload.limit:
+            ephemeral, more_ephemeral = ephemeral_store.take(recipient_hash, payload.limit - sent)
+            for m in ephemeral:
+                yield json.dumps(_format_message(m, payload.user_id)) + "\n"
+            more_pending = more_pending or more_ephemeral
+        elif not more_pending:
+            more_pending = ephemeral_store.has_pending(recipient_hash)
+        yield json.dumps({"more_pending": more_pending}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# =========================
+# BINARY TRANSPORT
+# =========================
+
+# Same operations as above, but ciphertexts travel as raw bytes instead of
+# UTF-8/base64 strings inside JSON. Message lists use the length-prefixed
+# frames from app.utils.framing.
+
+@router.post("/send/raw", dependencies=[Depends(send_rate_limit)])
+async def send_message_raw(
+    request: Request,
+    recipient: str,
+    senderId: str = "anonymous",
+    ephemeral: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Body is the ciphertext itself (application/octet-stream); metadata goes in the query string"""
+    try:
+        ciphertext_bytes = await request.body()
+        if not recipient or not ciphertext_bytes:
+            raise HTTPException(status_code=400, detail="Missing recipient or content")
+
+        await _deliver(db, recipient, ciphertext_bytes, senderId, ephemeral)
+
+        return {"status": "sent"}
+
+    except Exception as e:
+        print(f"❌ ERROR in send_message_raw: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/send_batch/raw")
+async def send_message_batch_raw(
+    request: Request,
+    senderId: str = "anonymous",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Body is a sequence of frames: header {"recipient", "senderId"?, "ephemeral"?},
+    body the ciphertext. Returns one JSON result per frame, in order.
+    """
+    try:
+        try:
+            frames = decode_frames(await request.body())
+        except FrameError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        items = [
+            (header.get("recipient"), body, header.get("senderId"), bool(header.get("ephemeral", False)))
+            for header, body in frames
+        ]
+        _charge_batch(request, items)
+        return {"results": await _deliver_batch(db, items, senderId)}
+
+    except Exception as e:
+        print(f"❌ ERROR in send_message_batch_raw: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/receive/raw", dependencies=[Depends(receive_rate_limit)])
+async def receive_messages_raw(payload: ReceiveMessagesSchema, db: AsyncSession = Depends(get_async_db)):
+    """
+    Same request as /messages/receive. The response is one frame per message:
+    header {"id", "senderId", "recipientId", "timestamp"}, body the stored
+    ciphertext bytes exactly as sent. X-More-Pending works the same way.
+    """
+    try:
+        messages, more_pending = await _receive(db, payload)
+
+        content = encode_frames(
+            ({
                 "id": m.id,
-                "ciphertext": display_text,
                 "senderId": m.sender_id,
                 "recipientId": payload.user_id,
                 "timestamp": m.created_at.isoformat() if m.created_at else datetime.utcnow().isoformat()
-            })
-        
-        return result
-        
+            }, m.ciphertext)
+            for m in messages
+        )
+        return Response(
+            content=content,
+            media_type=FRAMES_CONTENT_TYPE,
+            headers={"X-More-Pending": "true" if more_pending else "false"}
+        )
+
     except Exception as e:
-        print(f"❌ ERROR in receive_messages: {str(e)}")
+        print(f"❌ ERROR in receive_messages_raw: {str(e)}")
         print(traceback.format_exc())
         if isinstance(e, HTTPException):
             raise e
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# =========================
+# PUSH DELIVERY
+# =========================
+
+# Re-check the mailbox this often even without a wakeup (missed NOTIFY safety net)
+STREAM_RECHECK_SECONDS = 30
+
+
+@router.websocket("/stream")
+async def stream_messages(websocket: WebSocket):
+    """
+    Push delivery. The first frame is the same JSON as /messages/receive
+    (user_id plus signature/timestamp or token); after that the server sends a JSON list
+    of messages, in the /messages/receive format, whenever the mailbox fills.
+    """
+    await websocket.accept()
+    try:
+        payload = ReceiveMessagesSchema(**await websocket.receive_json())
+        async with AsyncSessionLocal() as db:
+            recipient_hash = await _authenticate_receiver(db, payload)
+    except WebSocketDisconnect:
+        return
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    except Exception as e:
+        print(f"❌ ERROR in stream_messages auth: {str(e)}")
+        await websocket.close(code=1008, reason="Invalid authentication frame")
+        return
+
+    waiter = mailbox_notifier.subscribe(recipient_hash)
+
+    async def watch_disconnect():
+        # Clients don't send anything after auth; this only returns on disconnect
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            waiter.event.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await websocket.send_json({"status": "subscribed"})
+        while not watcher.done():
+            waiter.event.clear()
+            # Short-lived session per check so an idle stream holds no connection
+            async with AsyncSessionLocal() as db:
+                messages, more_pending = await _fetch_mailbox(db, recipient_hash)
+            if messages:
+                await websocket.send_json(_format_messages(messages, payload.user_id))
+            if not more_pending:
+                await waiter.wait(STREAM_RECHECK_SECONDS)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ ERROR in stream_messages: {str(e)}")
+        print(traceback.format_exc())
+    finally:
+        mailbox_notifier.unsubscribe(waiter)
+        watcher.cancel()
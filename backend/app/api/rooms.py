@@ -1,18 +1,11 @@
 # app/api/rooms.py
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from app.infra.postgres import get_db
-import hashlib
+from app.services.room_store import get_room_store, RoomNotFound, RoomUserMismatch, RoomExists
 
 router = APIRouter(prefix="/rooms")
 
-# In-memory storage for simplicity (use database in production)
-_rooms = {}
-# Track active room per user
-_user_active_rooms = {}
-
 class CreateRoomSchema(BaseModel):
     user1_id: str
     user2_id: str
@@ -31,28 +24,17 @@ class DeleteRoomSchema(BaseModel):
 def create_room(payload: CreateRoomSchema):
     """Create a new chat room"""
     
-    # DELETE PREVIOUS ROOM if user has one
-    if payload.user1_id in _user_active_rooms:
-        old_room_code = _user_active_rooms[payload.user1_id]
-        print(f"🗑️ Deleting previous room for user {payload.user1_id}: {old_room_code}")
-        
-        # Remove old room
-        if old_room_code in _rooms:
-            del _rooms[old_room_code]
-        
-        # Note: The PROTOCOL_USER_LEFT_ROOM signal will be sent via messages API
-    
-    # Create new room
+    # Create new room, DELETING PREVIOUS ROOM if user has one
     room_key = f"{payload.room_code}"
-    
-    _rooms[room_key] = {
-        'code': payload.room_code,
-        'user1_id': payload.user1_id,
-        'user2_id': payload.user2_id,
-    }
-    
-    # Track active room for this user
-    _user_active_rooms[payload.user1_id] = room_key
+    try:
+        _, old_room_code = get_room_store().create_room(room_key, payload.user1_id, payload.user2_id)
+    except RoomExists:
+        print(f"❌ Room code already in use: {room_key}")
+        raise HTTPException(status_code=409, detail="Room code already in use")
+
+    if old_room_code is not None:
+        print(f"🗑️ Deleted previous room for user {payload.user1_id}: {old_room_code}")
+        # Note: The PROTOCOL_USER_LEFT_ROOM signal will be sent via messages API
     
     print(f"✅ Room created: {room_key}, Users: {payload.user1_id} <-> {payload.user2_id}")
     
@@ -63,31 +45,18 @@ def join_room(payload: JoinRoomSchema):
     """Join an existing room with code"""
     room_key = f"{payload.room_code.upper()}"
     
-    # Check if room exists
-    if room_key not in _rooms:
+    # Check room exists and users match, DELETE PREVIOUS ROOM for user2 if they have one
+    try:
+        room, old_room_code = get_room_store().join_room(room_key, payload.user1_id, payload.user2_id)
+    except RoomNotFound:
         print(f"❌ Room not found: {room_key}")
         raise HTTPException(status_code=404, detail="Room not found or has been deleted")
-    
-    room = _rooms[room_key]
-    
-    # Check if users match
-    users_in_room = {room['user1_id'], room['user2_id']}
-    provided_users = {payload.user1_id, payload.user2_id}
-    
-    if users_in_room != provided_users:
-        print(f"❌ User mismatch. Room has: {users_in_room}, Provided: {provided_users}")
+    except RoomUserMismatch as e:
+        print(f"❌ User mismatch. Room has: {e.room_users}, Provided: {e.provided_users}")
         raise HTTPException(status_code=403, detail="Invalid users for this room")
-    
-    # DELETE PREVIOUS ROOM for user2 if they have one
-    if payload.user2_id in _user_active_rooms:
-        old_room_code = _user_active_rooms[payload.user2_id]
-        if old_room_code != room_key:  # Don't delete if it's the same room
-            print(f"🗑️ Deleting previous room for user {payload.user2_id}: {old_room_code}")
-            if old_room_code in _rooms:
-                del _rooms[old_room_code]
-    
-    # Track active room for this user
-    _user_active_rooms[payload.user2_id] = room_key
+
+    if old_room_code is not None:
+        print(f"🗑️ Deleted previous room for user {payload.user2_id}: {old_room_code}")
     
     print(f"✅ User joined room: {room_key}")
     
@@ -101,17 +70,11 @@ def delete_room(room_code: str, user_id: str):
     """Delete a room (called when user creates new room)"""
     room_key = room_code.upper()
     
-    if room_key not in _rooms:
+    # Removes the room and the user's active-room pointer to it
+    if not get_room_store().delete_room(room_key, user_id):
         print(f"⚠️ Room already deleted: {room_key}")
         return {"status": "already_deleted"}
     
-    # Remove room
-    del _rooms[room_key]
-    
-    # Remove from user's active rooms
-    if user_id in _user_active_rooms and _user_active_rooms[user_id] == room_key:
-        del _user_active_rooms[user_id]
-    
     print(f"🗑️ Room deleted: {room_key}")
     
     return {"status": "deleted", "room_code": room_code}
@@ -1,10 +1,12 @@
 # app/api/users.py
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from app.infra.postgres import get_db
-from app.core.user import register_user, get_public_key
+from app.infra.postgres import get_async_db
+from app.core.user import register_user_async, get_public_key_async, hash_user_id
+from app.core.security import verify_pgp_signature_async, VerificationBacklogFull
+from app.core.circuit_breaker import public_key_rate_limit, identity_rate_limit
 import base64
 import traceback
 
@@ -16,17 +18,22 @@ class RegisterUserSchema(BaseModel):
     signature: str
     timestamp: str
 
-@router.post("/register")
-def register_user_endpoint(payload: RegisterUserSchema, db: Session = Depends(get_db)):
+@router.post("/register", dependencies=[Depends(identity_rate_limit)])
+async def register_user_endpoint(payload: RegisterUserSchema, db: AsyncSession = Depends(get_async_db)):
     try:
         print(f"📥 Received registration for user: {payload.user_id}")
         
         # 1. Verify Signature
         # The data signed should be user_id + timestamp to prevent reuse
         signed_data = f"{payload.user_id}|{payload.timestamp}"
-        from app.core.security import verify_pgp_signature
-        
-        if not verify_pgp_signature(payload.public_key, payload.signature, signed_data):
+        try:
+            verified = await verify_pgp_signature_async(
+                payload.public_key, payload.signature, signed_data,
+                user_id_hash=hash_user_id(payload.user_id)
+            )
+        except VerificationBacklogFull:
+            raise HTTPException(status_code=503, detail="Server busy, retry shortly", headers={"Retry-After": "1"})
+        if not verified:
             print(f"❌ Signature verification failed for {payload.user_id}")
             raise HTTPException(status_code=401, detail="Invalid identity signature")
 
@@ -36,7 +43,7 @@ def register_user_endpoint(payload: RegisterUserSchema, db: Session = Depends(ge
         public_key_bytes = payload.public_key.encode('utf-8')
         
         # Register user
-        register_user(db, payload.user_id, public_key_bytes)
+        await register_user_async(db, payload.user_id, public_key_bytes)
         print(f"✅ User {payload.user_id} registered successfully")
         
         return {"status": "registered", "user_id": payload.user_id}
@@ -47,9 +54,9 @@ def register_user_endpoint(payload: RegisterUserSchema, db: Session = Depends(ge
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/{user_id}/public-key")
-def get_user_public_key(user_id: str, db: Session = Depends(get_db)):
-    public_key = get_public_key(db, user_id)
+@router.get("/{user_id}/public-key", dependencies=[Depends(public_key_rate_limit)])
+async def get_user_public_key(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    public_key = await get_public_key_async(db, user_id)
     if public_key is None:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -4,10 +4,14 @@ import requests
 import os
 import time
 import random
+import base64
+import pgpy
+from pgpy.constants import PubKeyAlgorithm, KeyFlags, HashAlgorithm, EllipticCurveOID
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from app.core.crypto import VaultCryptoContext
+from app.utils.framing import decode_frames
 
 # =========================
 # CONFIGURATION
@@ -19,9 +23,12 @@ TOR_PROXY = {
 }
 
 SERVER_URL = "http://127.0.0.1:8000"  # change to .onion for Tor backend
-PADDED_MESSAGE_SIZE = 64 * 1024       # 64 KB fixed message size for metadata obfuscation
+PADDED_MESSAGE_SIZE = 64 * 1024       # 64 KB message size for the "fixed" padding scheme
+PADDING_SCHEME = "padme"              # "fixed", "pow2" or "padme" (see padded_size)
+MIN_PADDED_SIZE = 256                 # smallest bucket, so short messages all look alike
 MIN_DELAY_MS = 100                     # minimum random delay
 MAX_DELAY_MS = 2000                    # maximum random delay
+TOKEN_REFRESH_MARGIN = 30              # renew the session token this many seconds early
 
 # =========================
 # TOR SESSION
@@ -33,24 +40,139 @@ def create_tor_session():
     session.proxies = TOR_PROXY
     return session
 
+def generate_identity_key(user_id: str) -> pgpy.PGPKey:
+    """Ed25519 PGP key for registering and signing in (fast to generate, cheap to verify)"""
+    key = pgpy.PGPKey.new(PubKeyAlgorithm.EdDSA, EllipticCurveOID.Ed25519)
+    key.add_uid(pgpy.PGPUID.new(user_id), usage={KeyFlags.Sign}, hashes=[HashAlgorithm.SHA256])
+    return key
+
+def signed_identity(identity_key: pgpy.PGPKey, user_id: str) -> dict:
+    """user_id + a signature over "user_id|timestamp", as /users/register and /auth/session expect"""
+    timestamp = str(int(time.time() * 1000))
+    signature = identity_key.sign(f"{user_id}|{timestamp}")
+    return {"user_id": user_id, "signature": str(signature), "timestamp": timestamp}
+
+def decode_payload(stored) -> bytes:
+    """
+    Payload bytes from a received message, whichever way it was sent:
+    JSON senders hex-encode, binary senders post raw bytes (which JSON
+    receivers get back as base64).
+    """
+    if isinstance(stored, bytes):
+        try:
+            return bytes.fromhex(stored.decode('ascii'))
+        except (UnicodeDecodeError, ValueError):
+            return stored
+    try:
+        return bytes.fromhex(stored)
+    except ValueError:
+        return base64.b64decode(stored)
+
 # =========================
 # METADATA OBFUSCATION
 # =========================
 
-def pad_message(message_bytes: bytes) -> bytes:
-    """Pad message to fixed size to prevent length-based analysis"""
+def padded_size(length: int, scheme: str = PADDING_SCHEME) -> int:
+    """
+    Size on the wire for a message of `length` bytes (4-byte length prefix included).
+      fixed: always PADDED_MESSAGE_SIZE
+      pow2:  next power of two; at most 2x overhead, reveals log2 of the length
+      padme: Padmé buckets; at most ~12% overhead, reveals O(log log) bits of the length
+    pow2 and padme never go below MIN_PADDED_SIZE.
+    """
+    total = length + 4
+    if scheme == "fixed":
+        if total > PADDED_MESSAGE_SIZE:
+            raise ValueError("Message too large")
+        return PADDED_MESSAGE_SIZE
+    total = max(total, MIN_PADDED_SIZE)
+    if scheme == "pow2":
+        return 1 << (total - 1).bit_length()
+    if scheme == "padme":
+        # Keep the top floor(log2(E)) + 1 bits of the length, round the rest up
+        exponent = total.bit_length() - 1
+        mantissa_bits = exponent.bit_length()
+        mask = (1 << (exponent - mantissa_bits)) - 1
+        return (total + mask) & ~mask
+    raise ValueError(f"Unknown padding scheme: {scheme}")
+
+def pad_message(message_bytes: bytes, scheme: str = PADDING_SCHEME) -> bytes:
+    """Pad message to its bucket size to prevent length-based analysis"""
     actual_length = len(message_bytes)
-    if actual_length > PADDED_MESSAGE_SIZE - 4:
-        raise ValueError("Message too large")
+    size = padded_size(actual_length, scheme)
     length_prefix = actual_length.to_bytes(4, 'big')
-    padding = os.urandom(PADDED_MESSAGE_SIZE - 4 - actual_length)
+    padding = os.urandom(size - 4 - actual_length)
     return length_prefix + message_bytes + padding
 
 def unpad_message(padded_bytes: bytes) -> bytes:
-    """Extract original message from padded data"""
+    """Extract original message from padded data (any scheme)"""
+    if len(padded_bytes) < 4:
+        raise ValueError("Padded message too short")
     length = int.from_bytes(padded_bytes[:4], 'big')
+    if length > len(padded_bytes) - 4:
+        raise ValueError("Invalid padding length prefix")
     return padded_bytes[4:4+length]
 
+def try_unpad_message(payload: bytes) -> bytes:
+    """unpad_message, but a payload without a valid prefix (unpadded sender) comes back as is"""
+    try:
+        return unpad_message(payload)
+    except ValueError:
+        return payload
+
+def open_messages(crypto: VaultCryptoContext, items: list, padded: bool = True) -> list:
+    """
+    Unpad and decrypt (sender_pub_bytes, payload) pairs. Each slot holds the
+    plaintext string, or the exception for that item (bad tag, not UTF-8...),
+    so one bad message never costs the rest of an already-deleted backlog.
+    """
+    payloads = [try_unpad_message(payload) if padded else payload for _, payload in items]
+    results = crypto.decrypt_many(
+        [(pub, payload) for (pub, _), payload in zip(items, payloads)], return_exceptions=True
+    )
+    opened = []
+    for (pub, original), payload, result in zip(items, payloads, results):
+        if isinstance(result, Exception) and len(payload) != len(original):
+            # An unpadded payload whose first bytes happened to look like a length prefix
+            try:
+                result = crypto.decrypt(pub, original)
+            except Exception:
+                pass
+        if not isinstance(result, Exception):
+            try:
+                result = result.decode()
+            except UnicodeDecodeError as e:
+                result = e
+        opened.append(result)
+    return opened
+
+def message_result(sender: str, opened) -> dict:
+    """
+    {"sender", "message"} for a decrypted item, {"sender", "error"} for a
+    failed one, or for None (no key for that sender)
+    """
+    if opened is None:
+        return {"sender": sender, "error": "unknown sender"}
+    if isinstance(opened, Exception):
+        return {"sender": sender, "error": str(opened) or type(opened).__name__}
+    return {"sender": sender, "message": opened}
+
+def known_sender_items(messages: list, sender_pub_bytes_dict: dict) -> list:
+    """(sender key, payload) for every (sender, payload) whose sender has a key"""
+    return [(sender_pub_bytes_dict[sender], payload) for sender, payload in messages if sender in sender_pub_bytes_dict]
+
+def message_results(messages: list, sender_pub_bytes_dict: dict, opened: list) -> list:
+    """
+    One result per received message, in order. opened holds the results for
+    known_sender_items; the server has already deleted what it returned, so
+    messages from unknown senders are reported rather than dropped.
+    """
+    opened = iter(opened)
+    return [
+        message_result(sender, next(opened) if sender in sender_pub_bytes_dict else None)
+        for sender, _ in messages
+    ]
+
 def random_delay(min_ms=MIN_DELAY_MS, max_ms=MAX_DELAY_MS):
     """Random delay to prevent timing analysis"""
     time.sleep(random.uniform(min_ms / 1000, max_ms / 1000))
@@ -76,66 +198,81 @@ def derive_session_key(private_key: x25519.X25519PrivateKey,
 # =========================
 
 class AnonymousVaultClient:
-    def __init__(self, user_id: str, use_tor=True, enable_padding=True, enable_delays=True):
+    def __init__(self, user_id: str, use_tor=True, enable_padding=True, enable_delays=True, binary_transport=False,
+                 padding_scheme=PADDING_SCHEME, identity_key: pgpy.PGPKey | None = None):
         self.user_id = user_id
         self.use_tor = use_tor
         self.enable_padding = enable_padding
+        self.padding_scheme = padding_scheme
         self.enable_delays = enable_delays
+        # Send/receive raw ciphertext bytes instead of hex inside JSON (half the bytes on the wire)
+        self.binary_transport = binary_transport
 
-        # Generate ephemeral key pair
+        # PGP identity (server auth) and ephemeral X25519 key pair (message encryption)
+        self.identity_key = identity_key or generate_identity_key(user_id)
+        self._token = None
+        self._token_expires = 0.0
         self.private_key = x25519.X25519PrivateKey.generate()
         self.public_key = self.private_key.public_key()
 
         # Session for HTTP requests
         self.session = create_tor_session() if use_tor else requests.Session()
-        self.session_keys = {}  # cache session keys
+        # Caches one AES-GCM key per peer (bounded LRU)
+        self.crypto = VaultCryptoContext(self.private_key, info=b"vault-chat")
 
         # Register public key on server
         self.register_public_key()
 
     def register_public_key(self):
-        """Send public key to the server"""
-        from cryptography.hazmat.primitives import serialization
-        pub_bytes = self.public_key.public_bytes(
-            encoding=serialization.Encoding.Raw,
-            format=serialization.PublicFormat.Raw
-        )
-        resp = self.session.post(f"{SERVER_URL}/users/{self.user_id}",
-                                 json={"public_key": pub_bytes.hex()})
+        """Register the PGP identity key with the server"""
+        resp = self.session.post(f"{SERVER_URL}/users/register", json={
+            **signed_identity(self.identity_key, self.user_id),
+            "public_key": str(self.identity_key.pubkey)
+        })
         if resp.status_code == 200:
             print(f"✅ Public key registered for {self.user_id}")
         else:
             print(f"❌ Registration failed: {resp.text}")
 
+    def session_token(self) -> str:
+        """Current /auth/session token, renewed shortly before it expires"""
+        if self._token is None or time.monotonic() >= self._token_expires:
+            resp = self.session.post(f"{SERVER_URL}/auth/session",
+                                     json=signed_identity(self.identity_key, self.user_id))
+            resp.raise_for_status()
+            body = resp.json()
+            self._token = body["token"]
+            self._token_expires = time.monotonic() + body["expires_in"] - TOKEN_REFRESH_MARGIN
+        return self._token
+
     def get_session_key(self, recipient_id: str, recipient_pub_bytes: bytes) -> bytes:
-        """Get or derive AES key for a recipient"""
-        if recipient_id not in self.session_keys:
-            key = derive_session_key(self.private_key, recipient_pub_bytes)
-            self.session_keys[recipient_id] = key
-        return self.session_keys[recipient_id]
+        """Derive the AES key for a recipient (messages use the cached context instead)"""
+        return self.crypto.shared_key(recipient_pub_bytes)
 
     def send_message(self, recipient_id: str, recipient_pub_bytes: bytes, message: str):
         """Encrypt and send message to recipient anonymously"""
-        key = self.get_session_key(recipient_id, recipient_pub_bytes)
-
-        # Encrypt using AES-GCM
-        aesgcm = AESGCM(key)
-        nonce = os.urandom(12)
-        ciphertext = aesgcm.encrypt(nonce, message.encode(), None)
-        payload = nonce + ciphertext
+        # Encrypt using AES-GCM: nonce + ciphertext + tag
+        payload = self.crypto.encrypt(recipient_pub_bytes, message.encode())
 
         # Padding
         if self.enable_padding:
-            payload = pad_message(payload)
+            payload = pad_message(payload, self.padding_scheme)
 
         # Random delay
         if self.enable_delays:
             random_delay()
 
-        # POST encrypted payload (no sender info!)
-        resp = self.session.post(f"{SERVER_URL}/messages/send",
-                                 json={"recipient": recipient_id,
-                                       "ciphertext": payload.hex()})
+        # POST encrypted payload; senderId lets the recipient pick our key to decrypt it
+        if self.binary_transport:
+            resp = self.session.post(f"{SERVER_URL}/messages/send/raw",
+                                     params={"recipient": recipient_id, "senderId": self.user_id},
+                                     data=payload,
+                                     headers={"Content-Type": "application/octet-stream"})
+        else:
+            resp = self.session.post(f"{SERVER_URL}/messages/send",
+                                     json={"recipient": recipient_id,
+                                           "ciphertext": payload.hex(),
+                                           "senderId": self.user_id})
         if resp.status_code == 200:
             print(f"✅ Message sent to {recipient_id}")
         else:
@@ -143,28 +280,28 @@ class AnonymousVaultClient:
         return resp.json()
 
     def fetch_messages(self, sender_pub_bytes_dict: dict):
-        """Fetch and decrypt messages for this client"""
-        resp = self.session.get(f"{SERVER_URL}/messages/{self.user_id}")
+        """
+        Fetch and decrypt messages for this client. Every fetched message gets
+        a result: {"sender", "message"}, or {"sender", "error"} if it can't be
+        decrypted or its sender is missing in sender_pub_bytes_dict.
+        """
+        body = {"user_id": self.user_id, "token": self.session_token()}
+        path = "/messages/receive/raw" if self.binary_transport else "/messages/receive"
+        resp = self.session.post(f"{SERVER_URL}{path}", json=body)
         if resp.status_code != 200:
-            return []
+            print(f"❌ Failed to fetch messages: {resp.status_code} {resp.text}")
+            resp.raise_for_status()
 
-        messages = resp.json()
-        decrypted = []
-
-        for msg in messages:
-            recipient_key = self.get_session_key(msg['sender'], sender_pub_bytes_dict[msg['sender']])
-            payload = bytes.fromhex(msg['ciphertext'])
-
-            if self.enable_padding and len(payload) == PADDED_MESSAGE_SIZE:
-                payload = unpad_message(payload)
-
-            aesgcm = AESGCM(recipient_key)
-            nonce = payload[:12]
-            ciphertext = payload[12:]
-            plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-            decrypted.append({"sender": msg['sender'], "message": plaintext.decode()})
-
-        return decrypted
+        if self.binary_transport:
+            # Frames carry the raw payload, no hex decoding needed
+            messages = [(header['senderId'], decode_payload(data)) for header, data in decode_frames(resp.content)]
+        else:
+            messages = [(msg['senderId'], decode_payload(msg['ciphertext'])) for msg in resp.json()]
+        # Every scheme uses the same length prefix, so the sender's scheme doesn't matter;
+        # senders that don't pad are passed through. Large backlogs are decrypted across
+        # threads, and a message that fails comes back with an "error" instead of a "message".
+        opened = open_messages(self.crypto, known_sender_items(messages, sender_pub_bytes_dict), self.enable_padding)
+        return message_results(messages, sender_pub_bytes_dict, opened)
 
 # =========================
 # DEMO USAGE
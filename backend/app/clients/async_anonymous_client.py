@@ -0,0 +1,210 @@
+# app/clients/async_anonymous_client.py
+
+import time
+import random
+import asyncio
+import httpx
+import pgpy
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+from app.clients.anonymous_client import (
+    SERVER_URL, MIN_DELAY_MS, MAX_DELAY_MS, PADDING_SCHEME, TOKEN_REFRESH_MARGIN,
+    pad_message, open_messages, known_sender_items, message_results,
+    generate_identity_key, signed_identity, decode_payload
+)
+from app.core.crypto import VaultCryptoContext, PARALLEL_MIN_ITEMS
+from app.utils.framing import decode_frames
+
+# =========================
+# CONFIGURATION
+# =========================
+
+TOR_PROXY_URL = "socks5://127.0.0.1:9050"  # needs httpx[socks]
+MAX_CONNECTIONS = 100                       # per shared transport
+REQUEST_TIMEOUT = 30.0                      # seconds, on top of any long-poll wait
+KEEPALIVE_EXPIRY = 4.0                      # below uvicorn's 5s keep-alive, so we never reuse a closed socket
+
+# =========================
+# TRANSPORT
+# =========================
+
+def create_http_client(server_url=SERVER_URL, use_tor=False, max_connections=MAX_CONNECTIONS) -> httpx.AsyncClient:
+    """
+    Pooled HTTP/1.1 keep-alive transport. Share one between many clients so
+    thousands of simulated users reuse a bounded set of connections.
+    """
+    return httpx.AsyncClient(
+        base_url=server_url,
+        proxy=TOR_PROXY_URL if use_tor else None,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        timeout=REQUEST_TIMEOUT
+    )
+
+async def random_delay(min_ms=MIN_DELAY_MS, max_ms=MAX_DELAY_MS):
+    """Random delay to prevent timing analysis, without blocking the event loop"""
+    await asyncio.sleep(random.uniform(min_ms / 1000, max_ms / 1000))
+
+# =========================
+# ASYNC ANONYMOUS VAULT CLIENT
+# =========================
+
+class AsyncAnonymousVaultClient:
+    """
+    asyncio counterpart of AnonymousVaultClient with the same padding and
+    AES-GCM/X25519 crypto. Any number of sends and fetches can be in flight
+    at once; use as `async with AsyncAnonymousVaultClient(...) as client`.
+
+    Talks to the current API: PGP-signed /users/register, a session token
+    from /auth/session for /messages/receive, and senderId on every send so
+    the recipient knows which session key to decrypt with.
+    """
+
+    def __init__(self, user_id: str, identity_key: pgpy.PGPKey | None = None, http_client: httpx.AsyncClient | None = None,
+                 use_tor=False, enable_padding=True, enable_delays=True, binary_transport=False,
+                 padding_scheme=PADDING_SCHEME):
+        self.user_id = user_id
+        self.enable_padding = enable_padding
+        self.enable_delays = enable_delays
+        self.binary_transport = binary_transport
+        self.padding_scheme = padding_scheme
+
+        # PGP identity (server auth) and X25519 key pair (message encryption)
+        self.identity_key = identity_key or generate_identity_key(user_id)
+        self.private_key = x25519.X25519PrivateKey.generate()
+        self.public_key = self.private_key.public_key()
+        self.public_key_bytes = self.public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+
+        # Only close the transport if we created it
+        self._owns_http = http_client is None
+        self.http = http_client or create_http_client(use_tor=use_tor)
+        # Same key derivation as AnonymousVaultClient, one cached AES-GCM key per peer
+        self.crypto = VaultCryptoContext(self.private_key, info=b"vault-chat")
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_http:
+            await self.http.aclose()
+
+    def _signed_identity(self) -> dict:
+        return signed_identity(self.identity_key, self.user_id)
+
+    async def register_public_key(self):
+        """Register the PGP identity key with the server"""
+        resp = await self.http.post("/users/register", json={
+            **self._signed_identity(),
+            "public_key": str(self.identity_key.pubkey)
+        })
+        resp.raise_for_status()
+        return resp.json()
+
+    async def session_token(self) -> str:
+        """Current /auth/session token, renewed shortly before it expires"""
+        async with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                resp = await self.http.post("/auth/session", json=self._signed_identity())
+                resp.raise_for_status()
+                body = resp.json()
+                self._token = body["token"]
+                self._token_expires = time.monotonic() + body["expires_in"] - TOKEN_REFRESH_MARGIN
+            return self._token
+
+    def _encrypt(self, recipient_pub_bytes: bytes, message: str) -> bytes:
+        payload = self.crypto.encrypt(recipient_pub_bytes, message.encode())
+        if self.enable_padding:
+            payload = pad_message(payload, self.padding_scheme)
+        return payload
+
+    def _decrypt_all(self, items: list) -> list:
+        """(sender_pub_bytes, payload) pairs -> plaintext string or exception per item"""
+        return open_messages(self.crypto, items, self.enable_padding)
+
+    async def send_message(self, recipient_id: str, recipient_pub_bytes: bytes, message: str, ephemeral=False) -> dict:
+        """Encrypt and send one message"""
+        payload = self._encrypt(recipient_pub_bytes, message)
+
+        if self.enable_delays:
+            await random_delay()
+
+        if self.binary_transport:
+            resp = await self.http.post(
+                "/messages/send/raw",
+                params={"recipient": recipient_id, "senderId": self.user_id, "ephemeral": ephemeral},
+                content=payload,
+                headers={"Content-Type": "application/octet-stream"}
+            )
+        else:
+            resp = await self.http.post("/messages/send", json={
+                "recipient": recipient_id,
+                "ciphertext": payload.hex(),
+                "senderId": self.user_id,
+                "ephemeral": ephemeral
+            })
+        resp.raise_for_status()
+        return resp.json()
+
+    async def send_many(self, messages: list) -> list:
+        """Send (recipient_id, recipient_pub_bytes, message) tuples concurrently, each with its own jitter"""
+        return await asyncio.gather(*(self.send_message(*m) for m in messages))
+
+    async def fetch_messages(self, sender_pub_bytes_dict: dict, wait: float = 0, limit: int | None = None) -> list:
+        """
+        Fetch and decrypt messages. With wait > 0 the server holds the request
+        until something arrives (long-poll). Every fetched message gets a
+        result; one that can't be decrypted, or whose sender is missing in
+        sender_pub_bytes_dict, comes back as {"sender", "error"}.
+        """
+        body = {"user_id": self.user_id, "token": await self.session_token(), "wait": wait}
+        if limit is not None:
+            body["limit"] = limit
+        path = "/messages/receive/raw" if self.binary_transport else "/messages/receive"
+        resp = await self.http.post(path, json=body, timeout=REQUEST_TIMEOUT + wait)
+        resp.raise_for_status()
+
+        if self.binary_transport:
+            messages = [(header['senderId'], decode_payload(data)) for header, data in decode_frames(resp.content)]
+        else:
+            messages = [(msg['senderId'], decode_payload(msg['ciphertext'])) for msg in resp.json()]
+
+        items = known_sender_items(messages, sender_pub_bytes_dict)
+        if len(items) >= PARALLEL_MIN_ITEMS:
+            # Big backlog: decrypt across the crypto threads without blocking the event loop
+            plaintexts = await asyncio.to_thread(self._decrypt_all, items)
+        else:
+            plaintexts = self._decrypt_all(items)
+        return message_results(messages, sender_pub_bytes_dict, plaintexts)
+
+# =========================
+# DEMO USAGE
+# =========================
+
+async def _demo():
+    # One shared keep-alive pool for both simulated users
+    async with create_http_client() as http:
+        alice = AsyncAnonymousVaultClient("alice", http_client=http, enable_delays=False)
+        bob = AsyncAnonymousVaultClient("bob", http_client=http, enable_delays=False)
+        await asyncio.gather(alice.register_public_key(), bob.register_public_key())
+
+        # Bob long-polls while Alice sends
+        inbox, _ = await asyncio.gather(
+            bob.fetch_messages({"alice": alice.public_key_bytes}, wait=5),
+            alice.send_message("bob", bob.public_key_bytes, "Hello Bob! 🔒")
+        )
+        print(inbox)
+
+if __name__ == "__main__":
+    asyncio.run(_demo())
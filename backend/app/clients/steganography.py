@@ -0,0 +1,178 @@
+# app/clients/steganography.py
+
+import io
+import numpy as np
+
+# Ghost Mode LSB steganography, bit-compatible with the Flutter client
+# (frontend/lib/services/steganography_service.dart):
+#   - one bit in the least significant bit of R, G and B of every pixel
+#     (alpha untouched), pixels in row-major order, channels in R, G, B order
+#   - each byte written most significant bit first
+#   - "text" mode: the message bytes followed by a 0 byte, as the app does
+#   - "binary" mode (Python only): 4-byte big-endian length, then the bytes,
+#     for raw ciphertext that may itself contain zero bytes
+# Everything works on whole row bands ("tiles") of the pixel array at once,
+# so big images never go through a per-pixel Python loop.
+
+# =========================
+# CONFIGURATION
+# =========================
+
+MODE_TEXT = "text"
+MODE_BINARY = "binary"
+TILE_ROWS = 256           # rows per band; kept a multiple of 8 so bands hold whole bytes
+LENGTH_PREFIX_SIZE = 4
+
+# =========================
+# CAPACITY
+# =========================
+
+def capacity_bits(shape) -> int:
+    """Bits an (height, width, channels) image can carry"""
+    height, width = shape[:2]
+    return height * width * 3
+
+
+def capacity(shape, mode: str = MODE_TEXT) -> int:
+    """Largest message in bytes that fits, after the terminator or length prefix"""
+    overhead = 1 if mode == MODE_TEXT else LENGTH_PREFIX_SIZE
+    return max(capacity_bits(shape) // 8 - overhead, 0)
+
+
+def _check_pixels(pixels: np.ndarray):
+    if pixels.dtype != np.uint8 or pixels.ndim != 3 or pixels.shape[2] < 3:
+        raise ValueError("Expected a uint8 (height, width, 3 or 4) pixel array")
+
+
+def _tile_rows(tile_rows: int) -> int:
+    return max(8, tile_rows - tile_rows % 8)
+
+# =========================
+# EMBED
+# =========================
+
+def _frame_payload(payload, mode: str) -> bytes:
+    if mode == MODE_TEXT:
+        if isinstance(payload, str):
+            # The app stores one byte per character
+            payload = payload.encode('latin-1')
+        if 0 in payload:
+            raise ValueError("Text mode payload can't contain zero bytes (use binary mode)")
+        return bytes(payload) + b"\x00"
+    if mode == MODE_BINARY:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        return len(payload).to_bytes(LENGTH_PREFIX_SIZE, 'big') + bytes(payload)
+    raise ValueError(f"Unknown stego mode: {mode}")
+
+
+def embed(pixels: np.ndarray, payload, mode: str = MODE_TEXT, inplace: bool = False,
+          tile_rows: int = TILE_ROWS) -> np.ndarray:
+    """
+    Hide payload in the RGB least significant bits of pixels. Returns the
+    modified array (pixels itself with inplace=True, otherwise a copy).
+    Raises ValueError if it doesn't fit.
+    """
+    _check_pixels(pixels)
+    data = _frame_payload(payload, mode)
+    if len(data) * 8 > capacity_bits(pixels.shape):
+        raise ValueError(f"Payload needs {len(data)} bytes, image holds {capacity_bits(pixels.shape) // 8}")
+
+    out = pixels if inplace else pixels.copy()
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    rgb = out[..., :3]
+    width = out.shape[1]
+    row_bits = width * 3
+    step = _tile_rows(tile_rows)
+
+    # Whole rows, a band at a time
+    full_rows = len(bits) // row_bits
+    for top in range(0, full_rows, step):
+        bottom = min(top + step, full_rows)
+        band = bits[top * row_bits:bottom * row_bits].reshape(bottom - top, width, 3)
+        rgb[top:bottom] = (rgb[top:bottom] & 0xFE) | band
+
+    # Then the part of the last row the payload reaches
+    rest = bits[full_rows * row_bits:]
+    if len(rest):
+        row = rgb[full_rows].reshape(-1)
+        row[:len(rest)] = (row[:len(rest)] & 0xFE) | rest
+        rgb[full_rows] = row.reshape(width, 3)
+    return out
+
+# =========================
+# EXTRACT
+# =========================
+
+def iter_lsb_bytes(pixels: np.ndarray, tile_rows: int = TILE_ROWS):
+    """Yield the hidden byte stream one band of rows at a time"""
+    _check_pixels(pixels)
+    step = _tile_rows(tile_rows)
+    for top in range(0, pixels.shape[0], step):
+        band = pixels[top:top + step, :, :3]
+        # Only the last band can end mid-byte; those trailing bits are dropped, as in the app
+        yield np.packbits(band & 1, axis=None).tobytes()[:band.size // 8]
+
+
+def extract(pixels: np.ndarray, mode: str = MODE_TEXT, tile_rows: int = TILE_ROWS) -> bytes:
+    """
+    Read a payload hidden by embed (or by the app, in text mode). Stops at
+    the band holding the end of the message, so short messages in large
+    images only touch the first rows. Text mode returns everything up to
+    the first zero byte (or the whole stream if there is none, like the app).
+    """
+    if mode not in (MODE_TEXT, MODE_BINARY):
+        raise ValueError(f"Unknown stego mode: {mode}")
+
+    collected = bytearray()
+    needed = None
+    for block in iter_lsb_bytes(pixels, tile_rows):
+        if mode == MODE_TEXT:
+            end = block.find(b"\x00")
+            if end >= 0:
+                collected += block[:end]
+                return bytes(collected)
+            collected += block
+            continue
+
+        collected += block
+        if needed is None and len(collected) >= LENGTH_PREFIX_SIZE:
+            needed = LENGTH_PREFIX_SIZE + int.from_bytes(collected[:LENGTH_PREFIX_SIZE], 'big')
+            if needed * 8 > capacity_bits(pixels.shape):
+                raise ValueError("No binary payload in image (length prefix out of range)")
+        if needed is not None and len(collected) >= needed:
+            return bytes(collected[LENGTH_PREFIX_SIZE:needed])
+
+    if mode == MODE_BINARY:
+        raise ValueError("No binary payload in image (truncated)")
+    return bytes(collected)
+
+# =========================
+# IMAGE FILES (needs Pillow)
+# =========================
+
+def load_pixels(image_bytes: bytes) -> np.ndarray:
+    """Decode PNG/JPEG/... bytes into an RGB or RGBA uint8 array"""
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    return np.asarray(image).copy()
+
+
+def to_png(pixels: np.ndarray) -> bytes:
+    """PNG is lossless, so the hidden bits survive (a JPEG would destroy them)"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def encode_image(image_bytes: bytes, secret, mode: str = MODE_TEXT) -> bytes:
+    """Same as SteganographyService.encode: image in, PNG with the secret out"""
+    return to_png(embed(load_pixels(image_bytes), secret, mode, inplace=True))
+
+
+def decode_image(image_bytes: bytes, mode: str = MODE_TEXT) -> bytes:
+    """Same as SteganographyService.decode (text mode returns bytes; .decode('latin-1') for the app's string)"""
+    return extract(load_pixels(image_bytes), mode)
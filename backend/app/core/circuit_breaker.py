@@ -1,20 +1,170 @@
-# app/core/circuit_breaker.py - FIXED
+# app/core/circuit_breaker.py
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from fastapi import Request
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from fastapi import HTTPException, Request
+from app.utils.metrics import RATE_LIMITED
 
-# Initialize limiter
-limiter = Limiter(key_func=get_remote_address)
+# =========================
+# CONFIGURATION
+# =========================
 
-# Rate limit constants
-PUBLIC_KEY_LIMIT = "10/minute"
+# "<count>/<second|minute|hour|day>"; the bucket holds <count> tokens and refills
+# continuously, so bursts up to <count> are allowed after a quiet period
+PUBLIC_KEY_LIMIT = os.getenv("RATE_LIMIT_PUBLIC_KEY", "10/minute")
+SEND_LIMIT = os.getenv("RATE_LIMIT_SEND", "30/second")
+RECEIVE_LIMIT = os.getenv("RATE_LIMIT_RECEIVE", "10/second")
+# /auth/session and /users/register, which each run a full PGP verify
+IDENTITY_LIMIT = os.getenv("RATE_LIMIT_IDENTITY", "10/minute")
+# Attachment uploads, per user: sessions started, bytes reserved by them
+# (charged up front from the declared size) and chunk PUTs
+UPLOAD_LIMIT = os.getenv("RATE_LIMIT_UPLOADS", "30/hour")
+UPLOAD_BYTES_LIMIT = os.getenv("RATE_LIMIT_UPLOAD_BYTES", "2147483648/day")
+UPLOAD_CHUNK_LIMIT = os.getenv("RATE_LIMIT_UPLOAD_CHUNKS", "20/second")
 
-def rate_limit_dependency(request: Request):
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Keys tracked per limiter; the least recently seen are forgotten past this
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SHARDS = 64
+# Behind a reverse proxy, the header carrying the client address (e.g. X-Forwarded-For).
+# Only set this if the proxy overwrites it, otherwise clients can pick their own key.
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER", "")
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_limit(limit: str) -> tuple:
+    """'10/minute' -> (tokens per second, bucket size)"""
+    count, _, period = limit.partition("/")
+    if period not in _PERIODS or not count.isdigit() or int(count) <= 0:
+        raise ValueError(f"Invalid rate limit: {limit!r}")
+    return int(count) / _PERIODS[period], float(count)
+
+# =========================
+# TOKEN BUCKET
+# =========================
+
+class TokenBucketLimiter:
     """
-    Rate limiting dependency for FastAPI routes.
-    Must receive the request object to work with slowapi.
+    One token bucket per key, stored as (tokens, last update), so memory is
+    constant per key and nothing runs in the background: refill is computed
+    on access. Keys are spread over shards with their own lock, so threads
+    limiting different keys rarely contend. A forgotten key comes back with
+    a full bucket, which it would have refilled to anyway once idle.
     """
-    # The limiter will automatically handle rate limiting
-    # when this dependency is used in a route
-    return None
\ No newline at end of file
+
+    def __init__(self, rate: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS,
+                 shards: int = RATE_LIMIT_SHARDS):
+        self.rate = rate
+        self.burst = burst
+        self._max_per_shard = max(1, max_keys // shards)
+        self._locks = [threading.Lock() for _ in range(shards)]
+        # key -> (tokens, monotonic time), least recently seen first
+        self._buckets = [OrderedDict() for _ in range(shards)]
+
+    @classmethod
+    def from_limit(cls, limit: str, **kwargs):
+        rate, burst = parse_limit(limit)
+        return cls(rate, burst, **kwargs)
+
+    def acquire(self, key, cost: float = 1.0) -> float:
+        """
+        Take cost tokens. Returns 0 if allowed, else seconds until it would be
+        (inf if cost is more than the bucket holds, see enforce_rate_limit).
+        """
+        if cost > self.burst:
+            return math.inf
+        shard = hash(key) % len(self._locks)
+        buckets = self._buckets[shard]
+        now = time.monotonic()
+        with self._locks[shard]:
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+                if len(buckets) >= self._max_per_shard:
+                    buckets.popitem(last=False)
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                buckets.move_to_end(key)
+
+            if tokens >= cost:
+                buckets[key] = (tokens - cost, now)
+                return 0.0
+            buckets[key] = (tokens, now)
+            return (cost - tokens) / self.rate
+
+    def stats(self) -> dict:
+        return {"keys": sum(len(b) for b in self._buckets), "rate": self.rate, "burst": self.burst}
+
+# =========================
+# FASTAPI DEPENDENCIES
+# =========================
+
+send_limiter = TokenBucketLimiter.from_limit(SEND_LIMIT)
+receive_limiter = TokenBucketLimiter.from_limit(RECEIVE_LIMIT)
+public_key_limiter = TokenBucketLimiter.from_limit(PUBLIC_KEY_LIMIT)
+identity_limiter = TokenBucketLimiter.from_limit(IDENTITY_LIMIT)
+upload_limiter = TokenBucketLimiter.from_limit(UPLOAD_LIMIT)
+upload_bytes_limiter = TokenBucketLimiter.from_limit(UPLOAD_BYTES_LIMIT)
+upload_chunk_limiter = TokenBucketLimiter.from_limit(UPLOAD_CHUNK_LIMIT)
+
+
+def client_key(request: Request) -> str:
+    if RATE_LIMIT_CLIENT_HEADER:
+        forwarded = request.headers.get(RATE_LIMIT_CLIENT_HEADER)
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def enforce_rate_limit(limiter: TokenBucketLimiter, name: str, request: Request, cost: float = 1.0,
+                       key: str | None = None):
+    """Raise 429 with Retry-After if the client (or key, e.g. an authenticated user) is over this limit"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    if cost > limiter.burst:
+        # Would never fit in the bucket; clamping it would let big requests exceed the rate
+        RATE_LIMITED.labels(name).inc()
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request exceeds the {name} rate limit (costs {cost:g}, at most {limiter.burst:g} at once)"
+        )
+    retry_after = limiter.acquire(key or client_key(request), cost)
+    if retry_after:
+        RATE_LIMITED.labels(name).inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+
+def send_rate_limit(request: Request):
+    enforce_rate_limit(send_limiter, "send", request)
+
+
+def receive_rate_limit(request: Request):
+    enforce_rate_limit(receive_limiter, "receive", request)
+
+
+def public_key_rate_limit(request: Request):
+    enforce_rate_limit(public_key_limiter, "public_key", request)
+
+
+def identity_rate_limit(request: Request):
+    enforce_rate_limit(identity_limiter, "identity", request)
+
+
+def rate_limit_stats() -> dict:
+    return {
+        "send": send_limiter.stats(),
+        "receive": receive_limiter.stats(),
+        "public_key": public_key_limiter.stats(),
+        "identity": identity_limiter.stats(),
+        "upload": upload_limiter.stats(),
+        "upload_bytes": upload_bytes_limiter.stats(),
+        "upload_chunk": upload_chunk_limiter.stats(),
+    }
@@ -2,7 +2,19 @@ from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.cache import LRUCache
+import hashlib
 import os
+import threading
+
+# Peers whose derived AESGCM object a context keeps
+CRYPTO_KEY_CACHE_SIZE = int(os.getenv("CRYPTO_KEY_CACHE_SIZE", "1024"))
+# Threads for encrypt_many/decrypt_many (OpenSSL releases the GIL during AES-GCM)
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", str(os.cpu_count() or 1)))
+# Batches smaller than this (items and bytes) run inline; the pool only pays off for bulk work
+PARALLEL_MIN_ITEMS = 64
+PARALLEL_MIN_BYTES = 1024 * 1024
 
 # ---------- KEY DERIVATION ----------
 
@@ -29,6 +41,9 @@ def derive_shared_key(
 
 # ---------- ENCRYPTION ----------
 
+# No module-level key cache: raw keys passed here are not kept past the call.
+# Callers that reuse a key per peer should hold a VaultCryptoContext instead.
+
 def encrypt_vault_message(key: bytes, plaintext: bytes) -> bytes:
     """
     AES-GCM → nonce (12) + ciphertext + tag (16)
@@ -47,3 +62,115 @@ def decrypt_vault_message(key: bytes, encrypted_payload: bytes) -> bytes:
     ciphertext = encrypted_payload[12:]
     aesgcm = AESGCM(key)
     return aesgcm.decrypt(nonce, ciphertext, None)
+
+
+# ---------- BATCHES ----------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _crypto_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="vault-crypto")
+        return _pool
+
+
+def _run_batch(fn, items: list, return_exceptions: bool) -> list:
+    """Apply fn to every (peer, data) item, on the crypto pool when the batch is large"""
+    def run_one(item):
+        try:
+            return fn(*item)
+        except Exception as e:
+            if return_exceptions:
+                return e
+            raise
+
+    def run_chunk(chunk):
+        return [run_one(item) for item in chunk]
+
+    if CRYPTO_WORKERS <= 1 or len(items) < PARALLEL_MIN_ITEMS and sum(len(d) for _, d in items) < PARALLEL_MIN_BYTES:
+        return run_chunk(items)
+
+    # One contiguous chunk per worker keeps per-task overhead negligible
+    chunk_size = -(-len(items) // CRYPTO_WORKERS)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    results = []
+    for chunk_results in _crypto_pool().map(run_chunk, chunks):
+        results.extend(chunk_results)
+    return results
+
+
+# ---------- CONTEXT ----------
+
+class VaultCryptoContext:
+    """
+    One party's X25519 key with a bounded LRU of per-peer AESGCM objects,
+    so X25519 + HKDF run once per peer instead of once per message.
+    Thread-safe; encrypt_many/decrypt_many spread large batches over threads.
+    Derived keys live only as long as the context (or until clear()), and the
+    cache is indexed by a digest of the peer's public key.
+    """
+
+    def __init__(
+        self,
+        private_key: x25519.X25519PrivateKey | bytes,
+        info: bytes = b"vault-chat-v1",
+        salt: bytes | None = None,
+        max_peers: int = CRYPTO_KEY_CACHE_SIZE
+    ):
+        if isinstance(private_key, bytes):
+            private_key = x25519.X25519PrivateKey.from_private_bytes(private_key)
+        self._private_key = private_key
+        self._info = info
+        self._salt = salt
+        # sha256(peer public key) -> AESGCM
+        self._peers = LRUCache(max_peers)
+
+    def shared_key(self, peer_public_key_bytes: bytes) -> bytes:
+        """X25519 + HKDF for a peer (uncached; see aead_for)"""
+        peer_public_key = x25519.X25519PublicKey.from_public_bytes(peer_public_key_bytes)
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=self._salt,
+            info=self._info
+        ).derive(self._private_key.exchange(peer_public_key))
+
+    def aead_for(self, peer_public_key_bytes: bytes) -> AESGCM:
+        peer = hashlib.sha256(peer_public_key_bytes).digest()
+        aead = self._peers.get(peer)
+        if aead is None:
+            aead = AESGCM(self.shared_key(peer_public_key_bytes))
+            self._peers.set(peer, aead)
+        return aead
+
+    def encrypt(self, peer_public_key_bytes: bytes, plaintext: bytes) -> bytes:
+        """nonce (12) + ciphertext + tag (16), same layout as encrypt_vault_message"""
+        nonce = os.urandom(12)
+        return nonce + self.aead_for(peer_public_key_bytes).encrypt(nonce, plaintext, None)
+
+    def decrypt(self, peer_public_key_bytes: bytes, encrypted_payload: bytes) -> bytes:
+        nonce = encrypted_payload[:12]
+        return self.aead_for(peer_public_key_bytes).decrypt(nonce, encrypted_payload[12:], None)
+
+    def encrypt_many(self, items: list, return_exceptions: bool = False) -> list:
+        """Encrypt (peer_public_key_bytes, plaintext) pairs; results in the same order"""
+        return _run_batch(self.encrypt, items, return_exceptions)
+
+    def decrypt_many(self, items: list, return_exceptions: bool = False) -> list:
+        """
+        Decrypt (peer_public_key_bytes, payload) pairs; results in the same order.
+        With return_exceptions=True a bad payload yields its exception (e.g.
+        InvalidTag) in its slot instead of failing the whole batch.
+        """
+        return _run_batch(self.decrypt, items, return_exceptions)
+
+    def cache_stats(self) -> dict:
+        return self._peers.stats()
+
+    def clear(self):
+        """Forget every derived peer key (e.g. on logout)"""
+        self._peers.clear()
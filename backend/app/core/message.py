@@ -1,9 +1,33 @@
+from sqlalchemy import select, func, insert, update, delete, exists, text, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.message import Message
+from app.models.mailbox_usage import MailboxUsage
+from app.infra.pg_notify import mailbox_channel
+from app.services.notification_service import mailbox_notifier
+from app.utils.metrics import stage_timer, MESSAGES_STORED, MESSAGES_FETCHED, MAILBOX_QUOTA_REJECTED
 from datetime import datetime, timedelta
+import anyio
+import anyio.lowlevel
 import hashlib
+import os
 import random
 
+# Per-recipient caps on what may sit unread in a mailbox (0 disables a cap).
+# Checked against the mailbox_usage counters before each insert, so
+# concurrent senders can overshoot slightly.
+MAILBOX_MAX_PENDING = int(os.getenv("MAILBOX_MAX_PENDING", "10000"))
+MAILBOX_MAX_BYTES = int(os.getenv("MAILBOX_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class MailboxQuotaExceeded(Exception):
+    """The recipient(s) already have too many pending messages or bytes"""
+
+    def __init__(self, recipient_hashes):
+        super().__init__(f"{len(recipient_hashes)} recipient mailbox(es) full")
+        self.recipient_hashes = set(recipient_hashes)
+
 def hash_recipient(public_key: bytes) -> bytes:
     """Hash recipient public key (must be bytes)"""
     if isinstance(public_key, str):
@@ -12,6 +36,146 @@ def hash_recipient(public_key: bytes) -> bytes:
         raise TypeError("public_key must be bytes or a string that can be encoded")
     return hashlib.sha256(public_key).digest()
 
+def _expiry() -> datetime:
+    return datetime.utcnow() + timedelta(
+        days=7,
+        minutes=random.randint(-60, 60)  # timing blur for privacy
+    )
+
+def _notify_statement(recipient_hash: bytes):
+    """pg_notify for this mailbox; delivered to every worker's LISTEN connection on commit"""
+    return select(func.pg_notify(mailbox_channel(recipient_hash), ""))
+
+def _new_message(recipient_public_key: bytes, ciphertext: bytes, sender_id: str) -> Message:
+    # Defensive check: ensure ciphertext is bytes for LargeBinary column
+    if isinstance(ciphertext, str):
+        ciphertext = ciphertext.encode('utf-8')
+
+    return Message(
+        recipient_hash=hash_recipient(recipient_public_key),
+        ciphertext=ciphertext,
+        sender_id=sender_id,
+        expires_at=_expiry()
+    )
+
+# ---------- mailbox usage counters ----------
+
+def _usage_statement(recipient_hashes: list, today):
+    """Pending message count and ciphertext bytes per recipient, from the counters"""
+    usage = MailboxUsage.__table__
+    return (
+        select(usage.c.recipient_hash, func.sum(usage.c.pending), func.sum(usage.c.bytes))
+        .where(usage.c.recipient_hash.in_(recipient_hashes), usage.c.expires_on >= today)
+        .group_by(usage.c.recipient_hash)
+    )
+
+def _by_day(messages) -> list:
+    """(recipient_hash, expiry day, count, bytes) for (recipient_hash, ciphertext, expires_at) triples, in key order"""
+    totals = {}
+    for recipient_hash, ciphertext, expires_at in messages:
+        total = totals.setdefault((recipient_hash, expires_at.date()), [0, 0])
+        total[0] += 1
+        total[1] += len(ciphertext)
+    return [(h, day, count, size) for (h, day), (count, size) in sorted(totals.items())]
+
+def _add_usage_statement(dialect: str, messages):
+    """Upsert adding newly stored messages to their (recipient, day) counters"""
+    usage = MailboxUsage.__table__
+    # Sorted rows, so concurrent batches lock counters in the same order
+    stmt = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(usage).values([
+        {"recipient_hash": h, "expires_on": day, "pending": count, "bytes": size}
+        for h, day, count, size in _by_day(messages)
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[usage.c.recipient_hash, usage.c.expires_on],
+        set_={"pending": usage.c.pending + stmt.excluded.pending, "bytes": usage.c.bytes + stmt.excluded.bytes}
+    )
+
+_release_usage_statement = (
+    update(MailboxUsage.__table__)
+    .where(
+        MailboxUsage.__table__.c.recipient_hash == bindparam("h"),
+        MailboxUsage.__table__.c.expires_on == bindparam("day")
+    )
+    .values(
+        pending=MailboxUsage.__table__.c.pending - bindparam("count"),
+        bytes=MailboxUsage.__table__.c.bytes - bindparam("size")
+    )
+)
+
+def _release_params(recipient_hash: bytes, claimed) -> list:
+    """Parameters for _release_usage_statement from claimed message rows"""
+    return [
+        {"h": h, "day": day, "count": count, "size": size}
+        for h, day, count, size in _by_day((recipient_hash, m.ciphertext, m.expires_at) for m in claimed)
+    ]
+
+def rebuild_mailbox_usage(conn):
+    """Recompute every counter from the messages table (after creating it, or to repair drift)"""
+    messages = Message.__table__
+    usage = MailboxUsage.__table__
+    conn.execute(delete(usage))
+    conn.execute(insert(usage).from_select(
+        ["recipient_hash", "expires_on", "pending", "bytes"],
+        select(
+            messages.c.recipient_hash,
+            func.date(messages.c.expires_at),
+            func.count(),
+            func.sum(func.length(messages.c.ciphertext))
+        ).group_by(messages.c.recipient_hash, func.date(messages.c.expires_at))
+    ))
+
+# ---------- quotas ----------
+
+def _incoming(rows) -> dict:
+    """recipient_hash -> [count, bytes] for the messages about to be stored"""
+    incoming = {}
+    for recipient_hash, ciphertext, _ in rows:
+        usage = incoming.setdefault(recipient_hash, [0, 0])
+        usage[0] += 1
+        usage[1] += len(ciphertext)
+    return incoming
+
+def _over_quota(incoming: dict, usage_rows) -> set:
+    usage = {row[0]: (row[1], row[2]) for row in usage_rows}
+    full = set()
+    for recipient_hash, (count, size) in incoming.items():
+        pending, pending_bytes = usage.get(recipient_hash, (0, 0))
+        if MAILBOX_MAX_PENDING and pending + count > MAILBOX_MAX_PENDING:
+            full.add(recipient_hash)
+        elif MAILBOX_MAX_BYTES and pending_bytes + size > MAILBOX_MAX_BYTES:
+            full.add(recipient_hash)
+    return full
+
+def _quotas_enabled() -> bool:
+    return bool(MAILBOX_MAX_PENDING or MAILBOX_MAX_BYTES)
+
+def _reject(full: set, incoming: dict):
+    MAILBOX_QUOTA_REJECTED.inc(sum(incoming[h][0] for h in full))
+    raise MailboxQuotaExceeded(full)
+
+def reserve_mailbox_space(db: Session, rows):
+    """
+    Check the quotas for rows ((recipient_hash, ciphertext, expires_at) triples)
+    and count them in mailbox_usage, in the caller's transaction. Raises
+    MailboxQuotaExceeded (changing nothing) if a mailbox would overfill.
+    """
+    if _quotas_enabled():
+        incoming = _incoming(rows)
+        full = _over_quota(incoming, db.execute(_usage_statement(list(incoming), datetime.utcnow().date())).all())
+        if full:
+            _reject(full, incoming)
+    db.execute(_add_usage_statement(db.get_bind().dialect.name, rows))
+
+async def reserve_mailbox_space_async(db: AsyncSession, rows):
+    """Async version of reserve_mailbox_space"""
+    if _quotas_enabled():
+        incoming = _incoming(rows)
+        full = _over_quota(incoming, (await db.execute(_usage_statement(list(incoming), datetime.utcnow().date()))).all())
+        if full:
+            _reject(full, incoming)
+    await db.execute(_add_usage_statement(db.get_bind().dialect.name, rows))
+
 def store_message(
     db: Session,
     recipient_public_key: bytes,
@@ -19,41 +183,204 @@ def store_message(
     sender_id: str = "anonymous"
 ):
     """Store an encrypted message for a recipient"""
-    # Defensive check: ensure ciphertext is bytes for LargeBinary column
-    if isinstance(ciphertext, str):
-        ciphertext = ciphertext.encode('utf-8')
-        
-    recipient_hash = hash_recipient(recipient_public_key)
+    message = _new_message(recipient_public_key, ciphertext, sender_id)
 
-    expires_at = datetime.utcnow() + timedelta(
-        days=7,
-        minutes=random.randint(-60, 60)  # timing blur for privacy
-    )
+    with stage_timer("store_message"):
+        reserve_mailbox_space(db, [(message.recipient_hash, message.ciphertext, message.expires_at)])
+        db.add(message)
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(_notify_statement(message.recipient_hash))
+        db.flush()
+        # Don't reload after commit: a woken receiver may already have deleted the row
+        db.expunge(message)
+        db.commit()
+    MESSAGES_STORED.inc()
 
-    message = Message(
-        recipient_hash=recipient_hash,
-        ciphertext=ciphertext,
-        sender_id=sender_id,
-        expires_at=expires_at
-    )
+    # Wake local waiters right away (a second wake via NOTIFY is harmless)
+    mailbox_notifier.publish(message.recipient_hash)
+    return message
 
-    db.add(message)
-    db.commit()
-    db.refresh(message)
+async def store_message_async(
+    db: AsyncSession,
+    recipient_public_key: bytes,
+    ciphertext: bytes,
+    sender_id: str = "anonymous"
+):
+    """Async version of store_message"""
+    message = _new_message(recipient_public_key, ciphertext, sender_id)
+
+    with stage_timer("store_message"):
+        await reserve_mailbox_space_async(db, [(message.recipient_hash, message.ciphertext, message.expires_at)])
+        db.add(message)
+        if db.get_bind().dialect.name == "postgresql":
+            await db.execute(_notify_statement(message.recipient_hash))
+        # No refresh: sessions don't expire on commit and the row may already be fetched
+        await db.commit()
+    MESSAGES_STORED.inc()
+
+    mailbox_notifier.publish(message.recipient_hash)
     return message
 
-def fetch_messages(db: Session, recipient_public_key: bytes):
-    """Fetch and delete messages for a recipient"""
+async def store_messages_async(db: AsyncSession, items: list, sender_id: str = "anonymous") -> int:
+    """
+    Store many messages in one multi-row INSERT and one transaction.
+    items: (recipient_public_key, ciphertext, sender_id or None) tuples.
+    Raises MailboxQuotaExceeded (storing nothing) if any recipient is full.
+    """
+    if not items:
+        return 0
+
+    now = datetime.utcnow()
+    rows = []
+    for recipient_public_key, ciphertext, item_sender in items:
+        message = _new_message(recipient_public_key, ciphertext, item_sender or sender_id)
+        rows.append({
+            "recipient_hash": message.recipient_hash,
+            "ciphertext": message.ciphertext,
+            "sender_id": message.sender_id,
+            "expires_at": message.expires_at,
+            "created_at": now,
+        })
+
+    recipient_hashes = list({row["recipient_hash"] for row in rows})
+
+    with stage_timer("store_messages_batch"):
+        # All or nothing: the caller drops the full mailboxes and retries the rest
+        await reserve_mailbox_space_async(db, [(row["recipient_hash"], row["ciphertext"], row["expires_at"]) for row in rows])
+        await db.execute(insert(Message).values(rows))
+        if db.get_bind().dialect.name == "postgresql":
+            await db.execute(
+                text("SELECT pg_notify(c, '') FROM unnest(CAST(:channels AS text[])) AS c"),
+                {"channels": [mailbox_channel(h) for h in recipient_hashes]}
+            )
+        await db.commit()
+    MESSAGES_STORED.inc(len(rows))
+
+    for recipient_hash in recipient_hashes:
+        mailbox_notifier.publish(recipient_hash)
+    return len(rows)
+
+# Server-side cap on messages returned by one fetch
+FETCH_LIMIT_DEFAULT = 100
+FETCH_LIMIT_MAX = 500
+
+def _claim_statement(recipient_hash: bytes, limit: int, now: datetime):
+    """
+    Atomically delete up to `limit` unexpired messages for a recipient and
+    return them as Core rows (read-once). SKIP LOCKED lets two concurrent
+    fetches for the same mailbox split the rows instead of blocking.
+    """
+    messages = Message.__table__
+    oldest = (
+        select(messages.c.id)
+        .where(messages.c.recipient_hash == recipient_hash, messages.c.expires_at > now)
+        .order_by(messages.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return (
+        delete(messages)
+        .where(messages.c.recipient_hash == recipient_hash, messages.c.id.in_(oldest))
+        .returning(messages.c.id, messages.c.ciphertext, messages.c.sender_id, messages.c.created_at, messages.c.expires_at)
+    )
+
+def _pending_statement(recipient_hash: bytes, now: datetime):
+    messages = Message.__table__
+    return select(exists().where(
+        messages.c.recipient_hash == recipient_hash, messages.c.expires_at > now
+    ))
+
+def fetch_messages(db: Session, recipient_public_key: bytes, limit: int = FETCH_LIMIT_DEFAULT):
+    """
+    Fetch and delete up to `limit` messages for a recipient in one statement.
+    Returns (messages, more_pending).
+    """
     recipient_hash = hash_recipient(recipient_public_key)
+    limit = max(1, min(limit, FETCH_LIMIT_MAX))
+    now = datetime.utcnow()
+
+    with stage_timer("fetch_messages"):
+        messages = db.execute(_claim_statement(recipient_hash, limit, now)).all()
+        if messages:
+            db.execute(_release_usage_statement, _release_params(recipient_hash, messages))
+        more_pending = len(messages) >= limit and db.execute(_pending_statement(recipient_hash, now)).scalar()
+
+        db.commit()
+    MESSAGES_FETCHED.inc(len(messages))
+    # RETURNING order is not guaranteed
+    messages.sort(key=lambda m: m.id)
+    return messages, bool(more_pending)
+
+async def fetch_messages_async(db: AsyncSession, recipient_public_key: bytes, limit: int = FETCH_LIMIT_DEFAULT):
+    """Async version of fetch_messages"""
+    return await fetch_mailbox_async(db, hash_recipient(recipient_public_key), limit)
+
+async def fetch_mailbox_async(db: AsyncSession, recipient_hash: bytes, limit: int = FETCH_LIMIT_DEFAULT):
+    """fetch_messages_async for an already hashed recipient (e.g. from a session token)"""
+    limit = max(1, min(limit, FETCH_LIMIT_MAX))
+    now = datetime.utcnow()
+
+    with stage_timer("fetch_messages"):
+        messages = (await db.execute(_claim_statement(recipient_hash, limit, now))).all()
+        if messages:
+            await db.execute(_release_usage_statement, _release_params(recipient_hash, messages))
+        more_pending = len(messages) >= limit and (await db.execute(_pending_statement(recipient_hash, now))).scalar()
+
+        await db.commit()
+    MESSAGES_FETCHED.inc(len(messages))
+    messages.sort(key=lambda m: m.id)
+    return messages, bool(more_pending)
+
+# Streamed fetches: rows pulled per cursor round trip, and the overall cap
+STREAM_BATCH_SIZE = 100
+STREAM_LIMIT_MAX = 100000
+
+async def stream_mailbox_async(db: AsyncSession, recipient_hash: bytes, limit: int = STREAM_LIMIT_MAX,
+                               status: dict | None = None):
+    """
+    Read-once fetch for large backlogs. Yields messages oldest first,
+    claiming (deleting) STREAM_BATCH_SIZE rows per transaction, so memory
+    stays flat however many are queued. A batch is committed when the
+    consumer asks for the message after it, i.e. once the whole batch has
+    been handed on; row locks and the open transaction never cover more than
+    one batch, however slow the consumer. If the consumer stops early, the
+    current batch is left to roll back and stays queued with everything after it.
+    Once exhausted, sets status["more_pending"] like fetch_mailbox_async returns it.
+    """
+    limit = max(1, min(limit, STREAM_LIMIT_MAX))
+    now = datetime.utcnow()
 
-    messages = db.query(Message).filter(
-        Message.recipient_hash == recipient_hash,
-        Message.expires_at > datetime.utcnow()
-    ).all()
+    streamed = 0
+    while streamed < limit:
+        size = min(STREAM_BATCH_SIZE, limit - streamed)
+        # Database round trips are shielded: a client disconnect cancelling asyncpg
+        # mid-protocol leaves the connection half-closed, still holding its row locks.
+        with anyio.CancelScope(shield=True):
+            batch = (await db.execute(_claim_statement(recipient_hash, size, now))).all()
+            if batch:
+                await db.execute(_release_usage_statement, _release_params(recipient_hash, batch))
+        if not batch:
+            break
+        # Unshielded checkpoint: a pending cancellation (client gone) stops the
+        # stream here, before this batch is committed
+        await anyio.lowlevel.checkpoint()
+        # RETURNING order is not guaranteed
+        batch.sort(key=lambda m: m.id)
+        for message in batch:
+            yield message
 
-    # Delete messages after fetching (read-once policy)
-    for msg in messages:
-        db.delete(msg)
+        with anyio.CancelScope(shield=True):
+            await db.commit()
+        streamed += len(batch)
+        MESSAGES_FETCHED.inc(len(batch))
+        if len(batch) < size:
+            break
 
-    db.commit()
-    return messages
\ No newline at end of file
+    if status is not None:
+        # Only worth asking when the limit cut the stream short
+        more_pending = False
+        if streamed >= limit:
+            with anyio.CancelScope(shield=True):
+                more_pending = (await db.execute(_pending_statement(recipient_hash, now))).scalar()
+                await db.commit()
+        status["more_pending"] = bool(more_pending)
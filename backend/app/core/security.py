@@ -1,19 +1,97 @@
 # app/core/security.py
 
+import os
+import time
+import hmac
+import base64
+import secrets
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
 import pgpy
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from typing import Tuple
+from starlette.concurrency import run_in_threadpool
+from app.utils.cache import LRUCache
+from app.utils.metrics import stage_timer
 
-def verify_pgp_signature(public_key_text: str, signature_text: str, data: str) -> bool:
+# =========================
+# PARSED KEY CACHE
+# =========================
+
+# Parsing an armored key dominates the cost of a verify, and the same few
+# thousand keys are verified over and over by /messages/receive polling.
+PGP_KEY_CACHE_SIZE = int(os.getenv("PGP_KEY_CACHE_SIZE", "4096"))
+
+# user_id_hash -> (key fingerprint, parsed PGPKey)
+_key_cache = LRUCache(PGP_KEY_CACHE_SIZE)
+
+
+def key_fingerprint(public_key_text: str) -> bytes:
+    """
+    SHA-256 of the armored key text. Cheap to compute without parsing,
+    and changes whenever the user registers a different key.
+    """
+    return hashlib.sha256(public_key_text.encode('utf-8')).digest()
+
+
+def load_public_key(public_key_text: str, user_id_hash: bytes | None = None) -> pgpy.PGPKey:
+    """Parse an armored public key, reusing the cached parse for this user if it still matches"""
+    if user_id_hash is None:
+        key, _ = pgpy.PGPKey.from_blob(public_key_text)
+        return key
+
+    fingerprint = key_fingerprint(public_key_text)
+    cached = _key_cache.get(user_id_hash)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    key, _ = pgpy.PGPKey.from_blob(public_key_text)
+    _key_cache.set(user_id_hash, (fingerprint, key))
+    return key
+
+
+def invalidate_cached_key(user_id_hash: bytes, public_key_text: str | None = None):
+    """
+    Drop the cached key for a user. If public_key_text is given and the
+    cached entry already matches it, the entry is kept.
+    """
+    if public_key_text is not None:
+        cached = _key_cache.get(user_id_hash)
+        if cached is not None and cached[0] == key_fingerprint(public_key_text):
+            return
+    _key_cache.pop(user_id_hash)
+
+
+def key_cache_stats() -> dict:
+    """Hit/miss/eviction counters for this worker's parsed key cache"""
+    return _key_cache.stats()
+
+
+# =========================
+# SIGNATURES
+# =========================
+
+def verify_pgp_signature(
+    public_key_text: str,
+    signature_text: str,
+    data: str,
+    user_id_hash: bytes | None = None
+) -> bool:
     """
     Verify a PGP signature for a given data string using the provided public key.
+    Pass user_id_hash to reuse the parsed key across calls.
     """
     try:
         # Load the public key
-        key, _ = pgpy.PGPKey.from_blob(public_key_text)
-        
+        key = load_public_key(public_key_text, user_id_hash)
+
         # Load the signature
         sig = pgpy.PGPSignature.from_blob(signature_text)
-        
+
         # Verify the signature against the data
         # Note: In PGP, cleartext signatures are common, but here we expect a detached signature
         # for simplicity in our API.
@@ -22,3 +100,154 @@ def verify_pgp_signature(public_key_text: str, signature_text: str, data: str) -
     except Exception as e:
         print(f"Signature verification failed: {e}")
         return False
+
+
+# =========================
+# VERIFICATION PROCESS POOL
+# =========================
+
+# pgpy is pure Python and holds the GIL, so verifies in the threadpool still
+# serialize on one core. With PGP_VERIFY_WORKERS > 0 they run in child
+# processes instead; 0 keeps the threadpool path.
+PGP_VERIFY_WORKERS = int(os.getenv("PGP_VERIFY_WORKERS", "0"))
+# Verifies allowed in flight (queued or running) before new ones are rejected
+PGP_VERIFY_MAX_PENDING = int(os.getenv("PGP_VERIFY_MAX_PENDING", "256"))
+
+
+class VerificationBacklogFull(Exception):
+    """Raised when PGP_VERIFY_MAX_PENDING verifies are already in flight"""
+
+
+# One single-process executor per child, so a given user's verifies always
+# land on the same child and hit that child's parsed key cache.
+_verify_pools = []
+_round_robin = itertools.count()
+_pending = 0
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+
+def start_verify_pool(workers: int = PGP_VERIFY_WORKERS):
+    """Start the child processes (call once per uvicorn worker, after fork)"""
+    global _verify_pools
+    if workers <= 0 or _verify_pools:
+        return
+    _verify_pools = [_new_pool() for _ in range(workers)]
+
+
+def shutdown_verify_pool():
+    global _verify_pools
+    pools, _verify_pools = _verify_pools, []
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _pick_pool(user_id_hash: bytes | None) -> int:
+    if user_id_hash:
+        return int.from_bytes(user_id_hash[:4], 'big') % len(_verify_pools)
+    return next(_round_robin) % len(_verify_pools)
+
+
+def _replace_broken_pool(index: int, broken: ProcessPoolExecutor):
+    """Start a fresh child in place of one that died (once, however many calls saw it break)"""
+    if index < len(_verify_pools) and _verify_pools[index] is broken:
+        _verify_pools[index] = _new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def verify_pgp_signature_async(
+    public_key_text: str,
+    signature_text: str,
+    data: str,
+    user_id_hash: bytes | None = None
+) -> bool:
+    """
+    Awaitable verify_pgp_signature. Runs in the process pool when it is
+    started, otherwise in the threadpool. Raises VerificationBacklogFull
+    when too many verifies are already pending.
+    """
+    global _pending
+    call = partial(verify_pgp_signature, public_key_text, signature_text, data, user_id_hash=user_id_hash)
+    if not _verify_pools:
+        with stage_timer("pgp_verify"):
+            return await run_in_threadpool(call)
+
+    # Only touched from the event loop thread, so no lock needed
+    if _pending >= PGP_VERIFY_MAX_PENDING:
+        raise VerificationBacklogFull()
+    _pending += 1
+    index = _pick_pool(user_id_hash)
+    pool = _verify_pools[index]
+    try:
+        with stage_timer("pgp_verify"):
+            return await asyncio.get_running_loop().run_in_executor(pool, call)
+    except BrokenProcessPool:
+        # This call might be what killed the child, so it isn't retried there
+        print("⚠️ PGP verify process died, restarting it; verifying this request in-process")
+        _replace_broken_pool(index, pool)
+        return await run_in_threadpool(call)
+    finally:
+        _pending -= 1
+
+
+# =========================
+# SESSION TOKENS
+# =========================
+
+# Must be identical on every worker, otherwise tokens only work on the worker that issued them
+SESSION_TOKEN_SECRET = os.getenv("SESSION_TOKEN_SECRET", "").encode('utf-8')
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "300"))
+
+if not SESSION_TOKEN_SECRET:
+    print("⚠️ SESSION_TOKEN_SECRET not set, using a per-process random secret")
+    SESSION_TOKEN_SECRET = secrets.token_bytes(32)
+
+_TOKEN_VERSION = 1
+# version (1) + expires_at (8) + user_id_hash (32) + recipient_hash (32)
+_TOKEN_PAYLOAD_SIZE = 73
+
+
+class InvalidSessionToken(Exception):
+    """Malformed, forged, expired, or issued to another user"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_session_token(user_id_hash: bytes, recipient_hash: bytes, ttl: int = SESSION_TOKEN_TTL) -> tuple:
+    """
+    HMAC-signed token binding a user to their mailbox after one PGP check.
+    Returns (token, expires_at unix time).
+    """
+    expires_at = int(time.time()) + ttl
+    payload = bytes([_TOKEN_VERSION]) + expires_at.to_bytes(8, 'big') + user_id_hash + recipient_hash
+    mac = hmac.new(SESSION_TOKEN_SECRET, payload, hashlib.sha256).digest()
+    return f"{_b64encode(payload)}.{_b64encode(mac)}", expires_at
+
+
+def verify_session_token(token: str, user_id_hash: bytes) -> bytes:
+    """Check a session token for this user and return the recipient hash it grants"""
+    try:
+        payload_text, mac_text = token.split(".", 1)
+        payload = _b64decode(payload_text)
+        mac = _b64decode(mac_text)
+    except ValueError:
+        raise InvalidSessionToken()
+
+    expected = hmac.new(SESSION_TOKEN_SECRET, payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(mac, expected):
+        raise InvalidSessionToken()
+    if len(payload) != _TOKEN_PAYLOAD_SIZE or payload[0] != _TOKEN_VERSION:
+        raise InvalidSessionToken()
+    if int.from_bytes(payload[1:9], 'big') < time.time():
+        raise InvalidSessionToken()
+    if not hmac.compare_digest(payload[9:41], user_id_hash):
+        raise InvalidSessionToken()
+    return payload[41:73]
@@ -1,21 +1,121 @@
 # app/core/user.py
 
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
+from app.core.security import invalidate_cached_key
+from app.utils.cache import LRUCache
+from app.utils.metrics import stage_timer
+import os
+import sys
 import hashlib
+import threading
+
+# =========================
+# PUBLIC KEY CACHE
+# =========================
+
+# Keys almost never change, but are looked up on every send and receive.
+# register_user invalidates the local entry and broadcasts the change to the
+# other workers over NOTIFY; the TTL bounds staleness if that is unavailable.
+PUBLIC_KEY_CACHE_SIZE = int(os.getenv("PUBLIC_KEY_CACHE_SIZE", "10000"))
+PUBLIC_KEY_CACHE_TTL = float(os.getenv("PUBLIC_KEY_CACHE_TTL", "300"))
+# Unknown users are cached briefly so a user registering on another worker shows up quickly
+PUBLIC_KEY_NEGATIVE_TTL = float(os.getenv("PUBLIC_KEY_NEGATIVE_TTL", "5"))
+
+# Cached value for "no such user"
+_NOT_FOUND = b""
+
+# user_id_hash -> armored public key bytes (or _NOT_FOUND)
+_public_key_cache = LRUCache(
+    PUBLIC_KEY_CACHE_SIZE,
+    ttl=PUBLIC_KEY_CACHE_TTL,
+    sizeof=lambda key, value: sys.getsizeof(key) + sys.getsizeof(value)
+)
+
+
+# A lookup that read the database before a re-registration committed must not
+# cache what it read after the invalidation. Invalidating bumps a generation
+# counter (striped over a fixed number of slots, so memory stays constant) and
+# a fill only goes in if its slot's generation is unchanged since the read.
+_GENERATION_SLOTS = 4096
+_generations = [0] * _GENERATION_SLOTS
+_generation_lock = threading.Lock()
+
+
+def _generation_slot(user_id_hash: bytes) -> int:
+    return int.from_bytes(user_id_hash[:4], 'big') % _GENERATION_SLOTS
+
+
+def _cache_generation(user_id_hash: bytes) -> int:
+    """Take before reading the key from the database, pass to _cache_public_key"""
+    return _generations[_generation_slot(user_id_hash)]
+
+
+def _cache_public_key(user_id_hash: bytes, public_key: bytes | None, generation: int):
+    slot = _generation_slot(user_id_hash)
+    with _generation_lock:
+        if _generations[slot] != generation:
+            # Invalidated while we were reading; what we read may be the old key
+            return
+        if public_key is None:
+            _public_key_cache.set(user_id_hash, _NOT_FOUND, ttl=PUBLIC_KEY_NEGATIVE_TTL)
+        else:
+            _public_key_cache.set(user_id_hash, public_key)
+
+
+def _drop_public_key(user_id_hash: bytes):
+    """Remove the cached key and fail any fill that read before now"""
+    slot = _generation_slot(user_id_hash)
+    with _generation_lock:
+        _generations[slot] += 1
+        _public_key_cache.pop(user_id_hash)
+
+
+def _cached_public_key(user_id_hash: bytes):
+    """Returns (hit, public_key); public_key is None for a cached unknown user"""
+    cached = _public_key_cache.get(user_id_hash)
+    if cached is None:
+        return False, None
+    return True, (cached or None)
+
+
+# NOTIFY channel announcing a new or changed registration (payload: user_id_hash hex)
+KEY_CHANGED_CHANNEL = "vc_user_key_changed"
+
+
+def invalidate_public_key(user_id_hash: bytes):
+    _drop_public_key(user_id_hash)
+    invalidate_cached_key(user_id_hash)
+
+
+def on_key_changed(payload: str):
+    """Handler for KEY_CHANGED_CHANNEL notifications from other workers"""
+    invalidate_public_key(bytes.fromhex(payload))
+
+
+def _key_changed_statement(user_id_hash: bytes):
+    return select(func.pg_notify(KEY_CHANGED_CHANNEL, user_id_hash.hex()))
+
+
+def public_key_cache_stats() -> dict:
+    """Hit rate and approximate memory footprint of this worker's public key cache"""
+    return _public_key_cache.stats()
+
 
 def hash_user_id(user_id: str) -> bytes:
     """Hash user ID for privacy"""
     return hashlib.sha256(user_id.encode()).digest()
 
-def register_user(db: Session, user_id: str, public_key: bytes):
-    """Register a new user with their public key"""
-    user_id_hash = hash_user_id(user_id)
-    
-    # Check if user already exists
-    existing = db.query(User).filter(User.user_id_hash == user_id_hash).first()
+def _apply_registration(db, existing, user_id_hash: bytes, public_key: bytes) -> bool:
+    """Returns True if this creates the user or changes their key"""
+    if existing and existing.public_key == public_key:
+        return False
     if existing:
         # Update public key if user exists
+        # Key rotated: the cached parse of the old key is now stale
+        invalidate_cached_key(user_id_hash, public_key.decode('utf-8'))
         existing.public_key = public_key
     else:
         # Create new user
@@ -24,16 +124,86 @@ def register_user(db: Session, user_id: str, public_key: bytes):
             public_key=public_key
         )
         db.add(user)
+    return True
+
+def register_user(db: Session, user_id: str, public_key: bytes):
+    """Register a new user with their public key"""
+    user_id_hash = hash_user_id(user_id)
+    
+    # Check if user already exists
+    existing = db.query(User).filter(User.user_id_hash == user_id_hash).first()
+    changed = _apply_registration(db, existing, user_id_hash, public_key)
+    if changed and db.get_bind().dialect.name == "postgresql":
+        db.execute(_key_changed_statement(user_id_hash))
     
     db.commit()
+    # After commit (a lookup that read the old key before it is kept out by the generation)
+    _drop_public_key(user_id_hash)
+
+async def register_user_async(db: AsyncSession, user_id: str, public_key: bytes):
+    """Async version of register_user"""
+    user_id_hash = hash_user_id(user_id)
+
+    result = await db.execute(select(User).where(User.user_id_hash == user_id_hash))
+    changed = _apply_registration(db, result.scalars().first(), user_id_hash, public_key)
+    if changed and db.get_bind().dialect.name == "postgresql":
+        await db.execute(_key_changed_statement(user_id_hash))
+
+    await db.commit()
+    _drop_public_key(user_id_hash)
 
 def get_public_key(db: Session, user_id: str) -> bytes:
     """Get user's public key by user_id"""
     user_id_hash = hash_user_id(user_id)
+    hit, public_key = _cached_public_key(user_id_hash)
+    if hit:
+        return public_key
     
+    generation = _cache_generation(user_id_hash)
     user = db.query(User).filter(User.user_id_hash == user_id_hash).first()
+    public_key = user.public_key if user is not None else None
+    _cache_public_key(user_id_hash, public_key, generation)
     
-    if user is None:
-        return None
-    
-    return user.public_key
\ No newline at end of file
+    return public_key
+
+async def get_public_key_async(db: AsyncSession, user_id: str) -> bytes:
+    """Async version of get_public_key (loads only the key column)"""
+    user_id_hash = hash_user_id(user_id)
+    hit, public_key = _cached_public_key(user_id_hash)
+    if hit:
+        return public_key
+
+    generation = _cache_generation(user_id_hash)
+    with stage_timer("public_key_lookup"):
+        result = await db.execute(
+            select(User.public_key).where(User.user_id_hash == user_id_hash)
+        )
+    public_key = result.scalar_one_or_none()
+    _cache_public_key(user_id_hash, public_key, generation)
+    return public_key
+
+async def get_public_keys_async(db: AsyncSession, user_ids: list) -> dict:
+    """Resolve many user_ids in one query. Unknown users are left out of the result."""
+    keys = {}
+    missing = {}
+    for user_id in set(user_ids):
+        user_id_hash = hash_user_id(user_id)
+        hit, public_key = _cached_public_key(user_id_hash)
+        if not hit:
+            missing[user_id_hash] = (user_id, _cache_generation(user_id_hash))
+        elif public_key is not None:
+            keys[user_id] = public_key
+    if not missing:
+        return keys
+
+    with stage_timer("public_key_lookup"):
+        result = await db.execute(
+            select(User.user_id_hash, User.public_key).where(User.user_id_hash.in_(list(missing)))
+        )
+    found = {row.user_id_hash: row.public_key for row in result}
+    for user_id_hash, (user_id, generation) in missing.items():
+        public_key = found.get(user_id_hash)
+        _cache_public_key(user_id_hash, public_key, generation)
+        if public_key is not None:
+            keys[user_id] = public_key
+    return keys
@@ -1,13 +1,24 @@
 # app/infra/init_db.py
 
+from sqlalchemy import inspect
 from app.infra.postgres import Base, engine
 from app.models.user import User
 from app.models.message import Message
+from app.models.mailbox_usage import MailboxUsage
+from app.core.message import rebuild_mailbox_usage
+from app.services.expiry_reaper import is_partitioned, ensure_partitions
 
 def init_db():
     """Create all tables in the database"""
     print("Creating database tables...")
+    new_usage_table = not inspect(engine).has_table(MailboxUsage.__tablename__)
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            ensure_partitions(conn)
+        if new_usage_table:
+            # Count the messages already queued so quotas apply to them too
+            rebuild_mailbox_usage(conn)
     print("✓ Tables created successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+# app/infra/pg_notify.py
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import psycopg2.extensions
+
+from app.infra.postgres import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reconnect attempts after the LISTEN connection drops
+RECONNECT_DELAY_SECONDS = 2
+
+
+def mailbox_channel(recipient_hash: bytes) -> str:
+    """
+    NOTIFY channel for one recipient's mailbox.
+    Identifiers are capped at 63 bytes, so the hex hash is truncated to 224 bits.
+    """
+    return "mbx_" + recipient_hash.hex()[:56]
+
+
+class PostgresMailboxListener:
+    """
+    Cross-worker wakeups for the mailbox notifier.
+
+    Holds one dedicated autocommit psycopg2 connection per worker and only
+    LISTENs on channels that have a local waiter. psycopg2 blocks, so the
+    connection is only ever touched from one dedicated thread; the event
+    loop just watches its socket (loop.add_reader) and the notifier hooks
+    only record which channels are wanted. A single task owns the
+    connection: it connects (retrying while Postgres is down, at boot too),
+    issues pending LISTEN/UNLISTENs as one batch per round trip, and reads
+    notifications when the socket becomes readable. notify() sends on the
+    same connection, queued behind whatever the thread is doing.
+    """
+
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self._conn = None
+        self._loop = None
+        self._executor = None
+        self._task = None
+        self._wake = None
+        self._readable = False
+        self._channels = {}     # channel -> recipient_hash (wanted)
+        self._handlers = {}     # fixed channel -> callback(payload)
+        self._listening = set()  # channels LISTENed on the current connection
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.closed
+
+    def start(self):
+        """Attach to the notifier and connect in the background"""
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pg-listen")
+        self._wake = asyncio.Event()
+        self.notifier.listener = self
+        self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self.notifier.listener is self:
+            self.notifier.listener = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._executor is not None:
+            # Close on the connection's own thread, after anything still in flight there
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                self._loop.remove_reader(conn.fileno())
+                self._executor.submit(conn.close)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def add_handler(self, channel: str, callback):
+        """LISTEN on a fixed channel for the lifetime of the listener; callback gets the payload"""
+        self._handlers[channel] = callback
+        self._request_sync()
+
+    def notify(self, channel: str, payload: str) -> bool:
+        """
+        Send a NOTIFY from the listener's connection (callable from any thread,
+        never blocks). Returns False, dropping it, while disconnected.
+        """
+        executor = self._executor
+        if executor is None or not self.connected:
+            return False
+        try:
+            executor.submit(self._notify, channel, payload)
+        except RuntimeError:
+            # Shutting down
+            return False
+        return True
+
+    # ---------- notifier hooks (event loop thread, never block) ----------
+
+    def on_first_subscriber(self, recipient_hash: bytes):
+        self._channels[mailbox_channel(recipient_hash)] = recipient_hash
+        self._request_sync()
+
+    def on_last_unsubscriber(self, recipient_hash: bytes):
+        if self._channels.pop(mailbox_channel(recipient_hash), None) is not None:
+            self._request_sync()
+
+    def _request_sync(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    # ---------- connection (dedicated thread) ----------
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, dbname=DB_NAME
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _execute(self, sql: str):
+        with self._conn.cursor() as cur:
+            cur.execute(sql)
+
+    def _notify(self, channel: str, payload: str):
+        conn = self._conn
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+        except (psycopg2.Error, AttributeError) as e:
+            # Reconnecting (the owner task notices on its own)
+            logger.warning(f"NOTIFY on {channel} dropped: {e}")
+            return
+        # Notifications that arrived with the reply are already read off the socket
+        if conn.notifies:
+            self._loop.call_soon_threadsafe(self._notifies_pending)
+
+    def _poll(self) -> list:
+        self._conn.poll()
+        notes = list(self._conn.notifies)
+        self._conn.notifies.clear()
+        return notes
+
+    async def _in_thread(self, fn, *args):
+        return await self._loop.run_in_executor(self._executor, fn, *args)
+
+    def _close(self):
+        self._listening.clear()
+        self._readable = False
+        if self._conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _notifies_pending(self):
+        self._readable = True
+        self._wake.set()
+
+    def _on_readable(self):
+        # Stop watching until the owner task has polled, or this fires in a loop
+        self._loop.remove_reader(self._conn.fileno())
+        self._readable = True
+        self._wake.set()
+
+    # ---------- owner task ----------
+
+    async def _run(self):
+        failing = False
+        while True:
+            if not self.connected:
+                try:
+                    self._conn = await self._in_thread(self._connect)
+                except psycopg2.Error as e:
+                    if not failing:
+                        logger.warning(f"Mailbox LISTEN connection unavailable, wakeups stay in-process until it is back: {e}")
+                        failing = True
+                    await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+                    continue
+                logger.info("Mailbox LISTEN/NOTIFY bridge connected")
+                failing = False
+                self._loop.add_reader(self._conn.fileno(), self._on_readable)
+
+            self._wake.clear()
+            try:
+                if self._readable:
+                    self._readable = False
+                    self._dispatch(await self._in_thread(self._poll))
+                    self._loop.add_reader(self._conn.fileno(), self._on_readable)
+                await self._sync_channels()
+            except psycopg2.Error as e:
+                logger.warning(f"Mailbox LISTEN connection lost: {e}")
+                self._close()
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+                continue
+
+            if not self._readable and self._listening == self._wanted():
+                await self._wake.wait()
+
+    def _wanted(self) -> set:
+        return set(self._channels) | set(self._handlers)
+
+    async def _sync_channels(self):
+        """Bring the connection's LISTENs in line with the wanted channels, in one round trip"""
+        wanted = self._wanted()
+        listen = wanted - self._listening
+        unlisten = self._listening - wanted
+        if not listen and not unlisten:
+            return
+        sql = "; ".join([f'LISTEN "{c}"' for c in listen] + [f'UNLISTEN "{c}"' for c in unlisten])
+        await self._in_thread(self._execute, sql)
+        self._listening = wanted
+        if self._conn.notifies:
+            self._readable = True
+        # A message stored on another worker before the LISTEN took effect was
+        # never announced to us: wake those mailboxes so their waiters re-check
+        for channel in listen:
+            recipient_hash = self._channels.get(channel)
+            if recipient_hash is not None:
+                self.notifier.publish(recipient_hash)
+
+    def _dispatch(self, notes: list):
+        for note in notes:
+            handler = self._handlers.get(note.channel)
+            if handler is not None:
+                try:
+                    handler(note.payload)
+                except Exception as e:
+                    logger.error(f"NOTIFY handler for {note.channel} failed: {e}")
+                continue
+            recipient_hash = self._channels.get(note.channel)
+            if recipient_hash is not None:
+                self.notifier.publish(recipient_hash)
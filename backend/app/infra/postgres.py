@@ -2,8 +2,12 @@ import os
 from sqlalchemy.orm import sessionmaker, declarative_base
 from contextlib import contextmanager
 from sqlalchemy import create_engine, text  # <-- add text here
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from time import perf_counter
 
 from app.models.base import Base
+from app.utils.metrics import DB_POOL_CHECKOUT, GaugeCallback
 
 # =========================
 # CONFIGURATION
@@ -19,6 +23,37 @@ DB_NAME = os.getenv("DB_NAME", "vaultchat")
 
 # Build PostgreSQL connection URL
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Pool sizing (per worker process, per engine)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# =========================
+# POOL INSTRUMENTATION
+# =========================
+
+# SQLAlchemy has no event for "waiting on the pool", so time _do_get,
+# the call that blocks until a connection is free (or a new one is opened).
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _sync_checkout.observe(perf_counter() - start)
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _async_checkout.observe(perf_counter() - start)
+
+_sync_checkout = DB_POOL_CHECKOUT.labels("sync")
+_async_checkout = DB_POOL_CHECKOUT.labels("async")
 
 # =========================
 # ENGINE CONFIGURATION
@@ -26,13 +61,52 @@ DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 engine = create_engine(
     DATABASE_URL,
-    pool_pre_ping=True,  # Check connections before using them
-    pool_size=5,         # Maintain 5 connections in the pool
-    max_overflow=10,     # Allow 10 extra connections if needed
-    pool_recycle=3600,   # Recycle connections every hour
-    echo=False           # Set True to see SQL statements (debugging)
+    poolclass=TimedQueuePool,
+    pool_pre_ping=True,            # Check connections before using them
+    pool_size=DB_POOL_SIZE,        # Connections kept open in the pool
+    max_overflow=DB_MAX_OVERFLOW,  # Extra connections allowed under load
+    pool_timeout=DB_POOL_TIMEOUT,  # Seconds to wait for a free connection
+    pool_recycle=3600,             # Recycle connections every hour
+    echo=False                     # Set True to see SQL statements (debugging)
 )
 
+# Async engine (asyncpg) used by the async API routes.
+# Requests wait on the pool instead of holding a threadpool slot.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=TimedAsyncAdaptedQueuePool,
+    pool_pre_ping=True,
+    pool_size=int(os.getenv("DB_ASYNC_POOL_SIZE", DB_POOL_SIZE)),
+    max_overflow=int(os.getenv("DB_ASYNC_MAX_OVERFLOW", DB_MAX_OVERFLOW)),
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=3600,
+    echo=False
+)
+
+def pool_stats() -> dict:
+    """Connection counts for both pools (this worker only)"""
+    return {
+        name: {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+        }
+        for name, pool in (("sync", engine.pool), ("async", async_engine.pool))
+    }
+
+for _field, _doc in (
+    ("checked_out", "Connections currently in use"),
+    ("idle", "Open connections waiting in the pool"),
+    ("overflow", "Connections beyond pool_size (negative while the pool is still filling)"),
+    ("size", "Configured pool_size"),
+):
+    GaugeCallback(
+        f"vaultchat_db_pool_{_field}", _doc,
+        lambda field=_field: {name: stats[field] for name, stats in pool_stats().items()},
+        labelname="pool"
+    )
+
 # =========================
 # SESSION CONFIGURATION
 # =========================
@@ -43,6 +117,12 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    autoflush=False,
+    expire_on_commit=False  # Routes read rows after commit
+)
+
 # =========================
 # DATABASE FUNCTIONS
 # =========================
@@ -61,6 +141,17 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """
+    FastAPI dependency to provide an AsyncSession to async routes.
+    Usage:
+        async def my_route(db: AsyncSession = Depends(get_async_db)):
+            ...
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 @contextmanager
 def db_session():
     """
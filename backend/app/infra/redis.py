@@ -1,2 +1,5 @@
+import os
 import redis
-redis_client = redis.Redis(host="localhost", port=6379, decode_responses=True)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
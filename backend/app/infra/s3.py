@@ -1,2 +1,212 @@
+# app/infra/s3.py
+
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+# =========================
+# CONFIGURATION
+# =========================
+
+# "local" (directory on disk, also used by tests) or "s3" (needs boto3)
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_ROOT = os.getenv("BLOB_STORE_ROOT", "./blobstore")
+# Optional endpoint for S3-compatible services (MinIO, R2, ...)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobStore(ABC):
+    """
+    Minimal S3-style object store for opaque (already encrypted) blobs.
+    Objects are written whole; reads can stream.
+    """
+
+    @abstractmethod
+    def put_object(self, bucket: str, key: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def get_object(self, bucket: str, key: str) -> bytes:
+        """Raises BlobNotFound"""
+
+    @abstractmethod
+    def iter_object(self, bucket: str, key: str, chunk_size: int = READ_CHUNK_SIZE):
+        """Yield the object in pieces without loading it whole. Raises BlobNotFound."""
+
+    @abstractmethod
+    def head_object(self, bucket: str, key: str) -> int | None:
+        """Object size in bytes, or None if it doesn't exist"""
+
+    @abstractmethod
+    def object_mtime(self, bucket: str, key: str) -> float | None:
+        """Last write as a unix timestamp, or None if it doesn't exist"""
+
+    @abstractmethod
+    def delete_object(self, bucket: str, key: str):
+        ...
+
+    @abstractmethod
+    def list_objects(self, bucket: str, prefix: str = "") -> list:
+        """Keys under prefix"""
+
+# =========================
+# LOCAL DISK BACKEND
+# =========================
+
+class LocalBlobStore(BlobStore):
+    """Objects are files under root/bucket/key; writes are atomic (temp file + rename)."""
+
+    def __init__(self, root: str = BLOB_STORE_ROOT):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def put_object(self, bucket: str, key: str, data: bytes):
+        path = self._path(bucket, key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get_object(self, bucket: str, key: str) -> bytes:
+        try:
+            with open(self._path(bucket, key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFound(f"{bucket}/{key}")
+
+    def iter_object(self, bucket: str, key: str, chunk_size: int = READ_CHUNK_SIZE):
+        try:
+            f = open(self._path(bucket, key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(f"{bucket}/{key}")
+        return self._iter_file(f, chunk_size)
+
+    @staticmethod
+    def _iter_file(f, chunk_size: int):
+        with f:
+            while True:
+                piece = f.read(chunk_size)
+                if not piece:
+                    return
+                yield piece
+
+    def head_object(self, bucket: str, key: str) -> int | None:
+        try:
+            return os.path.getsize(self._path(bucket, key))
+        except FileNotFoundError:
+            return None
+
+    def object_mtime(self, bucket: str, key: str) -> float | None:
+        try:
+            return os.path.getmtime(self._path(bucket, key))
+        except FileNotFoundError:
+            return None
+
+    def delete_object(self, bucket: str, key: str):
+        try:
+            os.unlink(self._path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, bucket: str, prefix: str = "") -> list:
+        base = os.path.join(self.root, bucket)
+        # Only walk the directory the prefix points into
+        start = os.path.join(base, os.path.dirname(prefix))
+        keys = []
+        for directory, _, files in os.walk(start):
+            for name in files:
+                if name.startswith(".tmp-"):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), base).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+# =========================
+# S3 BACKEND
+# =========================
+
+class S3BlobStore(BlobStore):
+    """Same interface on S3 or an S3-compatible service (boto3 is only needed for this backend)."""
+
+    def __init__(self, endpoint_url: str | None = S3_ENDPOINT_URL):
+        import boto3
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._missing = self.client.exceptions.NoSuchKey
+
+    def put_object(self, bucket: str, key: str, data: bytes):
+        self.client.put_object(Bucket=bucket, Key=key, Body=data)
+
+    def get_object(self, bucket: str, key: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except self._missing:
+            raise BlobNotFound(f"{bucket}/{key}")
+
+    def iter_object(self, bucket: str, key: str, chunk_size: int = READ_CHUNK_SIZE):
+        try:
+            body = self.client.get_object(Bucket=bucket, Key=key)["Body"]
+        except self._missing:
+            raise BlobNotFound(f"{bucket}/{key}")
+        return body.iter_chunks(chunk_size)
+
+    def head_object(self, bucket: str, key: str) -> int | None:
+        try:
+            return self.client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        except self.client.exceptions.ClientError:
+            return None
+
+    def object_mtime(self, bucket: str, key: str) -> float | None:
+        try:
+            return self.client.head_object(Bucket=bucket, Key=key)["LastModified"].timestamp()
+        except self.client.exceptions.ClientError:
+            return None
+
+    def delete_object(self, bucket: str, key: str):
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+    def list_objects(self, bucket: str, prefix: str = "") -> list:
+        keys = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(item["Key"] for item in page.get("Contents", ()))
+        return sorted(keys)
+
+# =========================
+# FACTORY
+# =========================
+
+_blob_store = None
+
+
+def get_blob_store() -> BlobStore:
+    """The configured store for this process (created on first use)"""
+    global _blob_store
+    if _blob_store is None:
+        if BLOB_STORE_BACKEND == "s3":
+            _blob_store = S3BlobStore()
+        elif BLOB_STORE_BACKEND == "local":
+            _blob_store = LocalBlobStore()
+        else:
+            raise ValueError(f"Unknown BLOB_STORE_BACKEND: {BLOB_STORE_BACKEND}")
+    return _blob_store
+
+
 def upload_encrypted_blob(bucket: str, key: str, data: bytes):
-    pass  # cloud-agnostic placeholder
+    get_blob_store().put_object(bucket, key, data)
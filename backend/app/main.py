@@ -1,14 +1,70 @@
 # app/main.py
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import users, messages, rooms  # Add rooms
+from app.api import users, messages, rooms, auth, files  # Add rooms
 from app.utils.logger import setup_logger
+from app.core.security import key_cache_stats, start_verify_pool, shutdown_verify_pool
+from app.core.circuit_breaker import rate_limit_stats
+from app.core.user import public_key_cache_stats, on_key_changed, KEY_CHANGED_CHANNEL
+from app.infra.pg_notify import PostgresMailboxListener
+from app.infra.postgres import async_engine
+from app.services.notification_service import mailbox_notifier
+from app.services.expiry_reaper import ExpiryReaper
+from app.services.upload_reaper import UploadReaper
+from app.services.room_store import get_room_store
+from app.services.ephemeral_store import ephemeral_store
+from app.utils.metrics import MetricsMiddleware, StatsCollector, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import logging
+
+reaper = ExpiryReaper(async_engine)
+upload_reaper = UploadReaper(async_engine)
+
+# Scraped on /metrics alongside the request/stage histograms and pool gauges
+StatsCollector("vaultchat_pgp_key_cache", "Parsed PGP key cache (this worker)", key_cache_stats)
+StatsCollector("vaultchat_public_key_cache", "Public key lookup cache (this worker)", public_key_cache_stats)
+StatsCollector("vaultchat_rooms", "Room store", lambda: get_room_store().stats())
+StatsCollector("vaultchat_ephemeral", "Ephemeral message buffers (this worker's copy)", ephemeral_store.stats)
+StatsCollector("vaultchat_reaper", "Expiry reaper totals (this worker's sweeps)", lambda: reaper.totals)
+StatsCollector("vaultchat_upload_reaper", "Upload reaper totals (this worker's sweeps)", lambda: upload_reaper.totals)
+StatsCollector("vaultchat_rate_limit", "Token-bucket rate limiters (this worker)", rate_limit_stats)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cross-worker mailbox wakeups for long-poll and /messages/stream
+    # (connects in the background, retrying while Postgres is unavailable)
+    listener = PostgresMailboxListener(mailbox_notifier)
+    listener.start()
+    # Drop cached public keys when a user (re-)registers on another worker
+    listener.add_handler(KEY_CHANGED_CHANNEL, on_key_changed)
+    # Copy typing/receipt/ICE signals to the other workers' buffers
+    ephemeral_store.attach(listener)
+
+    # Make sure upcoming message partitions exist before taking traffic
+    try:
+        await reaper.run_once()
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Initial expiry sweep failed: {e}")
+    reaper.start()
+    # Expired upload sessions and unreferenced attachment chunks (first sweep after one interval)
+    upload_reaper.start()
+
+    # PGP verification process pool (no-op unless PGP_VERIFY_WORKERS > 0)
+    start_verify_pool()
+
+    yield
+
+    shutdown_verify_pool()
+    await reaper.stop()
+    await upload_reaper.stop()
+    listener.stop()
 
 app = FastAPI(
     title="Vault Backend",
     version="1.0.0",
-    description="Zero-knowledge secure messaging backend"
+    description="Zero-knowledge secure messaging backend",
+    lifespan=lifespan
 )
 
 # CORS
@@ -19,6 +75,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the timing covers the other middleware too
+app.add_middleware(MetricsMiddleware)
 
 setup_logger()
 
@@ -26,7 +84,43 @@ setup_logger()
 app.include_router(users.router, tags=["Users"])
 app.include_router(messages.router, tags=["Messages"])
 app.include_router(rooms.router, tags=["Rooms"])  # Add this
+app.include_router(auth.router, tags=["Auth"])
+app.include_router(files.router, tags=["Files"])
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text exposition (this worker's counters)"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/health/caches")
+def cache_stats():
+    """Per-worker cache counters (each uvicorn worker has its own caches)"""
+    return {"pgp_keys": key_cache_stats(), "public_keys": public_key_cache_stats()}
+
+@app.get("/health/rooms")
+def room_stats():
+    """Room store counters (per worker for the in-memory backend)"""
+    return get_room_store().stats()
+
+@app.get("/health/ephemeral")
+def ephemeral_stats():
+    """This worker's copy of the ephemeral message buffers"""
+    return ephemeral_store.stats()
+
+@app.get("/health/rate-limits")
+def rate_limit_health():
+    """Tracked clients and configured rates (each worker limits on its own)"""
+    return rate_limit_stats()
+
+@app.get("/health/reaper")
+def reaper_stats():
+    """What the expiry and upload reapers reclaimed (this worker's sweeps only)"""
+    return {
+        "last_sweep": reaper.last_sweep,
+        "totals": reaper.totals,
+        "uploads": {"last_sweep": upload_reaper.last_sweep, "totals": upload_reaper.totals}
+    }
\ No newline at end of file
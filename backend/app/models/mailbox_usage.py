@@ -0,0 +1,18 @@
+# app/models/mailbox_usage.py
+
+from sqlalchemy import Column, BigInteger, Integer, LargeBinary, Date
+from app.infra.postgres import Base
+
+class MailboxUsage(Base):
+    """
+    Pending messages and ciphertext bytes per recipient and expiry day, kept
+    in step with messages by store/fetch so quota checks read a few rows
+    instead of the whole mailbox. Days line up with the messages partitions,
+    and the expiry reaper deletes past days along with them.
+    """
+    __tablename__ = "mailbox_usage"
+
+    recipient_hash = Column(LargeBinary, primary_key=True)
+    expires_on = Column(Date, primary_key=True)
+    pending = Column(Integer, nullable=False, default=0)
+    bytes = Column(BigInteger, nullable=False, default=0)
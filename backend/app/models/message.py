@@ -1,11 +1,18 @@
-from sqlalchemy import Column, Integer, String, LargeBinary, DateTime
+from sqlalchemy import Column, BigInteger, String, LargeBinary, DateTime
 from datetime import datetime, timedelta
 from app.infra.postgres import Base
 
 class Message(Base):
     __tablename__ = "messages"
+
+    # Range-partitioned by expiry day on PostgreSQL so expired messages can be
+    # dropped a whole partition at a time (see app/services/expiry_reaper.py).
+    # Partitions are created by the reaper, not by create_all.
+    __table_args__ = {"postgresql_partition_by": "RANGE (expires_at)"}
     
-    id = Column(Integer, primary_key=True)
+    # A partitioned table's primary key must include the partition key,
+    # so the key is (id, expires_at); id alone is still unique via its sequence.
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     
     # Changed from recipient_id (String) to recipient_hash (LargeBinary)
     # This matches the 'recipient_hash' keyword argument in your store_message function
@@ -20,6 +27,7 @@ class Message(Base):
     
     expires_at = Column(
         DateTime, 
+        primary_key=True,
         nullable=False, 
         # Default is 7 days from now; store_message logic can still override this
         default=lambda: datetime.utcnow() + timedelta(days=7)
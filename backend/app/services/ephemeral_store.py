@@ -0,0 +1,228 @@
+# app/services/ephemeral_store.py
+
+import os
+import json
+import time
+import base64
+import secrets
+import logging
+import itertools
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from app.services.notification_service import mailbox_notifier
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# CONFIGURATION
+# =========================
+
+# Typing indicators, receipts and ICE candidates are useless after a few seconds
+EPHEMERAL_TTL_SECONDS = float(os.getenv("EPHEMERAL_TTL_SECONDS", "30"))
+# Per-recipient ring size; the oldest signal is dropped when it is full
+EPHEMERAL_MAX_PER_RECIPIENT = int(os.getenv("EPHEMERAL_MAX_PER_RECIPIENT", "256"))
+# Mailboxes kept per worker; the least recently written one is dropped past this
+EPHEMERAL_MAX_MAILBOXES = int(os.getenv("EPHEMERAL_MAX_MAILBOXES", "100000"))
+
+# NOTIFY channels copying puts to the other workers, and telling them what was taken
+EPHEMERAL_PUT_CHANNEL = "vc_ephemeral_put"
+EPHEMERAL_TAKEN_CHANNEL = "vc_ephemeral_taken"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD = 7999
+
+
+class EphemeralMessage:
+    """Same attributes as a fetched Message row, so receive can format both alike"""
+    __slots__ = ('id', 'ciphertext', 'sender_id', 'created_at', 'expires_at')
+
+    def __init__(self, id: str, ciphertext: bytes, sender_id: str, expires_at: float):
+        self.id = id
+        self.ciphertext = ciphertext
+        self.sender_id = sender_id
+        self.created_at = datetime.utcnow()
+        self.expires_at = expires_at
+
+
+class EphemeralStore:
+    """
+    Per-recipient in-memory ring buffers for short-lived signals. Nothing
+    touches the database: messages live EPHEMERAL_TTL_SECONDS at most and
+    are gone on restart.
+
+    Buffers are per worker. Once attach() has connected the store to the
+    LISTEN/NOTIFY bridge, every put is copied to the other workers (which
+    also wakes their waiters) and every take removes the copies elsewhere,
+    so a receiver can poll any worker. Message ids are the same on every
+    worker: a receiver that switches workers within the few milliseconds a
+    take takes to propagate can see a signal twice and should drop repeats.
+    Messages too big for a NOTIFY payload don't fit (see fits()).
+    """
+
+    def __init__(
+        self,
+        ttl: float = EPHEMERAL_TTL_SECONDS,
+        max_per_recipient: int = EPHEMERAL_MAX_PER_RECIPIENT,
+        max_mailboxes: int = EPHEMERAL_MAX_MAILBOXES
+    ):
+        self.ttl = ttl
+        self.max_per_recipient = max_per_recipient
+        self.max_mailboxes = max_mailboxes
+        # recipient_hash -> deque of EphemeralMessage, least recently written first
+        self._mailboxes = OrderedDict()
+        self._lock = threading.Lock()
+        # Worker id: keeps ids unique across workers and skips our own notifications
+        self.node = secrets.token_hex(4)
+        self._ids = itertools.count(1)
+        self.bridge = None
+        self.stored = 0
+        self.replicated = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def _prune_idle(self, now: float):
+        """Drop mailboxes at the cold end whose newest message has expired"""
+        while self._mailboxes:
+            recipient_hash, ring = next(iter(self._mailboxes.items()))
+            if ring and ring[-1].expires_at > now:
+                return
+            self.expired += len(ring)
+            del self._mailboxes[recipient_hash]
+
+    def attach(self, bridge):
+        """Share puts and takes with the other workers through a PostgresMailboxListener"""
+        self.bridge = bridge
+        bridge.add_handler(EPHEMERAL_PUT_CHANNEL, self.on_remote_put)
+        bridge.add_handler(EPHEMERAL_TAKEN_CHANNEL, self.on_remote_take)
+
+    def _put_payload(self, recipient_hash: bytes, message_id: str, ciphertext: bytes, sender_id: str) -> str:
+        return json.dumps({
+            "o": self.node,
+            "r": recipient_hash.hex(),
+            "i": message_id,
+            "s": sender_id,
+            "c": base64.b64encode(ciphertext).decode('ascii')
+        })
+
+    def fits(self, ciphertext: bytes, sender_id: str = "anonymous") -> bool:
+        """
+        True if put() can share this message with the other workers (always
+        true without a bridge). Callers store anything bigger durably.
+        """
+        if self.bridge is None:
+            return True
+        return len(self._put_payload(b"\0" * 32, "e" + self.node + "-" + "9" * 12, ciphertext, sender_id)) <= MAX_NOTIFY_PAYLOAD
+
+    def _buffer(self, recipient_hash: bytes, message: EphemeralMessage, now: float):
+        with self._lock:
+            self._prune_idle(now)
+            ring = self._mailboxes.get(recipient_hash)
+            if ring is None:
+                if len(self._mailboxes) >= self.max_mailboxes:
+                    _, evicted = self._mailboxes.popitem(last=False)
+                    self.dropped += len(evicted)
+                ring = self._mailboxes[recipient_hash] = deque(maxlen=self.max_per_recipient)
+            else:
+                self._mailboxes.move_to_end(recipient_hash)
+            if len(ring) == ring.maxlen:
+                self.dropped += 1  # deque drops the oldest on append
+            ring.append(message)
+
+    def put(self, recipient_hash: bytes, ciphertext: bytes, sender_id: str = "anonymous") -> EphemeralMessage:
+        """Buffer a message for a recipient, wake their local waiters and copy it to the other workers"""
+        now = time.monotonic()
+        # String ids can't collide with the integer ids of durable messages
+        message = EphemeralMessage(f"e{self.node}-{next(self._ids)}", ciphertext, sender_id, now + self.ttl)
+        self._buffer(recipient_hash, message, now)
+        with self._lock:
+            self.stored += 1
+
+        mailbox_notifier.publish(recipient_hash)
+        if self.bridge is not None:
+            self.bridge.notify(
+                EPHEMERAL_PUT_CHANNEL, self._put_payload(recipient_hash, message.id, ciphertext, sender_id)
+            )
+        return message
+
+    def on_remote_put(self, payload: str):
+        """Handler for EPHEMERAL_PUT_CHANNEL: buffer another worker's message here too"""
+        data = json.loads(payload)
+        if data["o"] == self.node:
+            return
+        now = time.monotonic()
+        recipient_hash = bytes.fromhex(data["r"])
+        message = EphemeralMessage(data["i"], base64.b64decode(data["c"]), data["s"], now + self.ttl)
+        self._buffer(recipient_hash, message, now)
+        with self._lock:
+            self.replicated += 1
+        mailbox_notifier.publish(recipient_hash)
+
+    def on_remote_take(self, payload: str):
+        """Handler for EPHEMERAL_TAKEN_CHANNEL: drop what a receiver took on another worker"""
+        data = json.loads(payload)
+        if data["o"] == self.node:
+            return
+        recipient_hash = bytes.fromhex(data["r"])
+        taken = set(data["i"])
+        with self._lock:
+            ring = self._mailboxes.get(recipient_hash)
+            if ring is None:
+                return
+            kept = [message for message in ring if message.id not in taken]
+            if not kept:
+                del self._mailboxes[recipient_hash]
+            elif len(kept) < len(ring):
+                ring.clear()
+                ring.extend(kept)
+
+    def take(self, recipient_hash: bytes, limit: int) -> tuple:
+        """Remove and return up to limit live messages, oldest first. Returns (messages, more_pending)."""
+        now = time.monotonic()
+        with self._lock:
+            ring = self._mailboxes.get(recipient_hash)
+            if ring is None:
+                return [], False
+            messages = []
+            while ring and len(messages) < limit:
+                message = ring.popleft()
+                if message.expires_at <= now:
+                    self.expired += 1
+                    continue
+                messages.append(message)
+            if not ring:
+                del self._mailboxes[recipient_hash]
+            self.delivered += len(messages)
+            more_pending = bool(ring)
+
+        if messages and self.bridge is not None:
+            ids = [message.id for message in messages]
+            # A few hundred ids per notification keeps it under MAX_NOTIFY_PAYLOAD
+            for start in range(0, len(ids), 200):
+                self.bridge.notify(EPHEMERAL_TAKEN_CHANNEL, json.dumps({
+                    "o": self.node,
+                    "r": recipient_hash.hex(),
+                    "i": ids[start:start + 200]
+                }))
+        return messages, more_pending
+
+    def has_pending(self, recipient_hash: bytes) -> bool:
+        """True if the recipient has buffered messages (may include some about to expire)"""
+        with self._lock:
+            return bool(self._mailboxes.get(recipient_hash))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mailboxes": len(self._mailboxes),
+                "buffered": sum(len(ring) for ring in self._mailboxes.values()),
+                "stored": self.stored,
+                "replicated": self.replicated,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "expired": self.expired,
+            }
+
+
+# Singleton used by app/api/messages.py
+ephemeral_store = EphemeralStore()
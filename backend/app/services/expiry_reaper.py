@@ -0,0 +1,234 @@
+# app/services/expiry_reaper.py
+
+import os
+import re
+import asyncio
+import logging
+from datetime import datetime, date, timedelta
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# CONFIGURATION
+# =========================
+
+# store_message sets expires_at ~7 days out, so keep a few more days of partitions ready
+PARTITION_DAYS_AHEAD = int(os.getenv("PARTITION_DAYS_AHEAD", "10"))
+REAPER_INTERVAL_SECONDS = float(os.getenv("REAPER_INTERVAL_SECONDS", "3600"))
+# How long a DETACH/CREATE may wait for a lock on messages before giving up
+# until the next sweep (so sends and receives never queue behind the reaper)
+REAPER_LOCK_TIMEOUT_MS = int(os.getenv("REAPER_LOCK_TIMEOUT_MS", "2000"))
+
+PARENT_TABLE = "messages"
+USAGE_TABLE = "mailbox_usage"
+# Session advisory lock so only one worker sweeps at a time
+REAPER_LOCK_ID = 0x5641554C  # "VAUL"
+_PARTITION_NAME = re.compile(r"^messages_p(\d{8})$")
+
+# =========================
+# PARTITION MANAGEMENT
+# =========================
+
+def partition_name(day: date) -> str:
+    return f"{PARENT_TABLE}_p{day:%Y%m%d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """True if the messages table is range-partitioned (PostgreSQL only)"""
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass(:parent))"
+    ), {"parent": PARENT_TABLE}).scalar()
+
+
+def list_partitions(conn: Connection) -> dict:
+    """Existing daily partitions as {day: table_name}"""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:parent)"
+    ), {"parent": PARENT_TABLE})
+    partitions = {}
+    for (name,) in rows:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.strptime(match.group(1), "%Y%m%d").date()] = name
+    return partitions
+
+
+def ensure_partitions(conn: Connection, days_ahead: int = PARTITION_DAYS_AHEAD, today: date | None = None) -> list:
+    """Create the daily partitions from today through today + days_ahead. Returns the new table names."""
+    today = today or datetime.utcnow().date()
+    existing = list_partitions(conn)
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        if day in existing:
+            continue
+        name = partition_name(day)
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {PARENT_TABLE} '
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+
+def _expired_tables(conn: Connection, now: datetime) -> list:
+    """
+    (name, attached, detach_pending, estimated rows, bytes) for every daily table
+    whose whole range is in the past, including ones a previous sweep detached
+    but didn't get to drop. Row counts come from pg_class.reltuples, so nothing
+    scans the partition.
+    """
+    rows = conn.execute(text(
+        "SELECT c.relname, i.inhrelid IS NOT NULL, "
+        "       COALESCE(i.inhdetachpending, false), "
+        "       GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid) "
+        "FROM pg_class c "
+        "LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = to_regclass(:parent) "
+        "WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace "
+        "  AND c.relname ~ :pattern"
+    ), {"parent": PARENT_TABLE, "pattern": _PARTITION_NAME.pattern}).all()
+    expired = []
+    for row in rows:
+        day = datetime.strptime(_PARTITION_NAME.match(row[0]).group(1), "%Y%m%d").date()
+        if datetime.combine(day + timedelta(days=1), datetime.min.time()) <= now:
+            expired.append(tuple(row))
+    return sorted(expired)
+
+
+def _lock_not_available(e: DBAPIError) -> bool:
+    # SQLSTATE 55P03: lock_timeout expired
+    orig = e.orig
+    return (getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)) == "55P03"
+
+
+def drop_expired_partitions(conn: Connection, now: datetime | None = None) -> dict:
+    """
+    Detach and drop every partition whose whole range is in the past.
+    conn must be in autocommit mode: DETACH ... CONCURRENTLY can't run in a
+    transaction block, and it only takes SHARE UPDATE EXCLUSIVE on messages,
+    so inserts and fetches keep going while it waits for older snapshots.
+    A partition whose lock isn't granted within lock_timeout is left for the
+    next sweep (an interrupted concurrent detach is finalized then).
+    Returns how many partitions, (estimated) rows and bytes were reclaimed.
+    """
+    now = now or datetime.utcnow()
+    concurrently = conn.dialect.server_version_info >= (14,)
+    stats = {"partitions": 0, "rows": 0, "bytes": 0, "deferred": 0}
+    for name, attached, detach_pending, rows, size in _expired_tables(conn, now):
+        try:
+            if detach_pending:
+                conn.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}" FINALIZE'))
+            elif attached:
+                mode = " CONCURRENTLY" if concurrently else ""
+                conn.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"{mode}'))
+            # Detached: dropping it no longer touches the parent's locks
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        except DBAPIError as e:
+            if not _lock_not_available(e):
+                raise
+            logger.warning(f"Partition {name} is busy; retrying on the next sweep")
+            stats["deferred"] += 1
+            continue
+        stats["partitions"] += 1
+        stats["rows"] += rows
+        stats["bytes"] += size
+    return stats
+
+
+def drop_expired_usage(conn: Connection, today: date | None = None):
+    """Forget mailbox usage counters for days whose partitions are gone (or going)"""
+    if conn.execute(text("SELECT to_regclass(:table)"), {"table": USAGE_TABLE}).scalar() is None:
+        return
+    conn.execute(
+        text(f"DELETE FROM {USAGE_TABLE} WHERE expires_on < :today"),
+        {"today": today or datetime.utcnow().date()}
+    )
+
+
+def sweep(conn: Connection) -> dict | None:
+    """
+    One reaper pass on an autocommit connection: drop expired partitions,
+    then pre-create upcoming ones, each statement in its own transaction.
+    """
+    if not is_partitioned(conn):
+        return None
+    if not conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": REAPER_LOCK_ID}).scalar():
+        return {"partitions": 0, "rows": 0, "bytes": 0, "deferred": 0, "created": 0, "skipped": True}
+    try:
+        conn.execute(text(f"SET lock_timeout = {REAPER_LOCK_TIMEOUT_MS}"))
+        stats = drop_expired_partitions(conn)
+        drop_expired_usage(conn)
+        try:
+            stats["created"] = len(ensure_partitions(conn))
+        except DBAPIError as e:
+            if not _lock_not_available(e):
+                raise
+            # Ten days are kept ahead, so the next sweep has plenty of time
+            logger.warning("Couldn't lock messages to create partitions; retrying on the next sweep")
+            stats["created"] = 0
+        return stats
+    finally:
+        conn.execute(text("RESET lock_timeout"))
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": REAPER_LOCK_ID})
+
+# =========================
+# BACKGROUND TASK
+# =========================
+
+class ExpiryReaper:
+    """Runs sweep() every REAPER_INTERVAL_SECONDS (call run_once() at startup first)"""
+
+    def __init__(self, engine, interval: float = REAPER_INTERVAL_SECONDS):
+        self.engine = engine  # AsyncEngine
+        self.interval = interval
+        self.last_sweep = None
+        self.totals = {"sweeps": 0, "partitions": 0, "rows": 0, "bytes": 0, "deferred": 0}
+        self._task = None
+
+    async def run_once(self) -> dict | None:
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            stats = await conn.run_sync(sweep)
+        if stats is None:
+            logger.warning("messages table is not partitioned; expired rows are not being reclaimed")
+            return None
+
+        self.last_sweep = {**stats, "at": datetime.utcnow().isoformat()}
+        self.totals["sweeps"] += 1
+        for key in ("partitions", "rows", "bytes", "deferred"):
+            self.totals[key] += stats[key]
+        logger.info(
+            f"Expiry sweep: dropped {stats['partitions']} partitions, "
+            f"~{stats['rows']} rows, {stats['bytes']} bytes; deferred {stats['deferred']}; created {stats['created']}"
+        )
+        return stats
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Expiry sweep failed: {e}")
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
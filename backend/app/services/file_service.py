@@ -0,0 +1,305 @@
+# app/services/file_service.py
+
+import os
+import re
+import json
+import time
+import hashlib
+import secrets
+from app.infra.s3 import get_blob_store, BlobNotFound
+
+# Attachments are encrypted on the client; the server only ever sees opaque
+# chunks. Layout in FILES_BUCKET:
+#   chunks/<sha[:2]>/<sha256>        chunk bytes, content-addressed (stored once)
+#   uploads/<upload_id>/meta.json    upload session (owner, size, chunk size, expiry)
+#   uploads/<upload_id>/parts/<idx>  sha256 of the chunk received at that index
+#   files/<file_id>.json             manifest of a completed upload
+# One marker object per part means parallel chunk uploads never race on a
+# shared manifest; resuming is "ask which indexes are missing, send those".
+# Expired sessions and chunks nothing refers to any more are removed by
+# sweep_uploads() (run periodically by UploadReaper).
+
+# =========================
+# CONFIGURATION
+# =========================
+
+FILES_BUCKET = os.getenv("FILES_BUCKET", "vault-files")
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(512 * 1024 * 1024)))
+# Unfinished uploads can be resumed for this long
+UPLOAD_TTL_SECONDS = int(os.getenv("UPLOAD_TTL_SECONDS", "86400"))
+# A chunk nothing refers to is only deleted once it is this old, so one that
+# was just written (its part marker follows it) is never swept
+ORPHAN_CHUNK_GRACE_SECONDS = int(os.getenv("ORPHAN_CHUNK_GRACE_SECONDS", "3600"))
+
+_UPLOAD_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+_SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class FileNotFound(Exception):
+    pass
+
+
+class InvalidChunk(ValueError):
+    pass
+
+
+class UploadIncomplete(Exception):
+    def __init__(self, missing: list):
+        super().__init__(f"{len(missing)} chunk(s) missing")
+        self.missing = missing
+
+
+def _chunk_key(digest: str) -> str:
+    return f"chunks/{digest[:2]}/{digest}"
+
+
+def _meta_key(upload_id: str) -> str:
+    return f"uploads/{upload_id}/meta.json"
+
+
+def _part_key(upload_id: str, index: int) -> str:
+    return f"uploads/{upload_id}/parts/{index:08d}"
+
+
+def _file_key(file_id: str) -> str:
+    return f"files/{file_id}.json"
+
+# =========================
+# UPLOAD
+# =========================
+
+def validate_upload(size: int, chunk_size: int):
+    """Raises ValueError if the sizes are out of bounds"""
+    if size <= 0 or size > MAX_FILE_SIZE:
+        raise ValueError(f"File size must be between 1 and {MAX_FILE_SIZE} bytes")
+    if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes")
+
+
+def create_upload(owner: str, size: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    """Start an upload session, only usable by `owner`, for `size` bytes sent in `chunk_size` pieces"""
+    validate_upload(size, chunk_size)
+    meta = {
+        "upload_id": secrets.token_urlsafe(24),
+        "owner": owner,
+        "size": size,
+        "chunk_size": chunk_size,
+        "total_chunks": -(-size // chunk_size),
+        "expires_at": int(time.time()) + UPLOAD_TTL_SECONDS
+    }
+    get_blob_store().put_object(FILES_BUCKET, _meta_key(meta["upload_id"]), json.dumps(meta).encode())
+    return meta
+
+
+def get_upload(upload_id: str, owner: str | None = None) -> dict:
+    """
+    Upload session metadata. Raises UploadNotFound (also once it has expired,
+    or if owner is given and the session belongs to someone else).
+    """
+    if not _UPLOAD_ID.match(upload_id):
+        raise UploadNotFound(upload_id)
+    try:
+        meta = json.loads(get_blob_store().get_object(FILES_BUCKET, _meta_key(upload_id)))
+    except BlobNotFound:
+        raise UploadNotFound(upload_id)
+    if meta["expires_at"] < time.time():
+        raise UploadNotFound(upload_id)
+    if owner is not None and meta.get("owner") != owner:
+        raise UploadNotFound(upload_id)
+    return meta
+
+
+def expected_chunk_size(meta: dict, index: int) -> int:
+    """Every chunk is chunk_size bytes except possibly the last"""
+    if not 0 <= index < meta["total_chunks"]:
+        raise InvalidChunk(f"Chunk index must be between 0 and {meta['total_chunks'] - 1}")
+    if index == meta["total_chunks"] - 1:
+        return meta["size"] - meta["chunk_size"] * index
+    return meta["chunk_size"]
+
+
+def put_chunk(upload_id: str, owner: str, index: int, data: bytes, sha256: str | None = None) -> str:
+    """
+    Store one chunk of an upload and return its sha256. Re-sending an index
+    replaces it; a chunk whose content is already stored isn't written again
+    (unless it is old enough that the orphan sweep could be about to take it).
+    """
+    meta = get_upload(upload_id, owner)
+    expected = expected_chunk_size(meta, index)
+    if len(data) != expected:
+        raise InvalidChunk(f"Chunk {index} must be {expected} bytes, got {len(data)}")
+
+    digest = hashlib.sha256(data).hexdigest()
+    if sha256 is not None and sha256.lower() != digest:
+        raise InvalidChunk(f"Chunk {index} checksum mismatch")
+
+    store = get_blob_store()
+    written_at = store.object_mtime(FILES_BUCKET, _chunk_key(digest))
+    if written_at is None or time.time() - written_at > ORPHAN_CHUNK_GRACE_SECONDS / 2:
+        store.put_object(FILES_BUCKET, _chunk_key(digest), data)
+    # Written after the chunk, so a listed part always has its data
+    store.put_object(FILES_BUCKET, _part_key(upload_id, index), digest.encode())
+    return digest
+
+
+def _received_parts(upload_id: str) -> dict:
+    """index -> sha256 for every part received so far"""
+    store = get_blob_store()
+    prefix = f"uploads/{upload_id}/parts/"
+    return {
+        int(key[len(prefix):]): store.get_object(FILES_BUCKET, key).decode()
+        for key in store.list_objects(FILES_BUCKET, prefix)
+    }
+
+
+def upload_status(upload_id: str, owner: str) -> dict:
+    """What a client needs to resume: which chunk indexes are still missing"""
+    meta = get_upload(upload_id, owner)
+    received = _received_parts(upload_id)
+    return {
+        **meta,
+        "received": len(received),
+        "missing": [i for i in range(meta["total_chunks"]) if i not in received]
+    }
+
+
+def complete_upload(upload_id: str, owner: str) -> dict:
+    """
+    Turn a fully received upload into a file manifest and drop the session.
+    The file id is the sha256 over the chunk digests, so it is content-addressed
+    too: uploading the same ciphertext twice yields the same file.
+    Raises UploadIncomplete with the missing indexes.
+    """
+    meta = get_upload(upload_id, owner)
+    received = _received_parts(upload_id)
+    missing = [i for i in range(meta["total_chunks"]) if i not in received]
+    if missing:
+        raise UploadIncomplete(missing)
+
+    digests = [received[i] for i in range(meta["total_chunks"])]
+    file_id = hashlib.sha256(b"".join(bytes.fromhex(d) for d in digests)).hexdigest()
+    manifest = {
+        "file_id": file_id,
+        "size": meta["size"],
+        "chunk_size": meta["chunk_size"],
+        "chunks": digests
+    }
+
+    store = get_blob_store()
+    store.put_object(FILES_BUCKET, _file_key(file_id), json.dumps(manifest).encode())
+    for index in received:
+        store.delete_object(FILES_BUCKET, _part_key(upload_id, index))
+    store.delete_object(FILES_BUCKET, _meta_key(upload_id))
+    return manifest
+
+# =========================
+# DOWNLOAD
+# =========================
+
+def get_manifest(file_id: str) -> dict:
+    """Raises FileNotFound"""
+    if not _SHA256_HEX.match(file_id):
+        raise FileNotFound(file_id)
+    try:
+        return json.loads(get_blob_store().get_object(FILES_BUCKET, _file_key(file_id)))
+    except BlobNotFound:
+        raise FileNotFound(file_id)
+
+
+def iter_file(manifest: dict, start_chunk: int = 0):
+    """Yield the file's bytes from chunk start_chunk on, one read buffer at a time"""
+    store = get_blob_store()
+    for digest in manifest["chunks"][start_chunk:]:
+        yield from store.iter_object(FILES_BUCKET, _chunk_key(digest))
+
+
+def read_chunk(manifest: dict, index: int) -> bytes:
+    if not 0 <= index < len(manifest["chunks"]):
+        raise InvalidChunk(f"Chunk index must be between 0 and {len(manifest['chunks']) - 1}")
+    return get_blob_store().get_object(FILES_BUCKET, _chunk_key(manifest["chunks"][index]))
+
+# =========================
+# CLEANUP
+# =========================
+
+def reap_expired_uploads(now: float | None = None) -> dict:
+    """
+    Delete the parts and metadata of upload sessions that have expired (or
+    lost their metadata). Their chunks are left to reap_orphan_chunks.
+    """
+    now = time.time() if now is None else now
+    store = get_blob_store()
+    sessions = {}
+    for key in store.list_objects(FILES_BUCKET, "uploads/"):
+        sessions.setdefault(key.split("/")[1], []).append(key)
+
+    stats = {"uploads": 0, "parts": 0}
+    for upload_id, keys in sessions.items():
+        try:
+            expires_at = json.loads(store.get_object(FILES_BUCKET, _meta_key(upload_id)))["expires_at"]
+        except BlobNotFound:
+            # Parts are only written while the metadata exists, and complete_upload
+            # deletes them first; leftovers are from an interrupted cleanup
+            expires_at = 0
+        if expires_at >= now:
+            continue
+        # Metadata last, so an interrupted reap is picked up again next time
+        keys.sort(key=lambda k: k == _meta_key(upload_id))
+        for key in keys:
+            store.delete_object(FILES_BUCKET, key)
+        stats["uploads"] += 1
+        stats["parts"] += sum(1 for key in keys if "/parts/" in key)
+    return stats
+
+
+def _referenced_chunks() -> set:
+    """Digests used by a stored file or by a part of a live upload"""
+    store = get_blob_store()
+    referenced = set()
+    for key in store.list_objects(FILES_BUCKET, "files/"):
+        try:
+            referenced.update(json.loads(store.get_object(FILES_BUCKET, key))["chunks"])
+        except BlobNotFound:
+            pass
+    for key in store.list_objects(FILES_BUCKET, "uploads/"):
+        if "/parts/" in key:
+            try:
+                referenced.add(store.get_object(FILES_BUCKET, key).decode())
+            except BlobNotFound:
+                pass
+    return referenced
+
+
+def reap_orphan_chunks(now: float | None = None, grace: float = ORPHAN_CHUNK_GRACE_SECONDS) -> dict:
+    """
+    Delete chunks no file or upload refers to. References are collected
+    before the chunks are listed, and put_chunk rewrites a chunk older than
+    half the grace period, so a chunk being reused is never old enough here.
+    """
+    now = time.time() if now is None else now
+    store = get_blob_store()
+    referenced = _referenced_chunks()
+
+    stats = {"chunks": 0, "bytes": 0}
+    for key in store.list_objects(FILES_BUCKET, "chunks/"):
+        if key.rsplit("/", 1)[-1] in referenced:
+            continue
+        written_at = store.object_mtime(FILES_BUCKET, key)
+        if written_at is None or now - written_at < grace:
+            continue
+        stats["bytes"] += store.head_object(FILES_BUCKET, key) or 0
+        store.delete_object(FILES_BUCKET, key)
+        stats["chunks"] += 1
+    return stats
+
+
+def sweep_uploads(now: float | None = None) -> dict:
+    """Expired sessions first, so the chunks only they referenced go in the same sweep"""
+    return {**reap_expired_uploads(now), **reap_orphan_chunks(now)}
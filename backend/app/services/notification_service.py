@@ -0,0 +1,85 @@
+# app/services/notification_service.py
+
+import asyncio
+import threading
+
+
+class MailboxWaiter:
+    """A single pending wait on one recipient's mailbox"""
+
+    __slots__ = ("recipient_hash", "loop", "event")
+
+    def __init__(self, recipient_hash: bytes, loop: asyncio.AbstractEventLoop):
+        self.recipient_hash = recipient_hash
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait until a message is stored for this mailbox. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class MailboxNotifier:
+    """
+    In-process registry of requests waiting for new messages, keyed by
+    recipient hash. store_message runs in a threadpool thread, so wakeups
+    are handed to each waiter's event loop with call_soon_threadsafe.
+
+    An optional listener (see app.infra.pg_notify) is told when a mailbox
+    gains its first or loses its last local waiter, so wakeups from other
+    workers can be routed here as well.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self.listener = None
+
+    def subscribe(self, recipient_hash: bytes) -> MailboxWaiter:
+        """
+        Register interest in a mailbox. Subscribe BEFORE checking the
+        database so a message stored in between is not missed.
+        """
+        waiter = MailboxWaiter(recipient_hash, asyncio.get_running_loop())
+        with self._lock:
+            waiters = self._waiters.setdefault(recipient_hash, set())
+            first = not waiters
+            waiters.add(waiter)
+        if first and self.listener is not None:
+            self.listener.on_first_subscriber(recipient_hash)
+        return waiter
+
+    def unsubscribe(self, waiter: MailboxWaiter):
+        with self._lock:
+            waiters = self._waiters.get(waiter.recipient_hash)
+            if waiters is None:
+                return
+            waiters.discard(waiter)
+            last = not waiters
+            if last:
+                del self._waiters[waiter.recipient_hash]
+        if last and self.listener is not None:
+            self.listener.on_last_unsubscriber(waiter.recipient_hash)
+
+    def publish(self, recipient_hash: bytes):
+        """Wake everyone waiting on this mailbox (safe to call from any thread)"""
+        with self._lock:
+            waiters = list(self._waiters.get(recipient_hash, ()))
+        for waiter in waiters:
+            try:
+                waiter.loop.call_soon_threadsafe(waiter.event.set)
+            except RuntimeError:
+                # Loop already closed (worker shutting down)
+                pass
+
+    def waiting_count(self) -> int:
+        with self._lock:
+            return sum(len(w) for w in self._waiters.values())
+
+
+# One registry per worker process
+mailbox_notifier = MailboxNotifier()
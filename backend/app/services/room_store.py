@@ -0,0 +1,320 @@
+# app/services/room_store.py
+
+import os
+import sys
+import time
+import heapq
+import threading
+from abc import ABC, abstractmethod
+
+# =========================
+# CONFIGURATION
+# =========================
+
+# "memory" (single worker only) or "redis" (shared by all workers)
+ROOM_STORE_BACKEND = os.getenv("ROOM_STORE_BACKEND", "memory")
+# Rooms and active-room pointers expire after this long without being created/joined
+ROOM_TTL_SECONDS = int(os.getenv("ROOM_TTL_SECONDS", str(7 * 24 * 3600)))
+# Max rooms held by the in-memory backend; the least recently touched room is evicted past this
+ROOM_STORE_CAPACITY = int(os.getenv("ROOM_STORE_CAPACITY", "1000000"))
+
+
+class RoomNotFound(Exception):
+    pass
+
+
+class RoomExists(Exception):
+    """The code is taken by a room that isn't the creator's own active room"""
+    pass
+
+
+class RoomUserMismatch(Exception):
+    def __init__(self, room_users: set, provided_users: set):
+        super().__init__("Invalid users for this room")
+        self.room_users = room_users
+        self.provided_users = provided_users
+
+
+class RoomStore(ABC):
+    """
+    Room registry used by app/api/rooms.py. Each user has at most one active
+    room; creating or joining another room deletes their previous one.
+    Methods return (result, previous_room_code or None).
+    """
+
+    @abstractmethod
+    def create_room(self, room_code: str, user1_id: str, user2_id: str):
+        """Raises RoomExists if another room already has this code"""
+
+    @abstractmethod
+    def join_room(self, room_code: str, user1_id: str, user2_id: str):
+        """Raises RoomNotFound or RoomUserMismatch"""
+
+    @abstractmethod
+    def delete_room(self, room_code: str, user_id: str) -> bool:
+        """Returns False if the room did not exist"""
+
+    def stats(self) -> dict:
+        """Counters for /health/rooms"""
+        return {}
+
+
+def _check_users(room: dict, user1_id: str, user2_id: str):
+    users_in_room = {room['user1_id'], room['user2_id']}
+    provided_users = {user1_id, user2_id}
+    if users_in_room != provided_users:
+        raise RoomUserMismatch(users_in_room, provided_users)
+
+# =========================
+# IN-MEMORY BACKEND
+# =========================
+
+class _Room:
+    """One room; slots instead of a per-room dict, ids interned so both users' rooms share them"""
+    __slots__ = ('code', 'user1_id', 'user2_id', 'expires_at')
+
+    def __init__(self, code: str, user1_id: str, user2_id: str, expires_at: float):
+        self.code = code
+        self.user1_id = user1_id
+        self.user2_id = user2_id
+        self.expires_at = expires_at
+
+    def as_dict(self) -> dict:
+        return {'code': self.code, 'user1_id': self.user1_id, 'user2_id': self.user2_id}
+
+
+class InMemoryRoomStore(RoomStore):
+    """
+    Process-local rooms. Only correct with a single uvicorn worker.
+
+    Rooms expire ttl seconds after their last create/join. Expiry runs off a
+    min-heap of (expires_at, code) with lazy deletion: touching a room pushes
+    a new entry and leaves the old one to be skipped when it surfaces, so
+    every operation only pops what is actually due. When capacity is reached
+    the room closest to expiry (the least recently touched) is evicted.
+    """
+
+    def __init__(self, ttl: int = ROOM_TTL_SECONDS, capacity: int = ROOM_STORE_CAPACITY):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.ttl = ttl
+        self.capacity = capacity
+        self._rooms = {}              # room_code -> _Room
+        self._user_active_rooms = {}  # user_id -> room_code
+        self._expiry_heap = []        # (expires_at, room_code), may hold stale entries
+        self._lock = threading.Lock()
+        self.expirations = 0
+        self.evictions = 0
+
+    # --- internals, called with the lock held ---
+
+    def _touch(self, room: _Room, now: float):
+        room.expires_at = now + self.ttl
+        heapq.heappush(self._expiry_heap, (room.expires_at, room.code))
+        # Rebuild once stale entries outnumber live ones so the heap stays O(rooms)
+        if len(self._expiry_heap) > 2 * len(self._rooms) + 64:
+            self._expiry_heap = [(r.expires_at, r.code) for r in self._rooms.values()]
+            heapq.heapify(self._expiry_heap)
+
+    def _remove(self, room: _Room):
+        del self._rooms[room.code]
+        # Drop the reverse-index entries that still point at this room
+        for user_id in (room.user1_id, room.user2_id):
+            if self._user_active_rooms.get(user_id) == room.code:
+                del self._user_active_rooms[user_id]
+
+    def _pop_due(self, now: float | None):
+        """Pop the next live heap entry due by now (any live entry if now is None)"""
+        heap = self._expiry_heap
+        while heap:
+            expires_at, code = heap[0]
+            room = self._rooms.get(code)
+            if room is None or room.expires_at != expires_at:
+                heapq.heappop(heap)  # stale: room deleted or touched since
+                continue
+            if now is not None and expires_at > now:
+                return None
+            heapq.heappop(heap)
+            return room
+        return None
+
+    def _expire(self, now: float):
+        while (room := self._pop_due(now)) is not None:
+            self._remove(room)
+            self.expirations += 1
+
+    def _make_room_for_one(self):
+        while len(self._rooms) >= self.capacity:
+            room = self._pop_due(None)
+            if room is None:
+                break
+            self._remove(room)
+            self.evictions += 1
+
+    # --- RoomStore ---
+
+    def create_room(self, room_code: str, user1_id: str, user2_id: str):
+        room_code, user1_id, user2_id = sys.intern(room_code), sys.intern(user1_id), sys.intern(user2_id)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+
+            old_room_code = self._user_active_rooms.get(user1_id)
+            if room_code in self._rooms and old_room_code != room_code:
+                raise RoomExists(room_code)
+            if old_room_code is not None and old_room_code in self._rooms:
+                self._remove(self._rooms[old_room_code])
+            self._make_room_for_one()
+
+            room = _Room(room_code, user1_id, user2_id, 0.0)
+            self._rooms[room_code] = room
+            self._user_active_rooms[user1_id] = room_code
+            self._touch(room, now)
+            return room.as_dict(), old_room_code
+
+    def join_room(self, room_code: str, user1_id: str, user2_id: str):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+
+            room = self._rooms.get(room_code)
+            if room is None:
+                raise RoomNotFound(room_code)
+            _check_users(room.as_dict(), user1_id, user2_id)
+            user2_id = sys.intern(user2_id)
+
+            old_room_code = self._user_active_rooms.get(user2_id)
+            if old_room_code == room_code:
+                old_room_code = None  # Don't delete if it's the same room
+            elif old_room_code is not None and old_room_code in self._rooms:
+                self._remove(self._rooms[old_room_code])
+
+            self._user_active_rooms[user2_id] = room.code
+            self._touch(room, now)
+            return room.as_dict(), old_room_code
+
+    def delete_room(self, room_code: str, user_id: str) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            room = self._rooms.get(room_code)
+            if room is None:
+                return False
+            # Also clears user_id's active-room pointer if it points here
+            self._remove(room)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "rooms": len(self._rooms),
+                "capacity": self.capacity,
+                "active_users": len(self._user_active_rooms),
+                "heap_entries": len(self._expiry_heap),
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
+
+# =========================
+# REDIS BACKEND
+# =========================
+
+class RedisRoomStore(RoomStore):
+    """
+    Rooms shared by all workers and kept across restarts.
+    room:{code} is a hash, user_room:{user_id} points at the user's active room;
+    both carry the room TTL, refreshed on create/join.
+    """
+
+    def __init__(self, client, ttl: int = ROOM_TTL_SECONDS, prefix: str = "vaultchat:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _room_key(self, room_code: str) -> str:
+        return f"{self.prefix}room:{room_code}"
+
+    def _user_key(self, user_id: str) -> str:
+        return f"{self.prefix}user_room:{user_id}"
+
+    # Each operation reads, checks and writes inside one WATCH/MULTI transaction;
+    # redis-py's transaction() reruns it if a watched key changed in between.
+
+    def create_room(self, room_code: str, user1_id: str, user2_id: str):
+        room = {'code': room_code, 'user1_id': user1_id, 'user2_id': user2_id}
+        room_key, user_key = self._room_key(room_code), self._user_key(user1_id)
+
+        def create(pipe):
+            old_room_code = pipe.get(user_key)
+            if pipe.exists(room_key) and old_room_code != room_code:
+                raise RoomExists(room_code)
+            pipe.multi()
+            if old_room_code is not None:
+                pipe.delete(self._room_key(old_room_code))
+            pipe.hset(room_key, mapping=room)
+            pipe.expire(room_key, self.ttl)
+            pipe.set(user_key, room_code, ex=self.ttl)
+            return old_room_code
+
+        old_room_code = self.client.transaction(create, room_key, user_key, value_from_callable=True)
+        return room, old_room_code
+
+    def join_room(self, room_code: str, user1_id: str, user2_id: str):
+        room_key, user_key = self._room_key(room_code), self._user_key(user2_id)
+
+        def join(pipe):
+            room = pipe.hgetall(room_key)
+            if not room:
+                raise RoomNotFound(room_code)
+            _check_users(room, user1_id, user2_id)
+
+            old_room_code = pipe.get(user_key)
+            if old_room_code == room_code:
+                old_room_code = None  # Don't delete if it's the same room
+
+            pipe.multi()
+            if old_room_code is not None:
+                pipe.delete(self._room_key(old_room_code))
+            pipe.expire(room_key, self.ttl)
+            pipe.set(user_key, room_code, ex=self.ttl)
+            return room, old_room_code
+
+        return self.client.transaction(join, room_key, user_key, value_from_callable=True)
+
+    def delete_room(self, room_code: str, user_id: str) -> bool:
+        room_key, user_key = self._room_key(room_code), self._user_key(user_id)
+
+        def delete(pipe):
+            if not pipe.exists(room_key):
+                return False
+            clear_pointer = pipe.get(user_key) == room_code
+            pipe.multi()
+            pipe.delete(room_key)
+            if clear_pointer:
+                pipe.delete(user_key)
+            return True
+
+        return self.client.transaction(delete, room_key, user_key, value_from_callable=True)
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+# =========================
+# FACTORY
+# =========================
+
+_room_store = None
+
+
+def get_room_store() -> RoomStore:
+    """The configured store for this process (created on first use)"""
+    global _room_store
+    if _room_store is None:
+        if ROOM_STORE_BACKEND == "redis":
+            from app.infra.redis import redis_client
+            _room_store = RedisRoomStore(redis_client)
+        elif ROOM_STORE_BACKEND == "memory":
+            _room_store = InMemoryRoomStore()
+        else:
+            raise ValueError(f"Unknown ROOM_STORE_BACKEND: {ROOM_STORE_BACKEND}")
+    return _room_store
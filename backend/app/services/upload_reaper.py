@@ -0,0 +1,78 @@
+# app/services/upload_reaper.py
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import text
+from app.services.file_service import sweep_uploads
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# CONFIGURATION
+# =========================
+
+UPLOAD_REAPER_INTERVAL_SECONDS = float(os.getenv("UPLOAD_REAPER_INTERVAL_SECONDS", "900"))
+# Session advisory lock so only one worker walks the blob store at a time
+UPLOAD_REAPER_LOCK_ID = 0x56415550  # "VAUP"
+
+
+class UploadReaper:
+    """
+    Runs file_service.sweep_uploads() every UPLOAD_REAPER_INTERVAL_SECONDS in a
+    thread (it lists and deletes blobs). Sweeps are idempotent; the advisory
+    lock only keeps workers from repeating each other's work.
+    """
+
+    def __init__(self, engine, interval: float = UPLOAD_REAPER_INTERVAL_SECONDS):
+        self.engine = engine  # AsyncEngine
+        self.interval = interval
+        self.last_sweep = None
+        self.totals = {"sweeps": 0, "uploads": 0, "parts": 0, "chunks": 0, "bytes": 0}
+        self._task = None
+
+    async def run_once(self) -> dict | None:
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if conn.dialect.name == "postgresql":
+                locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": UPLOAD_REAPER_LOCK_ID})
+                if not locked:
+                    return None
+            try:
+                stats = await asyncio.to_thread(sweep_uploads)
+            finally:
+                if conn.dialect.name == "postgresql":
+                    await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": UPLOAD_REAPER_LOCK_ID})
+
+        self.last_sweep = {**stats, "at": datetime.utcnow().isoformat()}
+        self.totals["sweeps"] += 1
+        for key in ("uploads", "parts", "chunks", "bytes"):
+            self.totals[key] += stats[key]
+        logger.info(
+            f"Upload sweep: removed {stats['uploads']} expired uploads ({stats['parts']} parts), "
+            f"{stats['chunks']} orphan chunks ({stats['bytes']} bytes)"
+        )
+        return stats
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload sweep failed: {e}")
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
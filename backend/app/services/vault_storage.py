@@ -1,8 +1,277 @@
-from app.infra.s3 import upload_encrypted_blob
-
-def backup_encrypted_chat(user_id: str, encrypted_blob: bytes):
-    upload_encrypted_blob(
-        bucket="vault-backups",
-        key=f"{user_id}/backup.bin",
-        data=encrypted_blob
-    )
+# app/services/vault_storage.py
+
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import text
+from app.infra.postgres import engine
+from app.infra.s3 import get_blob_store, BlobNotFound
+
+# Backups are split with content-defined chunking (a gear rolling hash picks
+# the boundaries), so an edit only changes the chunks around it and every
+# other chunk keeps its digest. Layout in BACKUP_BUCKET:
+#   <user_id>/manifest.json          ordered chunk digests of the latest backup,
+#                                    plus objects it replaced and when ("retired")
+#   <user_id>/chunks/<sha[:2]>/<sha> chunk bytes
+#   <user_id>/backup.bin             pre-chunking single-blob backup (read on restore only)
+# Dedup only helps if the client's encryption is stable for unchanged data
+# (e.g. history encrypted record by record and appended); re-encrypting the
+# whole history under a fresh nonce makes every chunk new.
+
+# =========================
+# CONFIGURATION
+# =========================
+
+BACKUP_BUCKET = "vault-backups"
+CDC_MIN_SIZE = 16 * 1024
+CDC_AVG_SIZE = 64 * 1024
+CDC_MAX_SIZE = 256 * 1024
+# Bytes scanned for boundaries per pass, and hashed per array operation
+CDC_SCAN_SIZE = 2 * 1024 * 1024
+CDC_HASH_TILE = 16 * 1024
+# Chunks a new backup stopped using are kept this long, so a restore that
+# already read the previous manifest can finish
+BACKUP_CHUNK_GRACE_SECONDS = int(os.getenv("BACKUP_CHUNK_GRACE_SECONDS", "3600"))
+
+# =========================
+# CONTENT-DEFINED CHUNKING
+# =========================
+
+# Fixed forever: a different table moves every boundary and defeats dedup against older backups
+_GEAR = np.array([
+    int.from_bytes(hashlib.sha256(b"vaultchat-gear-%d" % i).digest()[:8], 'big')
+    for i in range(256)
+], dtype=np.uint64)
+
+
+def _masks(avg_size: int):
+    """
+    Normalized chunking (FastCDC): a stricter mask before avg_size and a
+    looser one after pulls chunk sizes towards the average. Masks use the
+    top bits of the hash, which depend on the whole 64-byte window.
+    """
+    bits = avg_size.bit_length() - 1
+    strict = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+    loose = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+    return np.uint64(strict), np.uint64(loose)
+
+
+def _gear_hashes(codes: np.ndarray) -> np.ndarray:
+    """
+    The gear hash after each byte, h = (h << 1) + GEAR[byte], for all
+    positions at once. Bytes more than 64 back are shifted out, so
+    h[j] = sum(GEAR[codes[j - k]] << k for k < 64); it is built by doubling
+    the window (1, 2, 4, ... 64 bytes) in six array passes.
+    """
+    h = _GEAR[codes]
+    shift = 1
+    while shift < 64:
+        h[shift:] += h[:-shift] << np.uint64(shift)
+        shift *= 2
+    return h
+
+
+def _boundary_hits(block: bytes, strict: np.uint64, loose: np.uint64) -> tuple:
+    """
+    Positions j in block where a chunk ending after byte j passes the strict
+    and the loose mask. Hashed in CDC_HASH_TILE pieces (each with the 63
+    bytes before it) so the working set stays in cache.
+    """
+    codes = np.frombuffer(block, dtype=np.uint8)
+    strict_hits, loose_hits = [], []
+    for start in range(0, len(codes), CDC_HASH_TILE):
+        lead = min(start, 63)
+        hashes = _gear_hashes(codes[start - lead:start + CDC_HASH_TILE])[lead:]
+        strict_hits.append(np.flatnonzero((hashes & strict) == 0) + start)
+        loose_hits.append(np.flatnonzero((hashes & loose) == 0) + start)
+    if not strict_hits:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(strict_hits), np.concatenate(loose_hits)
+
+
+def _cut_points(block: bytes, final: bool, min_size: int, avg_size: int, max_size: int) -> list:
+    """
+    Lengths of the chunks at the start of block, which must begin at a chunk
+    boundary. Unless final, stops while less than max_size is left (the next
+    boundary may be in data not read yet).
+
+    A chunk can't end before min_size (>= 64), so every window tested lies
+    inside the chunk and the hashes can be computed once for the whole block.
+    """
+    strict_hits, loose_hits = _boundary_hits(block, *_masks(avg_size))
+
+    cuts = []
+    start = 0
+    while start < len(block):
+        remaining = len(block) - start
+        if remaining < max_size and not final:
+            break
+        if remaining <= min_size:
+            cut = remaining
+        else:
+            end = min(remaining, max_size)
+            normal = min(avg_size, end)
+            cut = end
+            k = np.searchsorted(strict_hits, start + min_size - 1)
+            if k < len(strict_hits) and strict_hits[k] < start + normal:
+                cut = int(strict_hits[k]) - start + 1
+            else:
+                k = np.searchsorted(loose_hits, start + normal)
+                if k < len(loose_hits) and loose_hits[k] < start + end:
+                    cut = int(loose_hits[k]) - start + 1
+        cuts.append(cut)
+        start += cut
+    return cuts
+
+
+def chunk_stream(pieces, min_size: int = CDC_MIN_SIZE, avg_size: int = CDC_AVG_SIZE, max_size: int = CDC_MAX_SIZE):
+    """
+    Re-cut an iterable of byte strings at content-defined boundaries.
+    Scans CDC_SCAN_SIZE bytes at a time and holds at most that plus one
+    input piece.
+    """
+    scan_size = max(CDC_SCAN_SIZE, max_size)
+    buf = bytearray()
+
+    def cut(final: bool):
+        block = bytes(buf[:scan_size])
+        offset = 0
+        for length in _cut_points(block, final and len(buf) <= scan_size, min_size, avg_size, max_size):
+            yield block[offset:offset + length]
+            offset += length
+        del buf[:offset]
+
+    for piece in pieces:
+        buf += piece
+        while len(buf) >= scan_size:
+            yield from cut(final=False)
+    while buf:
+        yield from cut(final=True)
+
+# =========================
+# BACKUP / RESTORE
+# =========================
+
+class BackupNotFound(Exception):
+    pass
+
+
+def _manifest_key(user_id: str) -> str:
+    return f"{user_id}/manifest.json"
+
+
+def _chunk_key(user_id: str, digest: str) -> str:
+    return f"{user_id}/chunks/{digest[:2]}/{digest}"
+
+
+def _legacy_key(user_id: str) -> str:
+    return f"{user_id}/backup.bin"
+
+
+def get_backup_manifest(user_id: str) -> dict | None:
+    try:
+        return json.loads(get_blob_store().get_object(BACKUP_BUCKET, _manifest_key(user_id)))
+    except BlobNotFound:
+        return None
+
+
+@contextmanager
+def _backup_lock(user_id: str):
+    """
+    One backup at a time per user, across workers (a session advisory lock;
+    the connection is held for the duration of the backup).
+    """
+    key = int.from_bytes(hashlib.sha256(b"vault-backup:" + user_id.encode()).digest()[:8], 'big', signed=True)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+            conn.commit()
+
+
+def backup_encrypted_chat(user_id: str, encrypted_blob) -> dict:
+    """
+    Back up a client-encrypted history (bytes, or an iterable of bytes to
+    stream a large one). Only chunks the user's store doesn't already have
+    are uploaded. Chunks the new backup no longer uses are retired, and
+    deleted by a later backup once BACKUP_CHUNK_GRACE_SECONDS have passed.
+    """
+    if isinstance(encrypted_blob, (bytes, bytearray, memoryview)):
+        encrypted_blob = (encrypted_blob,)
+
+    with _backup_lock(user_id):
+        return _backup(user_id, encrypted_blob)
+
+
+def _backup(user_id: str, encrypted_blob) -> dict:
+    store = get_blob_store()
+    previous = get_backup_manifest(user_id)
+    now = int(time.time())
+    # object key -> when it stopped being used; the first chunked backup retires the legacy blob
+    retired = dict(previous.get("retired", {})) if previous else {_legacy_key(user_id): now}
+    known = {digest for digest, _ in previous["chunks"]} if previous else set()
+
+    chunks = []
+    size = uploaded = uploaded_bytes = 0
+    for chunk in chunk_stream(encrypted_blob):
+        digest = hashlib.sha256(chunk).hexdigest()
+        chunks.append((digest, len(chunk)))
+        size += len(chunk)
+        if digest in known:
+            continue
+        # Also picks up retired chunks and ones left behind by an interrupted backup
+        if store.head_object(BACKUP_BUCKET, _chunk_key(user_id, digest)) is None:
+            store.put_object(BACKUP_BUCKET, _chunk_key(user_id, digest), chunk)
+            uploaded += 1
+            uploaded_bytes += len(chunk)
+        known.add(digest)
+
+    in_use = {_chunk_key(user_id, digest) for digest, _ in chunks}
+    if previous:
+        for digest, _ in previous["chunks"]:
+            key = _chunk_key(user_id, digest)
+            if key not in in_use:
+                retired.setdefault(key, now)
+    retired = {key: at for key, at in retired.items() if key not in in_use}
+    expired = [key for key, at in retired.items() if now - at >= BACKUP_CHUNK_GRACE_SECONDS]
+    for key in expired:
+        del retired[key]
+
+    # The manifest is written before anything is deleted: until then restore
+    # still sees the previous backup, and a crash only leaves unused objects
+    manifest = {"size": size, "chunks": chunks, "created_at": now, "retired": retired}
+    store.put_object(BACKUP_BUCKET, _manifest_key(user_id), json.dumps(manifest).encode())
+    for key in expired:
+        store.delete_object(BACKUP_BUCKET, key)
+
+    return {
+        "size": size,
+        "chunks": len(chunks),
+        "uploaded_chunks": uploaded,
+        "uploaded_bytes": uploaded_bytes,
+        "deleted_objects": len(expired)
+    }
+
+
+def restore_encrypted_chat(user_id: str):
+    """
+    Yield the latest backup's bytes chunk by chunk. Raises BackupNotFound
+    (checked up front, before the first chunk is read).
+    """
+    store = get_blob_store()
+    manifest = get_backup_manifest(user_id)
+    if manifest is None:
+        if store.head_object(BACKUP_BUCKET, _legacy_key(user_id)) is None:
+            raise BackupNotFound(user_id)
+        return store.iter_object(BACKUP_BUCKET, _legacy_key(user_id))
+    return _iter_chunks(store, user_id, manifest)
+
+
+def _iter_chunks(store, user_id: str, manifest: dict):
+    for digest, _ in manifest["chunks"]:
+        yield from store.iter_object(BACKUP_BUCKET, _chunk_key(user_id, digest))
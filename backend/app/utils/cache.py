@@ -0,0 +1,97 @@
+# app/utils/cache.py
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU map with hit/miss/eviction counters.
+    Routes run in Starlette's threadpool, so every access takes the lock.
+
+    Optional ttl (seconds) expires entries lazily on lookup; set() can
+    override it per entry. Optional sizeof(key, value) tracks an
+    approximate memory footprint in bytes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None, sizeof=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sizeof = sizeof
+        # key -> (value, expires_at or None, size)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        size = self._sizeof(key, value) if self._sizeof is not None else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize:
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self.bytes -= entry[2]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Counters for sizing the cache per worker"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+            if self.ttl is not None:
+                stats["expirations"] = self.expirations
+            if self._sizeof is not None:
+                stats["bytes"] = self.bytes
+            return stats
@@ -0,0 +1,55 @@
+# app/utils/framing.py
+
+import json
+import struct
+
+# Length-prefixed framing for moving raw ciphertext without JSON/base64/hex.
+# Each frame is:
+#   u32 header length | header (UTF-8 JSON object) | u32 body length | body (raw bytes)
+# All lengths big-endian. A message list is just frames back to back.
+
+FRAMES_CONTENT_TYPE = "application/x-vaultchat-frames"
+
+_LENGTH = struct.Struct(">I")
+
+
+class FrameError(ValueError):
+    """Truncated or malformed frame data"""
+
+
+def encode_frame(header: dict, body: bytes) -> bytes:
+    header_bytes = json.dumps(header, separators=(",", ":")).encode('utf-8')
+    return b"".join((_LENGTH.pack(len(header_bytes)), header_bytes, _LENGTH.pack(len(body)), body))
+
+
+def encode_frames(frames) -> bytes:
+    """Concatenate (header, body) pairs into one payload"""
+    return b"".join(encode_frame(header, body) for header, body in frames)
+
+
+def decode_frames(data: bytes) -> list:
+    """Split a payload into (header dict, body bytes) pairs"""
+    view = memoryview(data)
+    offset = 0
+    frames = []
+    while offset < len(view):
+        header_bytes, offset = _read_chunk(view, offset)
+        body, offset = _read_chunk(view, offset)
+        try:
+            header = json.loads(bytes(header_bytes))
+        except ValueError:
+            raise FrameError("Frame header is not valid JSON")
+        if not isinstance(header, dict):
+            raise FrameError("Frame header must be a JSON object")
+        frames.append((header, bytes(body)))
+    return frames
+
+
+def _read_chunk(view: memoryview, offset: int):
+    if offset + _LENGTH.size > len(view):
+        raise FrameError("Truncated frame length")
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    if offset + length > len(view):
+        raise FrameError("Truncated frame")
+    return view[offset:offset + length], offset + length
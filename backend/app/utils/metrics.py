@@ -0,0 +1,312 @@
+# app/utils/metrics.py
+
+import os
+import time
+import threading
+from bisect import bisect_left
+
+# Minimal in-process metrics with Prometheus text output (exposition format
+# 0.0.4), so the hot path pays one lock and a few additions per observation
+# and nothing is pulled in beyond the standard library.
+#
+# Values are per worker process, like /health/caches: with several uvicorn
+# workers each scrape sees whichever worker answered;
+# vaultchat_worker_info says which one (by pid).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cache hits (sub-millisecond) up to long-poll waits
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+WORKER = str(os.getpid())
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(collector):
+    with _registry_lock:
+        _registry.append(collector)
+    return collector
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# =========================
+# METRIC TYPES
+# =========================
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def labels(self, *values):
+        """Child for one label combination (cache it at call sites on hot paths)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """For metrics without labels"""
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf; cumulated when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """For metrics without labels"""
+        self.labels().observe(value)
+
+
+class Timer:
+    """`with histogram.labels(...).time():` records the block's wall time, awaits included"""
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class GaugeCallback:
+    """
+    Gauges read at scrape time from a callback, so nothing runs on the hot
+    path. fn returns a number, or a dict of label value -> number.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn, labelname: str | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelname = labelname
+        _register(self)
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        result = self.fn()
+        if isinstance(result, dict):
+            for value, number in result.items():
+                lines.append(f"{self.name}{_format_labels((self.labelname,), (value,))} {_format_value(number)}")
+        elif result is not None:
+            lines.append(f"{self.name} {_format_value(result)}")
+        return lines
+
+
+class StatsCollector:
+    """
+    Exposes every numeric field of a stats() dict (cache, room store,
+    reaper, ...) as a gauge named <prefix>_<field>. Nested dicts become
+    <prefix>_<key>_<field>.
+    """
+
+    def __init__(self, prefix: str, documentation: str, fn):
+        self.prefix = prefix
+        self.documentation = documentation
+        self.fn = fn
+        _register(self)
+
+    def collect(self) -> list:
+        lines = []
+        for name, value in self._flatten(self.prefix, self.fn() or {}):
+            lines.append(f"# HELP {name} {self.documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+    def _flatten(self, prefix: str, stats: dict):
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, dict):
+                yield from self._flatten(f"{prefix}_{key}", value)
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}_{key}", value
+
+# =========================
+# EXPOSITION
+# =========================
+
+def render() -> str:
+    """All registered metrics in Prometheus text format"""
+    with _registry_lock:
+        collectors = list(_registry)
+    lines = []
+    for collector in collectors:
+        try:
+            lines.extend(collector.collect())
+        except Exception as e:
+            # One broken stats source shouldn't take the whole scrape down
+            lines.append(f"# collector {getattr(collector, 'name', getattr(collector, 'prefix', '?'))} failed: {e}")
+    lines.append("# HELP vaultchat_worker_info Worker process that served this scrape")
+    lines.append("# TYPE vaultchat_worker_info gauge")
+    lines.append(f'vaultchat_worker_info{{worker="{WORKER}"}} 1')
+    return "\n".join(lines) + "\n"
+
+# =========================
+# HOT-PATH METRICS
+# =========================
+
+REQUEST_DURATION = Histogram(
+    "vaultchat_http_request_duration_seconds",
+    "HTTP request latency by route template (streaming and long-poll bodies included)",
+    ("method", "route", "status")
+)
+
+STAGE_DURATION = Histogram(
+    "vaultchat_stage_duration_seconds",
+    "Time spent in one step of request handling",
+    ("stage",)
+)
+
+DB_POOL_CHECKOUT = Histogram(
+    "vaultchat_db_pool_checkout_seconds",
+    "Wait for a connection from the SQLAlchemy pool",
+    ("pool",)
+)
+
+MESSAGES_STORED = Counter("vaultchat_messages_stored_total", "Messages written to the messages table")
+MESSAGES_FETCHED = Counter("vaultchat_messages_fetched_total", "Messages read (and deleted) from the messages table")
+RATE_LIMITED = Counter("vaultchat_rate_limited_total", "Requests rejected with 429 by a rate limit", ("limit",))
+MAILBOX_QUOTA_REJECTED = Counter("vaultchat_mailbox_quota_rejected_total", "Messages refused because the recipient mailbox was full")
+
+
+def stage_timer(stage: str) -> Timer:
+    """`with stage_timer("store_message"):` times one stage of a request"""
+    return STAGE_DURATION.labels(stage).time()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request. Labels use the matched
+    route's path template (/files/{file_id}, not the real path) so label
+    cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the shared scope
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.labels(scope["method"], template, str(status)).observe(time.perf_counter() - start)
@@ -0,0 +1,95 @@
+# benchmarks/__main__.py
+"""
+Micro-benchmarks for the crypto and storage hot paths.
+
+Run from the backend folder:
+    python -m benchmarks run --save benchmarks/results/baseline.json
+    python -m benchmarks run --compare benchmarks/results/baseline.json
+    python -m benchmarks compare old.json new.json --threshold 0.1
+
+Storage cases use a temporary SQLite file unless BENCH_DATABASE_URL points
+at a throwaway Postgres database. `run --compare` and `compare` exit with
+status 1 when any case is slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import fnmatch
+import sys
+from benchmarks import harness
+
+
+def _run(args) -> int:
+    from benchmarks.bench_crypto import all_cases
+    from benchmarks.bench_storage import BenchDatabase, storage_cases
+
+    db = BenchDatabase()
+    results = {}
+    try:
+        for source in (all_cases(args.quick), storage_cases(db, args.quick)):
+            for case in source:
+                if args.only and not any(fnmatch.fnmatch(case.name, pattern) for pattern in args.only):
+                    continue
+                results[case.name] = harness.measure(case, rounds=args.rounds)
+                r = results[case.name]
+                print(f"  {case.name}: {harness.format_seconds(r['median'])}", file=sys.stderr)
+    finally:
+        db.close()
+
+    meta = harness.environment(db.dialect)
+    print()
+    harness.print_results(results)
+    if args.save:
+        harness.save(args.save, meta, results)
+        print(f"\n💾 Saved {len(results)} results to {args.save}")
+
+    if args.compare:
+        baseline = harness.load(args.compare)
+        if args.only:
+            # Cases filtered out of this run aren't "missing"
+            baseline["results"] = {
+                name: r for name, r in baseline["results"].items()
+                if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)
+            }
+        return _report(baseline, {"meta": meta, "results": results}, args)
+    return 0
+
+
+def _compare(args) -> int:
+    return _report(harness.load(args.baseline), harness.load(args.current), args)
+
+
+def _report(baseline: dict, current: dict, args) -> int:
+    if baseline["meta"].get("platform") != current["meta"].get("platform"):
+        print("⚠️ Baseline was recorded on a different platform; differences may not mean much")
+    rows = harness.compare(baseline, current, args.threshold, args.metric)
+    print()
+    harness.print_comparison(rows, args.threshold)
+    return 1 if any(row[4] == "regressed" for row in rows) else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="VaultChat micro-benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks")
+    run.add_argument("--only", action="append", metavar="PATTERN", help="glob on case names (repeatable)")
+    run.add_argument("--quick", action="store_true", help="skip the largest keys, payloads and backlogs")
+    run.add_argument("--rounds", type=int, default=harness.ROUNDS)
+    run.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    run.add_argument("--compare", metavar="BASELINE", help="compare against a saved baseline")
+
+    cmp = sub.add_parser("compare", help="compare two saved result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+
+    for p in (run, cmp):
+        p.add_argument("--threshold", type=float, default=harness.DEFAULT_THRESHOLD,
+                       help="allowed slowdown as a fraction (default %(default)s)")
+        p.add_argument("--metric", choices=("median", "min"), default="median")
+
+    args = parser.parse_args()
+    return _run(args) if args.command == "run" else _compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# benchmarks/bench_crypto.py
+
+import os
+import pgpy
+from pgpy.constants import PubKeyAlgorithm, KeyFlags, HashAlgorithm, EllipticCurveOID
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+from benchmarks.harness import Case
+from app.core.security import verify_pgp_signature, invalidate_cached_key
+from app.core.message import hash_recipient
+from app.core.crypto import encrypt_vault_message, decrypt_vault_message, VaultCryptoContext
+from app.clients.anonymous_client import pad_message, unpad_message, PADDED_MESSAGE_SIZE
+
+PAYLOAD_SIZES = (64, 1024, 16 * 1024, 256 * 1024)
+PAD_SIZES = (64, 1024, 16 * 1024)
+HASH_KEY_SIZES = (32, 1024, 4096)   # raw X25519 key up to an armored RSA-4096 public key
+BATCH_SIZE = 1000
+
+
+def _pgp_key(kind: str) -> pgpy.PGPKey:
+    if kind == "ed25519":
+        key = pgpy.PGPKey.new(PubKeyAlgorithm.EdDSA, EllipticCurveOID.Ed25519)
+    else:
+        key = pgpy.PGPKey.new(PubKeyAlgorithm.RSAEncryptOrSign, int(kind[3:]))
+    key.add_uid(pgpy.PGPUID.new("bench"), usage={KeyFlags.Sign}, hashes=[HashAlgorithm.SHA256])
+    return key
+
+
+def pgp_cases(quick: bool = False):
+    """verify_pgp_signature per key type, with the parsed-key cache cold and warm"""
+    kinds = ("ed25519", "rsa2048") if quick else ("ed25519", "rsa2048", "rsa3072", "rsa4096")
+    for kind in kinds:
+        key = _pgp_key(kind)
+        public_text = str(key.pubkey)
+        data = "bench|1700000000000"
+        signature = str(key.sign(data))
+        user_id_hash = os.urandom(32)
+
+        def cold(public_text=public_text, signature=signature, data=data):
+            assert verify_pgp_signature(public_text, signature, data)
+
+        def warm(public_text=public_text, signature=signature, data=data, user_id_hash=user_id_hash):
+            assert verify_pgp_signature(public_text, signature, data, user_id_hash=user_id_hash)
+
+        yield Case(f"pgp.verify[{kind},cold]", cold)
+        # Prime the cache once so every timed call is a hit
+        warm()
+        yield Case(f"pgp.verify[{kind},cached]", warm)
+        invalidate_cached_key(user_id_hash)
+
+
+def hash_cases(quick: bool = False):
+    for size in HASH_KEY_SIZES:
+        key = os.urandom(size)
+        yield Case(f"hash_recipient[key={size}B]", lambda key=key: hash_recipient(key))
+
+
+def padding_cases(quick: bool = False):
+    for scheme in ("fixed", "pow2", "padme"):
+        for size in PAD_SIZES:
+            if scheme == "fixed" and size + 4 > PADDED_MESSAGE_SIZE:
+                continue
+            payload = os.urandom(size)
+            padded = pad_message(payload, scheme)
+            yield Case(f"pad_message[{scheme},{size}B]", lambda p=payload, s=scheme: pad_message(p, s))
+            yield Case(f"unpad_message[{scheme},{size}B]", lambda p=padded: unpad_message(p))
+
+
+def aead_cases(quick: bool = False):
+    key = os.urandom(32)
+    sizes = PAYLOAD_SIZES[:3] if quick else PAYLOAD_SIZES
+    for size in sizes:
+        plaintext = os.urandom(size)
+        ciphertext = encrypt_vault_message(key, plaintext)
+        yield Case(f"encrypt_vault_message[{size}B]", lambda p=plaintext: encrypt_vault_message(key, p))
+        yield Case(f"decrypt_vault_message[{size}B]", lambda c=ciphertext: decrypt_vault_message(key, c))
+
+    # Per-peer key cache and batch path used by the clients
+    me = x25519.X25519PrivateKey.generate()
+    peer = x25519.X25519PrivateKey.generate()
+    peer_public = peer.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    context = VaultCryptoContext(me)
+    items = [(peer_public, os.urandom(256)) for _ in range(BATCH_SIZE)]
+    encrypted = context.encrypt_many(items)
+    yield Case("context.encrypt[256B]", lambda: context.encrypt(peer_public, items[0][1]))
+    yield Case(f"context.decrypt_many[{BATCH_SIZE}x256B]",
+               lambda: context.decrypt_many([(peer_public, c) for c in encrypted]), items=BATCH_SIZE)
+
+
+def all_cases(quick: bool = False):
+    yield from hash_cases(quick)
+    yield from padding_cases(quick)
+    yield from aead_cases(quick)
+    yield from pgp_cases(quick)
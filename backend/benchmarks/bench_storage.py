@@ -0,0 +1,119 @@
+# benchmarks/bench_storage.py
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, delete, text
+from sqlalchemy.orm import sessionmaker
+from benchmarks.harness import Case
+from app.core.message import store_message, fetch_messages, hash_recipient, FETCH_LIMIT_MAX
+from app.infra.postgres import Base
+from app.models.message import Message
+from app.models.mailbox_usage import MailboxUsage
+from app.models.user import User  # noqa: F401 (registers the users table)
+
+# Postgres URL of a throwaway database (tables are created if missing; only
+# rows written by the benchmark are removed). Unset: a temporary SQLite file.
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+
+STORE_PAYLOAD_SIZES = (256, 4096, 64 * 1024)
+BACKLOG_DEPTHS = (1, 100, 1000, 10000)
+
+# SQLite can't autoincrement the (id, expires_at) primary key that
+# partitioning needs on Postgres, so it gets a plain rowid table instead
+SQLITE_MESSAGES_DDL = """
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY,
+    recipient_hash BLOB NOT NULL,
+    sender_id VARCHAR NOT NULL,
+    ciphertext BLOB NOT NULL,
+    expires_at DATETIME NOT NULL,
+    created_at DATETIME
+)
+"""
+
+
+class BenchDatabase:
+    """Engine + sessions for one benchmark run; close() removes what the run wrote"""
+
+    def __init__(self, url: str | None = BENCH_DATABASE_URL):
+        self._tmpdir = None
+        if url is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="vaultchat-bench-")
+            url = f"sqlite:///{self._tmpdir.name}/bench.db"
+        self.engine = create_engine(url)
+        self.dialect = self.engine.dialect.name
+        self.Session = sessionmaker(bind=self.engine, autoflush=False)
+        self.recipient_hashes = set()
+
+        if self.dialect == "sqlite":
+            with self.engine.begin() as conn:
+                conn.execute(text(SQLITE_MESSAGES_DDL))
+                conn.execute(text("CREATE INDEX ix_messages_recipient_hash ON messages (recipient_hash)"))
+            MailboxUsage.__table__.create(self.engine)
+        else:
+            from app.services.expiry_reaper import is_partitioned, ensure_partitions
+            Base.metadata.create_all(bind=self.engine)
+            with self.engine.begin() as conn:
+                if is_partitioned(conn):
+                    ensure_partitions(conn)
+
+    def recipient(self) -> bytes:
+        """A fresh recipient public key whose mailbox is cleaned up on close"""
+        public_key = os.urandom(32)
+        self.recipient_hashes.add(hash_recipient(public_key))
+        return public_key
+
+    def fill(self, recipient_public_key: bytes, count: int, size: int = 256):
+        """Queue count messages for a recipient in one multi-row insert (untimed setup)"""
+        now = datetime.utcnow()
+        rows = [{
+            "recipient_hash": hash_recipient(recipient_public_key),
+            "ciphertext": os.urandom(size),
+            "sender_id": "bench",
+            "expires_at": now + timedelta(days=7),
+            "created_at": now,
+        } for _ in range(count)]
+        with self.engine.begin() as conn:
+            for start in range(0, count, 1000):
+                conn.execute(insert(Message.__table__), rows[start:start + 1000])
+
+    def close(self):
+        if self.recipient_hashes:
+            with self.engine.begin() as conn:
+                for table in (Message.__table__, MailboxUsage.__table__):
+                    conn.execute(delete(table).where(table.c.recipient_hash.in_(list(self.recipient_hashes))))
+        self.engine.dispose()
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+
+
+def storage_cases(db: BenchDatabase, quick: bool = False):
+    session = db.Session()
+
+    for size in STORE_PAYLOAD_SIZES:
+        recipient = db.recipient()
+        payload = os.urandom(size)
+        yield Case(f"store_message[{db.dialect},{size}B]", lambda r=recipient, p=payload: store_message(session, r, p, "bench"))
+
+    depths = BACKLOG_DEPTHS[:3] if quick else BACKLOG_DEPTHS
+    for depth in depths:
+        recipient = db.recipient()
+
+        def setup(recipient=recipient, depth=depth):
+            db.fill(recipient, depth)
+            return recipient
+
+        def drain(recipient, depth=depth):
+            # What a client does with a backlog: fetch pages until nothing is pending
+            fetched = 0
+            while True:
+                messages, more_pending = fetch_messages(session, recipient, FETCH_LIMIT_MAX)
+                fetched += len(messages)
+                if not more_pending:
+                    break
+            assert fetched == depth, (fetched, depth)
+
+        yield Case(f"fetch_messages[{db.dialect},backlog={depth}]", drain, setup=setup, items=depth)
+
+    session.close()
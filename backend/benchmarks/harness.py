@@ -0,0 +1,153 @@
+# benchmarks/harness.py
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import timeit
+from datetime import datetime
+
+# =========================
+# CONFIGURATION
+# =========================
+
+ROUNDS = 5                 # timed rounds per case; the median is what gets compared
+MIN_ROUND_TIME = 0.2       # seconds; autoranged cases call fn enough times to fill a round
+DEFAULT_THRESHOLD = 0.15   # flag cases more than 15% slower than the baseline
+
+
+class Case:
+    """
+    One benchmark. fn is the timed operation; setup (untimed) runs before
+    every round and its return value is passed to fn. Cases with a setup run
+    fn once per round (state is consumed); others are autoranged. items is
+    how many units one call handles, for per-message figures.
+    """
+    __slots__ = ("name", "fn", "setup", "items")
+
+    def __init__(self, name: str, fn, setup=None, items: int = 1):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.items = items
+
+
+def measure(case: Case, rounds: int = ROUNDS, min_round_time: float = MIN_ROUND_TIME) -> dict:
+    """Seconds per call (median and best round) plus per-item cost and throughput"""
+    if case.setup is None:
+        timer = timeit.Timer(case.fn)
+        number, _ = timer.autorange()
+        number = max(1, int(number * min_round_time / 0.2))
+        times = [t / number for t in timer.repeat(rounds, number)]
+    else:
+        number = 1
+        times = []
+        for _ in range(rounds):
+            state = case.setup()
+            start = time.perf_counter()
+            case.fn(state)
+            times.append(time.perf_counter() - start)
+
+    median = statistics.median(times)
+    return {
+        "median": median,
+        "min": min(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "per_item": median / case.items,
+        "items_per_sec": case.items / median if median else None,
+        "calls_per_round": number,
+        "rounds": rounds,
+    }
+
+# =========================
+# RESULTS
+# =========================
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment(database: str) -> dict:
+    """Where the numbers came from; only compare baselines from the same machine"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "database": database,
+    }
+
+
+def save(path: str, meta: dict, results: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD, metric: str = "median") -> list:
+    """
+    (name, baseline, current, ratio, status) rows. status is "regressed"
+    past 1 + threshold, "improved" below 1 - threshold, "ok" otherwise,
+    or "new"/"missing" when a case exists on one side only.
+    """
+    rows = []
+    base_results = baseline["results"]
+    current_results = current["results"]
+    for name in sorted(set(base_results) | set(current_results)):
+        if name not in base_results:
+            rows.append((name, None, current_results[name][metric], None, "new"))
+            continue
+        if name not in current_results:
+            rows.append((name, base_results[name][metric], None, None, "missing"))
+            continue
+        before = base_results[name][metric]
+        after = current_results[name][metric]
+        ratio = after / before if before else float("inf")
+        if ratio > 1 + threshold:
+            status = "regressed"
+        elif ratio < 1 - threshold:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, before, after, ratio, status))
+    return rows
+
+
+def print_results(results: dict):
+    width = max((len(name) for name in results), default=10)
+    print(f"{'case':<{width}}  {'median':>10}  {'best':>10}  {'per item':>10}")
+    for name, r in results.items():
+        print(f"{name:<{width}}  {format_seconds(r['median']):>10}  {format_seconds(r['min']):>10}  "
+              f"{format_seconds(r['per_item']):>10}")
+
+
+def print_comparison(rows: list, threshold: float):
+    width = max((len(row[0]) for row in rows), default=10)
+    markers = {"regressed": "❌", "improved": "✅", "ok": "  ", "new": "🆕", "missing": "⚠️"}
+    print(f"{'case':<{width}}  {'baseline':>10}  {'current':>10}  {'change':>8}")
+    for name, before, after, ratio, status in rows:
+        change = f"{(ratio - 1) * 100:+.1f}%" if ratio is not None else "-"
+        print(f"{markers[status]} {name:<{width}}  {format_seconds(before) if before else '-':>10}  "
+              f"{format_seconds(after) if after else '-':>10}  {change:>8}")
+    regressed = sum(1 for row in rows if row[4] == "regressed")
+    print(f"\n{regressed} regression(s) beyond {threshold:.0%}")
@@ -0,0 +1,446 @@
+# benchmarks/loadgen.py
+"""
+Scenario load generator: N simulated users in chat pairs against a real
+server, for sizing uvicorn workers and DB pools before a rollout.
+
+    python -m benchmarks.loadgen --users 200 --duration 60 --spawn --workers 4 --pool-size 10
+    python -m benchmarks.loadgen --users 50 --url http://127.0.0.1:8000
+
+Each user registers a PGP identity and looks up its partner's key. The
+first user of a pair creates a room and the second joins it. Then both
+chat until the end of the run:
+  - bursts of 1-5 messages, each preceded by a typing signal
+  - a read receipt for everything received
+  - receive polls every 2 seconds, like the app
+At the end the room is deleted. Messages go through AsyncAnonymousVaultClient,
+so padding and AES-GCM/X25519 are the real client code. Signals are
+ephemeral messages.
+
+Reports request throughput, client-side p50/p99 per endpoint, and DB pool
+saturation sampled from /metrics while the load runs.
+
+With --workers > 1 set ROOM_STORE_BACKEND=redis: the in-memory room store is
+per worker, so a join landing on another worker than the create gets a 404.
+
+Every simulated user comes from 127.0.0.1, so they would all share one set
+of per-client rate limit buckets. --spawn therefore starts the server with
+RATE_LIMIT_ENABLED=false unless --rate-limits is given. 429s are reported
+apart from errors and left out of the latency figures.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import secrets
+import string
+import subprocess
+import sys
+import time
+from collections import defaultdict
+import httpx
+from app.clients.async_anonymous_client import AsyncAnonymousVaultClient, create_http_client
+
+# =========================
+# CONFIGURATION
+# =========================
+
+POLL_INTERVAL = 2.0          # seconds between receive polls (the app's cadence)
+MEAN_THINK_TIME = 5.0        # seconds between bursts, exponentially distributed
+MAX_BURST = 5
+TYPING_LEAD = 0.3            # seconds between the typing signal and the message
+METRICS_INTERVAL = 1.0       # /metrics scrape period
+SERVER_START_TIMEOUT = 30.0
+
+# Request paths -> route templates, so per-endpoint stats don't split by room code
+_ROUTE_PATTERNS = [
+    (re.compile(r"^/rooms/[^/]+/leave$"), "/rooms/{room_code}/leave"),
+    (re.compile(r"^/rooms/(?!create$|join$)[^/]+$"), "/rooms/{room_code}"),
+    (re.compile(r"^/users/[^/]+/public-key$"), "/users/{user_id}/public-key"),
+]
+
+
+def route_of(path: str) -> str:
+    for pattern, template in _ROUTE_PATTERNS:
+        if pattern.match(path):
+            return template
+    return path
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+# =========================
+# CLIENT-SIDE RECORDING
+# =========================
+
+class Recorder:
+    """Latency and status per endpoint, fed by httpx event hooks on the shared transport"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rate_limited = defaultdict(int)
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.signals_sent = 0
+
+    def install(self, http: httpx.AsyncClient):
+        async def on_request(request):
+            request.extensions["loadgen_start"] = time.perf_counter()
+
+        async def on_response(response):
+            start = response.request.extensions.get("loadgen_start")
+            if start is None or response.request.url.path == "/metrics":
+                return
+            # Headers are in; long-poll and streaming bodies are small here
+            key = f"{response.request.method} {route_of(response.request.url.path)}"
+            if response.status_code == 429:
+                # Rejected before doing any work: not a latency sample or an error
+                self.rate_limited[key] += 1
+                return
+            self.latencies[key].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                self.errors[f"{key} {response.status_code}"] += 1
+
+        http.event_hooks["request"].append(on_request)
+        http.event_hooks["response"].append(on_response)
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for key, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[key] = {
+                "count": len(values),
+                "rps": len(values) / elapsed,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "elapsed_s": elapsed,
+            "requests": total,
+            "requests_per_s": total / elapsed,
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+            "signals_sent": self.signals_sent,
+            "endpoints": endpoints,
+            "errors": dict(self.errors),
+            "rate_limited": dict(self.rate_limited),
+        }
+
+# =========================
+# SERVER-SIDE SATURATION
+# =========================
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{([^}]*)\})? (\S+)$')
+
+
+def parse_metrics(text: str) -> dict:
+    """(name, labels string) -> value, for the few series we look at"""
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+class PoolMonitor:
+    """
+    Samples the async pool gauges and checkout-wait histogram from /metrics.
+    With several workers each scrape lands on one of them; counters are
+    tracked per worker (first sample is the baseline) and summed.
+    """
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+        self.checked_out = []
+        self.overflow_max = None
+        self.pool_size = None
+        self._first = {}
+        self._last = {}
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                # New connection per scrape, so samples spread over all workers
+                resp = await self.http.get("/metrics", headers={"Connection": "close"})
+                self._record(parse_metrics(resp.text))
+            except (httpx.HTTPError, ValueError):
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), METRICS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _record(self, samples: dict):
+        pool = 'pool="async"'
+        worker = next((labels for name, labels in samples if name == "vaultchat_worker_info"), "")
+        checked_out = samples.get(("vaultchat_db_pool_checked_out", pool))
+        if checked_out is not None:
+            self.checked_out.append(checked_out)
+        overflow = samples.get(("vaultchat_db_pool_overflow", pool))
+        if overflow is not None:
+            self.overflow_max = overflow if self.overflow_max is None else max(self.overflow_max, overflow)
+        self.pool_size = samples.get(("vaultchat_db_pool_size", pool), self.pool_size)
+
+        counters = {
+            "count": samples.get(("vaultchat_db_pool_checkout_seconds_count", pool), 0.0),
+            "sum": samples.get(("vaultchat_db_pool_checkout_seconds_sum", pool), 0.0),
+            # Checkouts that took 10ms or less
+            "fast": samples.get(("vaultchat_db_pool_checkout_seconds_bucket", f'{pool},le="0.01"'), 0.0),
+        }
+        self._first.setdefault(worker, counters)
+        self._last[worker] = counters
+
+    def summary(self) -> dict:
+        delta = {
+            field: sum(self._last[w][field] - self._first[w][field] for w in self._last)
+            for field in ("count", "sum", "fast")
+        }
+        return {
+            "workers_seen": len(self._last),
+            "pool_size": self.pool_size,
+            "checked_out_mean": sum(self.checked_out) / len(self.checked_out) if self.checked_out else None,
+            "checked_out_max": max(self.checked_out) if self.checked_out else None,
+            # > 0 means the pool grew past pool_size at some point
+            "overflow_max": self.overflow_max,
+            "checkouts": int(delta["count"]),
+            "checkout_wait_mean_ms": delta["sum"] / delta["count"] * 1000 if delta["count"] else None,
+            "checkouts_over_10ms_pct": (1 - delta["fast"] / delta["count"]) * 100 if delta["count"] else None,
+        }
+
+# =========================
+# SCENARIO
+# =========================
+
+def _text(rng: random.Random) -> str:
+    # Mostly short chat lines, now and then a long paragraph
+    length = min(4000, max(1, int(rng.lognormvariate(3.5, 1.0))))
+    return "".join(rng.choices(string.ascii_letters + " ", k=length))
+
+
+async def user_session(me: AsyncAnonymousVaultClient, partner: AsyncAnonymousVaultClient, creates_room: bool,
+                       room_code: str, deadline: float, recorder: Recorder, rng: random.Random):
+    """One user's side of a conversation, from room setup until the deadline (already registered)"""
+    http = me.http
+
+    # Partner's identity key, as the app fetches it before chatting
+    await http.get(f"/users/{partner.user_id}/public-key")
+    if creates_room:
+        await http.post("/rooms/create", json={"user1_id": me.user_id, "user2_id": partner.user_id, "room_code": room_code})
+    else:
+        # Give the creator a moment, as a human would
+        await asyncio.sleep(rng.uniform(0.2, 1.0))
+        await http.post("/rooms/join", json={"user1_id": partner.user_id, "user2_id": me.user_id, "room_code": room_code})
+
+    partner_keys = {partner.user_id: partner.public_key_bytes}
+
+    async def poll():
+        # Offset polls so users don't all hit the server on the same tick
+        await asyncio.sleep(rng.uniform(0, POLL_INTERVAL))
+        while time.monotonic() < deadline:
+            try:
+                received = await me.fetch_messages(partner_keys)
+            except httpx.HTTPError:
+                received = []
+            chat = [m for m in received if not m["message"].startswith("__")]
+            recorder.messages_received += len(chat)
+            if chat:
+                recorder.signals_sent += 1
+                await me.send_message(partner.user_id, partner.public_key_bytes, f"__read__:{len(chat)}", ephemeral=True)
+            await asyncio.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+    async def chat():
+        while True:
+            await asyncio.sleep(min(rng.expovariate(1 / MEAN_THINK_TIME), max(0.0, deadline - time.monotonic())))
+            if time.monotonic() >= deadline:
+                return
+            for _ in range(rng.randint(1, MAX_BURST)):
+                try:
+                    recorder.signals_sent += 1
+                    await me.send_message(partner.user_id, partner.public_key_bytes, "__typing__", ephemeral=True)
+                    await asyncio.sleep(TYPING_LEAD)
+                    await me.send_message(partner.user_id, partner.public_key_bytes, _text(rng))
+                    recorder.messages_sent += 1
+                except httpx.HTTPError:
+                    pass
+
+    await asyncio.gather(poll(), chat())
+
+    if creates_room:
+        await http.delete(f"/rooms/{room_code}", params={"user_id": me.user_id})
+
+
+async def run_load(args) -> dict:
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    async with create_http_client(args.url, max_connections=args.connections) as http, \
+            create_http_client(args.url, max_connections=1) as metrics_http:
+        recorder.install(http)
+        tag = secrets.token_hex(3)
+        users = [
+            AsyncAnonymousVaultClient(f"load{tag}_{i}", http_client=http, enable_delays=args.delays,
+                                      binary_transport=args.binary)
+            for i in range(args.users - args.users % 2)
+        ]
+        print(f"👥 {len(users)} users, {args.duration}s against {args.url}", file=sys.stderr)
+
+        # Registration (PGP signing and verification) happens before the measured window
+        await asyncio.gather(*(user.register_public_key() for user in users))
+        recorder.latencies.clear()
+        recorder.errors.clear()
+
+        stop = asyncio.Event()
+        monitor = PoolMonitor(metrics_http)
+        monitor_task = asyncio.create_task(monitor.run(stop))
+
+        start = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        sessions = []
+        for i in range(0, len(users), 2):
+            code = secrets.token_hex(4).upper()
+            for me, partner, creates in ((users[i], users[i + 1], True), (users[i + 1], users[i], False)):
+                sessions.append(user_session(me, partner, creates, code, deadline, recorder, random.Random(rng.random())))
+        results = await asyncio.gather(*sessions, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await monitor_task
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    for failure in failures[:5]:
+        print(f"⚠️ session failed: {failure!r}", file=sys.stderr)
+    summary = recorder.summary(elapsed)
+    summary["failed_sessions"] = len(failures)
+    summary["db_pool"] = monitor.summary()
+    return summary
+
+# =========================
+# LOCAL SERVER
+# =========================
+
+def spawn_server(args) -> subprocess.Popen:
+    """uvicorn app.main:app on args.port with the pool/worker settings under test"""
+    env = dict(os.environ)
+    # Workers must share the token secret, or sessions only work on the worker that issued them
+    env.setdefault("SESSION_TOKEN_SECRET", secrets.token_hex(32))
+    if args.pool_size is not None:
+        env["DB_ASYNC_POOL_SIZE"] = str(args.pool_size)
+    if args.max_overflow is not None:
+        env["DB_ASYNC_MAX_OVERFLOW"] = str(args.max_overflow)
+    # All users share 127.0.0.1, i.e. one set of buckets
+    if not args.rate_limits:
+        env["RATE_LIMIT_ENABLED"] = "false"
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=backend_dir, env=env, stdout=subprocess.DEVNULL
+    )
+
+
+def wait_for_server(url: str, process: subprocess.Popen | None):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Server at {url} not healthy after {SERVER_START_TIMEOUT}s")
+
+# =========================
+# REPORT
+# =========================
+
+def print_report(summary: dict):
+    print(f"\n⏱️  {summary['elapsed_s']:.1f}s, {summary['requests']} requests "
+          f"({summary['requests_per_s']:.1f}/s), {summary['messages_sent']} messages sent, "
+          f"{summary['messages_received']} received, {summary['signals_sent']} signals, "
+          f"{summary['failed_sessions']} failed sessions\n")
+
+    endpoints = summary["endpoints"]
+    width = max((len(key) for key in endpoints), default=10)
+    print(f"{'endpoint':<{width}}  {'count':>7}  {'req/s':>7}  {'p50 ms':>8}  {'p99 ms':>8}  {'max ms':>8}")
+    for key, e in endpoints.items():
+        print(f"{key:<{width}}  {e['count']:>7}  {e['rps']:>7.1f}  {e['p50_ms']:>8.1f}  {e['p99_ms']:>8.1f}  {e['max_ms']:>8.1f}")
+
+    if summary["errors"]:
+        print("\n❌ Errors:")
+        for key, count in sorted(summary["errors"].items()):
+            print(f"   {key}: {count}")
+
+    if summary["rate_limited"]:
+        print("\n🚦 Rate limited (429, all users share one client address):")
+        for key, count in sorted(summary["rate_limited"].items()):
+            print(f"   {key}: {count}")
+
+    pool = summary["db_pool"]
+    print("\n🗄️  Async DB pool (per worker)")
+    if not pool["workers_seen"]:
+        print("   no /metrics samples")
+        return
+    for key, value in pool.items():
+        print(f"   {key}: {round(value, 2) if isinstance(value, float) else value}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadgen", description="VaultChat scenario load generator")
+    parser.add_argument("--users", type=int, default=20, help="simulated users (paired up, so rounded down to even)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of chatting after registration")
+    parser.add_argument("--url", help="server to target (default: the one started with --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="start uvicorn app.main:app locally for the run")
+    parser.add_argument("--port", type=int, default=8765, help="port for --spawn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --spawn")
+    parser.add_argument("--pool-size", type=int, help="DB_ASYNC_POOL_SIZE for --spawn")
+    parser.add_argument("--max-overflow", type=int, help="DB_ASYNC_MAX_OVERFLOW for --spawn")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the server's per-client rate limits on for --spawn")
+    parser.add_argument("--connections", type=int, default=100, help="client keep-alive connections")
+    parser.add_argument("--delays", action="store_true", help="keep the client's random send delays")
+    parser.add_argument("--binary", action="store_true", help="use the raw-bytes send/receive endpoints")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", metavar="PATH", help="also write the summary as JSON")
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+    if not args.spawn and not args.url:
+        parser.error("give --url or --spawn")
+
+    process = None
+    if args.spawn:
+        args.url = args.url or f"http://127.0.0.1:{args.port}"
+        process = spawn_server(args)
+    try:
+        wait_for_server(args.url, process)
+        summary = asyncio.run(run_load(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    summary["config"] = {
+        key: getattr(args, key)
+        for key in ("users", "duration", "workers", "pool_size", "max_overflow", "rate_limits", "connections", "delays", "binary")
+    }
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["failed_sessions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
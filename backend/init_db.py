@@ -3,6 +3,9 @@
 from app.infra.postgres import Base, engine
 from app.models.user import User
 from app.models.message import Message
+from app.models.mailbox_usage import MailboxUsage
+from app.core.message import rebuild_mailbox_usage
+from app.services.expiry_reaper import is_partitioned, ensure_partitions
 
 def init_db():
     """Drop and recreate all tables"""
@@ -12,6 +15,14 @@ def init_db():
     
     print("📦 Creating tables...")
     Base.metadata.create_all(bind=engine)
+
+    # messages is partitioned by expiry day; create the upcoming partitions
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            created = ensure_partitions(conn)
+            print(f"📅 Created {len(created)} message partitions")
+        # Quota counters start out matching the (empty) messages table
+        rebuild_mailbox_usage(conn)
     print("✅ Database initialized successfully!")
     
     # Print created tables